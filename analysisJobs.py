@@ -0,0 +1,462 @@
+"""
+Runs analyses in the background so the script thread is not blocked:
+    - Submitting analyses to a shared thread pool, bounded per server and per session
+    - Running the CPU heavy steps in worker processes, with the data passed as arrow
+    - Reporting the progress and partial results of running analyses
+    - Caching the finished reports in the results cache
+"""
+
+import os
+import logging
+import uuid
+import queue
+import itertools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+import pyarrow as pa
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from analysisResults import get_results_cache
+from performanceMonitor import monitor
+
+# failed analyses are logged with their traceback
+logger = logging.getLogger(__name__)
+
+# analyses that run at the same time, shared by all sessions (one worker process each)
+ANALYSIS_WORKERS = min(os.cpu_count() or 1, 4)
+
+# analyses running or waiting for a worker before new ones are turned away
+MAX_QUEUED_JOBS = 4 * ANALYSIS_WORKERS
+
+# analyses one session can have running or waiting
+MAX_SESSION_JOBS = 2
+
+# how often a running analysis is checked for progress
+JOB_POLL_INTERVAL_S = 0.5
+
+# finished jobs kept so their results and errors can be shown after reruns
+MAX_JOBS = 16
+
+
+def to_arrow(series):
+    """
+    Serializes a series (with its datetime index) as an arrow IPC stream
+
+    Returns: bytes
+    """
+
+    table = pa.Table.from_pandas(series.to_frame())
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def from_arrow(data):
+    """
+    Reads a series written by to_arrow
+
+    Returns: pandas series
+    """
+
+    table = pa.ipc.open_stream(data).read_all()
+
+    return table.to_pandas().iloc[:, 0]
+
+
+class WorkerProgress:
+    """
+    Stands in for the report in a worker process, the progress goes back to the server through a queue.
+    """
+
+    def __init__(self, progress):
+        """
+        Inputs:
+        - progress: queue from AnalysisPool.manager
+
+        Returns: none
+        """
+
+        self.progress = progress
+
+    def set_progress(self, fraction=None, stage=None):
+        self.progress.put((fraction, stage))
+
+
+def _find_ideal_grouping(data, progress=None):
+    """
+    Runs find_ideal_grouping in a worker process
+
+    Inputs:
+    - data: series serialized by to_arrow
+    - progress: queue the progress is put in, or None
+
+    Returns: grouped series serialized by to_arrow
+    """
+
+    # imported in the worker, the app modules are not needed to start the pool
+    from dataHandling import DataAnalysisTools
+
+    display = WorkerProgress(progress) if progress is not None else None
+    grouped = DataAnalysisTools(display=display).find_ideal_grouping(from_arrow(data))
+
+    return to_arrow(grouped)
+
+
+class AnalysisPool:
+    """
+    Worker processes shared by all sessions for the CPU heavy analysis steps, so they run on every core
+    instead of waiting for the GIL of the server process.
+    """
+
+    def __init__(self, max_workers=ANALYSIS_WORKERS):
+        """
+        Inputs:
+        - max_workers: number of worker processes
+
+        Returns: none
+        """
+
+        self.max_workers = max_workers
+        self._executor = None
+        self._manager = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """
+        Process pool, started the first time it is used
+        """
+
+        with self._lock:
+            if self._executor is None:
+                # the server has threads running, forking it is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+
+        return self._executor
+
+    @property
+    def manager(self):
+        """
+        Process holding the queues the workers report their progress to, started the first time it is used
+        """
+
+        with self._lock:
+            if self._manager is None:
+                self._manager = multiprocessing.get_context("spawn").Manager()
+
+        return self._manager
+
+    def find_ideal_grouping(self, audit_series, set_progress=None):
+        """
+        Runs DataAnalysisTools.find_ideal_grouping in a worker process
+
+        Inputs:
+        - audit_series: series
+        - set_progress: AnalysisReport.set_progress the progress of the worker is passed on to, or None
+
+        Returns: series of the ideal grouping
+        """
+
+        with monitor.span("grouping.worker", rows=len(audit_series)):
+            progress = self.manager.Queue() if set_progress is not None else None
+            data = self.executor.submit(
+                _find_ideal_grouping, to_arrow(audit_series), progress
+            )
+
+            # pass on the points removed so far while the worker runs
+            while progress is not None and not data.done():
+                wait([data], timeout=JOB_POLL_INTERVAL_S)
+                self._forward_progress(progress, set_progress)
+
+            return from_arrow(data.result())
+
+    def _forward_progress(self, progress, set_progress):
+        """
+        Passes the progress a worker queued on to set_progress
+        """
+
+        while True:
+            try:
+                fraction, stage = progress.get_nowait()
+            except queue.Empty:
+                return
+            set_progress(fraction, stage)
+
+    def find_ideal_groupings(
+        self, audit_series_list, set_progress=None, progress=(0, 1)
+    ):
+        """
+        Runs find_ideal_grouping on several series at once, one worker process each.
+
+        At most max_workers series of a batch are in the pool at a time, the groupings of other sessions queue
+        behind those instead of behind the whole batch.
+
+        Inputs:
+        - audit_series_list: list of series
+        - set_progress: AnalysisReport.set_progress to report the finished groupings to, or None
+        - progress: fractions of the analysis done before and after the groupings
+
+        Returns: list of series of the ideal groupings, in the same order
+        """
+
+        with monitor.span("grouping.workers", series=len(audit_series_list)):
+            groupings = [None] * len(audit_series_list)
+            waiting = iter(enumerate(audit_series_list))
+            running = {}
+            finished = 0
+            while True:
+                for number, audit_series in itertools.islice(
+                    waiting, self.max_workers - len(running)
+                ):
+                    future = self.executor.submit(
+                        _find_ideal_grouping, to_arrow(audit_series)
+                    )
+                    running[future] = number
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    groupings[running.pop(future)] = from_arrow(future.result())
+                finished += len(done)
+
+                if set_progress is not None:
+                    set_progress(
+                        progress[0]
+                        + (progress[1] - progress[0]) * finished / len(groupings),
+                        f"Found {finished} of {len(groupings)} ideal groupings",
+                    )
+
+            return groupings
+
+
+class AnalysisJob:
+    """
+    An analysis running in the background, its report fills up as the analysis goes.
+    """
+
+    def __init__(self, key, report, session=None):
+        """
+        Inputs:
+        - key: results cache key of the analysis
+        - report: AnalysisReport the analysis records to
+        - session: id of the streamlit session that submitted it
+
+        Returns: none
+        """
+
+        self.id = uuid.uuid4().hex[:8]
+        self.key = key
+        self.report = report
+        self.session = session
+        self.status = "queued"
+        self.error = None
+        self.future = None
+
+    def done(self):
+        return self.status in ["finished", "failed"]
+
+    def rejected(self):
+        """
+        True if the job was turned away by the server or session limit and never ran
+        """
+
+        return self.status == "failed" and self.future is None
+
+    def fail(self, error):
+        """
+        Marks the job as failed
+
+        Inputs:
+        - error: exception or message shown in place of the analysis
+        """
+
+        self.error = error
+        self.status = "failed"
+
+    def show(self):
+        """
+        Displays the progress and what the analysis recorded so far
+        """
+
+        if self.status == "failed":
+            st.error(f"Analysis {self.id} failed: {self.error}")
+        elif self.status != "finished":
+            st.progress(
+                min(max(self.report.progress, 0.0), 1.0),
+                text=f"{self.report.stage} (job {self.id})",
+            )
+
+        # copy, the worker may add items while they are displayed
+        for name, args, kwargs in list(self.report.items):
+            getattr(st, name)(*args, **kwargs)
+
+
+class AnalysisJobs:
+    """
+    Thread pool that runs the analyses of all sessions, one job per results cache key.
+    """
+
+    def __init__(self, results_cache, max_workers=ANALYSIS_WORKERS):
+        """
+        Inputs:
+        - results_cache: AnalysisResultsCache the finished reports are put in
+        - max_workers: analyses that run at the same time
+
+        Returns: none
+        """
+
+        self.results_cache = results_cache
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="analysis"
+        )
+        # the threads mostly wait on the worker processes
+        self.pool = AnalysisPool(max_workers)
+        self._jobs = OrderedDict()
+
+        # shared by all sessions
+        self._lock = threading.Lock()
+
+    def submitter(self, key):
+        """
+        Builds the function an analysis uses to run in the background.
+
+        Inputs:
+        - key: results cache key of the analysis
+
+        Returns: function(report, function, *args) that returns the AnalysisJob
+        """
+
+        # the session is only known in the script thread
+        context = get_script_run_ctx()
+        session = context.session_id if context is not None else None
+
+        def submit(report, function, *args):
+            return self.submit(key, report, function, *args, session=session)
+
+        return submit
+
+    def submit(self, key, report, function, *args, session=None):
+        """
+        Runs function(*args) in the background, unless the same analysis is already running.
+
+        Analyses past the server or session limit are not run, their job fails right away.
+
+        Inputs:
+        - key: results cache key of the analysis
+        - report: AnalysisReport the function records to
+        - function: the analysis
+        - args: inputs of the analysis
+        - session: id of the streamlit session submitting it
+
+        Returns: AnalysisJob
+        """
+
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not job.done():
+                return job
+
+            job = AnalysisJob(key, report, session)
+            self._jobs[key] = job
+            self._jobs.move_to_end(key)
+
+            active = [old_job for old_job in self._jobs.values() if not old_job.done()]
+            if len(active) > MAX_QUEUED_JOBS:
+                job.fail("the server is busy, try again in a moment")
+            elif (
+                session is not None
+                and sum(old_job.session == session for old_job in active)
+                > MAX_SESSION_JOBS
+            ):
+                job.fail(
+                    f"wait for one of your {MAX_SESSION_JOBS} running analyses to finish"
+                )
+
+            # forget the oldest finished jobs
+            finished = [old for old, old_job in self._jobs.items() if old_job.done()]
+            for old in finished[: max(len(self._jobs) - MAX_JOBS, 0)]:
+                del self._jobs[old]
+
+            if not job.done():
+                job.future = self._executor.submit(self._run, job, function, *args)
+
+        return job
+
+    def _run(self, job, function, *args):
+        """
+        Runs an analysis in a worker thread and caches its report
+        """
+
+        # the spans of the job go to the performance log
+        monitor.start_run()
+        job.status = "running"
+        try:
+            function(*args)
+        except Exception as error:
+            logger.exception("analysis job %s failed", job.id)
+            job.fail(error)
+            return
+
+        job.report.set_progress(1.0, "Done")
+        job.report.complete = True
+        self.results_cache.put(job.key, job.report)
+        job.status = "finished"
+
+    def get(self, key):
+        """
+        Returns the job of key, or None
+        """
+
+        with self._lock:
+            return self._jobs.get(key)
+
+    def display(self, key, dataset_hash):
+        """
+        Shows the job of key if it belongs to the current dataset, polling it until it is done.
+
+        Returns: True if the job was displayed
+        """
+
+        if key is None or key[0] != dataset_hash:
+            return False
+
+        job = self.get(key)
+        if job is None:
+            return False
+
+        if job.done():
+            job.show()
+            return True
+
+        @st.fragment(run_every=JOB_POLL_INTERVAL_S)
+        def poll():
+            if job.done():
+                # show the finished analysis in a full rerun, so the polling stops
+                st.rerun()
+            job.show()
+
+        poll()
+
+        return True
+
+
+@st.cache_resource
+def get_analysis_jobs():
+    """
+    Returns the analysis thread pool shared by all sessions
+    """
+
+    return AnalysisJobs(get_results_cache())
@@ -0,0 +1,174 @@
+"""
+Keeps the output of analyses so they can be displayed again without recomputing:
+    - Recording what an analysis displays
+    - Caching recorded analyses across reruns
+"""
+
+import threading
+from collections import OrderedDict
+import streamlit as st
+
+
+class AnalysisReport:
+    """
+    Records everything an analysis displays so it can be replayed later.
+
+    Has the same display functions as streamlit, so it can be passed anywhere `st` is used to display.
+    """
+
+    def __init__(self, live=True):
+        """
+        Inputs:
+        - live: also display the items as they are recorded
+
+        Returns: none
+        """
+
+        self.items = []
+        self.live = live
+        self.complete = False
+
+        # how far the analysis is, shown while it runs in the background
+        self.progress = 0.0
+        self.stage = "Queued"
+
+    def write(self, *args, **kwargs):
+        self._add("write", args, kwargs)
+
+    def markdown(self, *args, **kwargs):
+        self._add("markdown", args, kwargs)
+
+    def info(self, *args, **kwargs):
+        self._add("info", args, kwargs)
+
+    def dataframe(self, *args, **kwargs):
+        self._add("dataframe", args, kwargs)
+
+    def pyplot(self, *args, **kwargs):
+        self._add("pyplot", args, kwargs)
+
+    def download_button(self, *args, **kwargs):
+        self._add("download_button", args, kwargs)
+
+    def set_progress(self, fraction=None, stage=None):
+        """
+        Records how far the analysis is, not replayed
+
+        Inputs:
+        - fraction: 0 to 1, None to keep the last value
+        - stage: what the analysis is doing, None to keep the last value
+        """
+
+        if fraction is not None:
+            self.progress = fraction
+        if stage is not None:
+            self.stage = stage
+
+    def _add(self, name, args, kwargs):
+        """
+        Saves a display call and shows it if the report is live
+        """
+
+        self.items.append((name, args, kwargs))
+
+        if self.live:
+            getattr(st, name)(*args, **kwargs)
+
+    def replay(self):
+        """
+        Displays all recorded items again
+        """
+
+        for name, args, kwargs in self.items:
+            getattr(st, name)(*args, **kwargs)
+
+
+class AnalysisResultsCache:
+    """
+    Bounded cache of completed analysis reports, least recently used are evicted first.
+
+    Keys are built from the dataset hash, the audit type and the inputs of the analysis.
+    """
+
+    def __init__(self, max_entries=32):
+        """
+        Inputs:
+        - max_entries: number of reports kept before the least recently used is dropped
+
+        Returns: none
+        """
+
+        self.max_entries = max_entries
+        self._reports = OrderedDict()
+
+        # shared by all sessions
+        self._lock = threading.Lock()
+
+    def make_key(self, dataset_hash, audit_type, *inputs):
+        """
+        Builds the cache key for an analysis.
+
+        Inputs:
+        - dataset_hash: hash of the uploaded data
+        - audit_type: 'zero', 'cal', 'mdl', 'imet'
+        - inputs: everything else the analysis depends on (times, compound, params)
+
+        Returns: tuple key
+        """
+
+        return (dataset_hash, audit_type) + tuple(inputs)
+
+    def get(self, key):
+        """
+        Returns the cached report for key, or None
+        """
+
+        with self._lock:
+            report = self._reports.get(key)
+            if report is not None:
+                self._reports.move_to_end(key)
+
+        return report
+
+    def put(self, key, report):
+        """
+        Caches a report if the analysis finished
+        """
+
+        if not report.complete:
+            return
+
+        with self._lock:
+            self._reports[key] = report
+            self._reports.move_to_end(key)
+
+            # drop least recently used reports
+            while len(self._reports) > self.max_entries:
+                self._reports.popitem(last=False)
+
+    def redisplay(self, key, dataset_hash):
+        """
+        Replays a cached report if it belongs to the current dataset.
+
+        Returns: True if the report was displayed
+        """
+
+        if key is None or key[0] != dataset_hash:
+            return False
+
+        report = self.get(key)
+        if report is None:
+            return False
+
+        report.replay()
+
+        return True
+
+
+@st.cache_resource
+def get_results_cache():
+    """
+    Returns the results cache shared by all sessions
+    """
+
+    return AnalysisResultsCache()
@@ -5,16 +5,83 @@ Code for the analysis of the audit data
 import streamlit as st
 import numpy as np
 import pandas as pd
-import geopandas as gpd
-import scipy.stats as stats
-from pyproj import CRS
-from dataHandling import DataAnalysisTools, FlagData
+from dataHandling import DataAnalysisTools, FlagData, to_float64, time_rows
 from dataVisualization import DataVisualization
+from analysisResults import AnalysisReport
+from performanceMonitor import monitor
 
+# minutes of the MDL time averaging choices
+TIME_BINS = {
+    "None": None,
+    "1 minute": 1,
+    "5 minutes": 5,
+}
 
-class ZeroAirAnalysis:
+
+class AuditAnalysis:
+    """
+    Base of the audit analyses: sets up the report and runs, submits or replays the analysis
+    """
+
+    def __init__(self, report=None, background=None, pool=None):
+        """
+        Inputs:
+        - report: AnalysisReport of a previous run to redisplay instead of recomputing
+        - background: function from AnalysisJobs.submitter to run the analysis in, None to run it here
+        - pool: AnalysisPool the groupings run in, None to run them in this process
+        """
+
+        # record the output so it can be redisplayed from the results cache
+        self.report = (
+            AnalysisReport(live=background is None) if report is None else report
+        )
+        self.analysis_tools = DataAnalysisTools(display=self.report, pool=pool)
+        self.plot = DataVisualization(display=self.report)
+        self.job = None
+
+    def run(self, background, display_data, analysis, *data):
+        """
+        Replays the report if it is complete, else runs the analysis (in the background if given), then flags
+
+        Inputs:
+        - background: function from AnalysisJobs.submitter, None to run the analysis here
+        - display_data: the complete dataset that is updated with flags
+        - analysis: method that fills the report
+        - data: arguments of the analysis
+        """
+
+        if self.report.complete:
+            self.report.replay()
+        elif background is not None:
+            self.job = background(self.report, analysis, *data)
+        else:
+            analysis(*data)
+            self.report.complete = True
+
+        # flag the display data (and update state), unless the server turned the analysis away
+        if self.job is None or not self.job.rejected():
+            self.flag(display_data)
+
+    def flag(self, display_data):
+        """
+        Flags the audited window of display_data
+        """
+
+        raise NotImplementedError
+
+
+class ZeroAirAnalysis(AuditAnalysis):
     def __init__(
-        self, start_time, end_time, audit_date, compound, analysis_data, display_data
+        self,
+        start_time,
+        end_time,
+        audit_date,
+        compound,
+        analysis_data,
+        display_data,
+        report=None,
+        background=None,
+        pool=None,
     ):
         """
         Inputs:
@@ -24,12 +91,14 @@ class ZeroAirAnalysis:
         - compound: compround for analysis
         - analysis_data: data to be used in the analysis
         - display_data: the complete dataset that is updated with flags
+        - report: AnalysisReport of a previous run to redisplay instead of recomputing
+        - background: function from AnalysisJobs.submitter to run the analysis in, None to run it here
+        - pool: AnalysisPool the grouping runs in, None to run it in this process
 
         Returns: none, updates display data
         """
 
-        self.analysis_tools = DataAnalysisTools()
-        self.plot = DataVisualization()
+        super().__init__(report, background, pool)
 
         # convert times to datetimes
         self.start_time = self.analysis_tools.localize_time_inputs(
@@ -39,37 +108,52 @@ class ZeroAirAnalysis:
 
         self.compound = compound
 
-        # flag the display data (and update state)
-        FlagData(display_data, self.start_time, self.end_time, type="zero")
+        self.run(background, display_data, self.zero_air_analysis, analysis_data)
 
-        self.zero_air_analysis(analysis_data)
+    def flag(self, display_data):
+        """
+        Flags the zero air window
+        """
 
+        FlagData(
+            display_data,
+            self.start_time,
+            self.end_time,
+            type="zero",
+            parameters={"compound": self.compound},
+        )
+
+    @monitor.timed("analysis.zero")
     def zero_air_analysis(self, analysis_data):
         """
         Perform analysis
         """
 
         # shorted df to the timeframe to analyze
+        self.report.set_progress(0.1, "Selecting the analysis window")
         analysis_series = self.analysis_tools.shorten_to_analysis(
             analysis_data, self.start_time, self.end_time, self.compound
         )
 
         # if there is no remaining data
         if analysis_series.empty:
-            st.write(
+            self.report.write(
                 "No data to process. Please check that there is data between the given Start Time and End Time."
             )
 
         # find ideal grouping of points
+        self.report.set_progress(0.2, "Finding the ideal grouping")
         ideal_data = self.analysis_tools.find_ideal_grouping(analysis_series)
 
         # compute basic and display basic stats
+        self.report.set_progress(0.6, "Computing statistics")
         stats = self.analysis_tools.compute_basic_stats(ideal_data)
 
         # display series of ideal data
         self.analysis_tools.display_table(ideal_data)
 
-        st.write("Plots")
+        self.report.write("Plots")
+        self.report.set_progress(0.8, "Plotting")
 
         # plot scatter of data
         self.plot.scatter_plot(
@@ -80,7 +164,7 @@ class ZeroAirAnalysis:
         self.plot.histogram_plot(ideal_data, mean=stats["Mean"])
 
 
-class CalGasAnalysis:
+class CalGasAnalysis(AuditAnalysis):
     def __init__(
         self,
         start_time,
@@ -90,6 +174,9 @@ class CalGasAnalysis:
         cal_gas_conc,
         analysis_data,
         display_data,
+        report=None,
+        background=None,
+        pool=None,
     ):
         """
         Inputs:
@@ -100,12 +187,14 @@ class CalGasAnalysis:
         - cal_gas_conc: the calibration gas concentration (int)
         - analysis_data: data to be used in the analysis
         - display_data: the complete dataset that is updated with flags
+        - report: AnalysisReport of a previous run to redisplay instead of recomputing
+        - background: function from AnalysisJobs.submitter to run the analysis in, None to run it here
+        - pool: AnalysisPool the grouping runs in, None to run it in this process
 
         Returns: none, updates display data
         """
 
-        self.analysis_tools = DataAnalysisTools()
-        self.plot = DataVisualization()
+        super().__init__(report, background, pool)
 
         # convert times to datetimes
         self.start_time = self.analysis_tools.localize_time_inputs(
@@ -116,25 +205,39 @@ class CalGasAnalysis:
         self.compound = compound
         self.cal_gas_conc = cal_gas_conc
 
-        # flag the display data (and update state)
-        FlagData(display_data, self.start_time, self.end_time, type="cal")
+        self.run(background, display_data, self.cal_analysis, analysis_data)
+
+    def flag(self, display_data):
+        """
+        Flags the calibration gas window
+        """
 
-        self.cal_analysis(analysis_data)
+        FlagData(
+            display_data,
+            self.start_time,
+            self.end_time,
+            type="cal",
+            parameters={"compound": self.compound, "concentration": self.cal_gas_conc},
+        )
 
+    @monitor.timed("analysis.cal")
     def cal_analysis(self, analysis_data):
         """
         Performs analysis
         """
 
         # shorted df to the timeframe to analyze
+        self.report.set_progress(0.1, "Selecting the analysis window")
         analysis_series = self.analysis_tools.shorten_to_analysis(
             analysis_data, self.start_time, self.end_time, self.compound
         )
 
         # find ideal grouping of points
+        self.report.set_progress(0.2, "Finding the ideal grouping")
         ideal_data = self.analysis_tools.find_ideal_grouping(analysis_series)
 
         # compute basic and display basic stats
+        self.report.set_progress(0.6, "Computing statistics")
         stats = self.analysis_tools.compute_basic_stats(ideal_data)
 
         # compute the audit stats
@@ -143,7 +246,8 @@ class CalGasAnalysis:
         # display series of ideal data
         self.analysis_tools.display_table(ideal_data)
 
-        st.write("Plots")
+        self.report.write("Plots")
+        self.report.set_progress(0.8, "Plotting")
 
         # plot scatter of data
         self.plot.scatter_plot(
@@ -154,7 +258,215 @@ class CalGasAnalysis:
         self.plot.histogram_plot(ideal_data, mean=stats["Mean"])
 
 
-class MDLCheckAnalysis:
+class MultiPointCalAnalysis(AuditAnalysis):
+    def __init__(
+        self,
+        levels,
+        audit_date,
+        compounds,
+        analysis_data,
+        display_data,
+        report=None,
+        background=None,
+        pool=None,
+    ):
+        """
+        Calibration curve from several calibration gas levels (e.g. a zero and 4-6 concentrations).
+
+        Inputs:
+        - levels: list of ('hh:mm' start time, 'hh:mm' end time, concentration) of every level
+        - audit_date: 'yyyymmdd' date of the audit
+        - compounds: list of compound headers, each gets its own curve
+        - analysis_data: data to be used in the analysis
+        - display_data: the complete dataset that is updated with flags
+        - report: AnalysisReport of a previous run to redisplay instead of recomputing
+        - background: function from AnalysisJobs.submitter to run the analysis in, None to run it here
+        - pool: AnalysisPool the groupings run in (all at once), None to run them in this process
+
+        Returns: none, updates display data
+        """
+
+        super().__init__(report, background, pool)
+
+        # convert times to datetimes
+        self.windows = [
+            (
+                self.analysis_tools.localize_time_inputs(start_time, audit_date),
+                self.analysis_tools.localize_time_inputs(end_time, audit_date),
+            )
+            for start_time, end_time, _ in levels
+        ]
+        self.concentrations = np.array([level[2] for level in levels], dtype=float)
+        self.audit_date = audit_date
+        self.compounds = compounds
+
+        self.run(background, display_data, self.curve_analysis, analysis_data)
+
+    def flag(self, display_data):
+        """
+        Flags the window of every level
+        """
+
+        for (start_time, end_time), cal_gas_conc in zip(
+            self.windows, self.concentrations
+        ):
+            FlagData(
+                display_data,
+                start_time,
+                end_time,
+                type="cal",
+                parameters={"compounds": self.compounds, "concentration": cal_gas_conc},
+            )
+
+    @monitor.timed("analysis.cal_curve")
+    def curve_analysis(self, analysis_data):
+        """
+        Performs analysis
+        """
+
+        # the level windows of every compound are grouped in one pass
+        self.report.set_progress(
+            0.1,
+            f"Finding the ideal groupings of {len(self.windows)} levels and {len(self.compounds)} compounds",
+        )
+        window_series = [
+            self.analysis_tools.shorten_to_analysis(
+                analysis_data, start_time, end_time, compound
+            )
+            for compound in self.compounds
+            for start_time, end_time in self.windows
+        ]
+        groupings = self.analysis_tools.find_ideal_groupings(
+            window_series, progress=(0.1, 0.8)
+        )
+
+        # stats of every compound (rows) and level (columns), rounded like compute_basic_stats
+        self.report.set_progress(0.8, "Fitting the calibration curves")
+        shape = (len(self.compounds), len(self.windows))
+        points = np.array([len(data) for data in groupings]).reshape(shape)
+        means = np.array([data.mean() for data in groupings]).reshape(shape)
+        stats = {
+            "Minimum": np.array([data.min() for data in groupings]).reshape(shape),
+            "Maximum": np.array([data.max() for data in groupings]).reshape(shape),
+            "Mean": means,
+            "SD": np.array([data.std() for data in groupings]).reshape(shape),
+        }
+        stats = {name: np.round(values, 3) for name, values in stats.items()}
+
+        fit = self.analysis_tools.fit_calibration(self.concentrations, means)
+        audit_stats = self.analysis_tools.audit_stat_values(
+            stats["Mean"], stats["Maximum"], stats["Minimum"], self.concentrations
+        )
+        # a zero level has no recovery
+        for name in [name for name in audit_stats if "Range" not in name]:
+            audit_stats[name] = np.where(
+                self.concentrations == 0, np.nan, audit_stats[name]
+            )
+
+        # one row per compound and level
+        curve_df = pd.DataFrame(
+            {
+                "Compound": np.repeat(self.compounds, len(self.windows)),
+                "Start": np.tile([start for start, _ in self.windows], shape[0]),
+                "End": np.tile([end for _, end in self.windows], shape[0]),
+                "Concentration": np.tile(self.concentrations, shape[0]),
+                "Points": points.ravel(),
+            }
+            | {name: values.ravel() for name, values in stats.items()}
+            | {
+                "Fitted": np.round(fit["Fitted"], 3).ravel(),
+                "Residual": np.round(fit["Residuals"], 3).ravel(),
+            }
+            | {name: values.ravel() for name, values in audit_stats.items()}
+        )
+        curves_df = pd.DataFrame(
+            {
+                "Compound": self.compounds,
+                "Slope": fit["Slope"],
+                "Intercept": fit["Intercept"],
+                "R²": fit["R²"],
+            }
+        ).round(4)
+
+        self.report.set_progress(0.9, "Plotting")
+        self.report.markdown("**Calibration Curves**")
+        self.report.dataframe(curves_df, hide_index=True, use_container_width=True)
+
+        for number, compound in enumerate(self.compounds):
+            self.report.markdown(f"**{compound}**")
+            self.report.write(
+                f"Slope = {curves_df['Slope'][number]}, Intercept = {curves_df['Intercept'][number]}, "
+                f"R² = {curves_df['R²'][number]}"
+            )
+            self.report.dataframe(
+                curve_df[curve_df["Compound"] == compound].drop(columns="Compound"),
+                hide_index=True,
+                use_container_width=True,
+            )
+            self.plot.calibration_plot(
+                self.concentrations,
+                means[number],
+                fit["Slope"][number],
+                fit["Intercept"][number],
+                compound,
+            )
+
+        self.report.download_button(
+            "Download Calibration Table",
+            curve_df.to_csv(index=False).encode("utf-8"),
+            f"{self.audit_date}_calibration_curve.csv",
+            key="download-calibration-curve",
+        )
+
+
+class MDLAnalysis(AuditAnalysis):
+    """
+    Base of the MDL checks: the spike and blank windows and the time averaging
+    """
+
+    def set_windows(
+        self, spike_start, spike_end, blank_start, blank_end, time_averaging, audit_date
+    ):
+        """
+        Inputs:
+        - spike_start: start time for spike
+        - spike_end: end time for spike
+        - blank_start: start time for blank
+        - blank_end: end time for blank
+        - time_averaging: time bin averaging for the analysis, a key of TIME_BINS
+        - audit_date: 'yyyymmdd'
+        """
+
+        # convert times to datetimes
+        self.spike_start = self.analysis_tools.localize_time_inputs(
+            spike_start, audit_date
+        )
+        self.spike_end = self.analysis_tools.localize_time_inputs(spike_end, audit_date)
+        self.blank_start = self.analysis_tools.localize_time_inputs(
+            blank_start, audit_date
+        )
+        self.blank_end = self.analysis_tools.localize_time_inputs(blank_end, audit_date)
+        self.time_averaging = TIME_BINS[time_averaging]
+        self.time_averaging_label = time_averaging
+
+    def time_average(self, analysis_data, data, compound):
+        """
+        Re-shortens the data to its ideal grouping and averages it into time bins, if time averaging was picked
+
+        Returns: series
+        """
+
+        if self.time_averaging is None or len(data) == 0:
+            return data
+
+        data = self.analysis_tools.shorten_to_analysis(
+            analysis_data, data.index[0], data.index[-1], compound
+        )
+        # group data into x minute long averages
+        return data.resample(f"{self.time_averaging}min").mean()
+
+
+class MDLCheckAnalysis(MDLAnalysis):
     def __init__(
         self,
         spike_start,
@@ -166,6 +478,9 @@ class MDLCheckAnalysis:
         compound,
         analysis_data,
         display_data,
+        report=None,
+        background=None,
+        pool=None,
     ):
         """
         Inputs:
@@ -178,26 +493,15 @@ class MDLCheckAnalysis:
         - compound: compound header strv
         - analysis_data: df to be used in analydid
         - display_data: df that is updated with flags
+        - report: AnalysisReport of a previous run to redisplay instead of recomputing
+        - background: function from AnalysisJobs.submitter to run the analysis in, None to run it here
+        - pool: AnalysisPool the grouping runs in, None to run it in this process
         """
-        self.analysis_tools = DataAnalysisTools()
-        self.plot = DataVisualization()
-
-        # convert times to datetimes
-        self.spike_start = self.analysis_tools.localize_time_inputs(
-            spike_start, audit_date
-        )
-        self.spike_end = self.analysis_tools.localize_time_inputs(spike_end, audit_date)
-        self.blank_start = self.analysis_tools.localize_time_inputs(
-            blank_start, audit_date
+        super().__init__(report, background, pool)
+        self.set_windows(
+            spike_start, spike_end, blank_start, blank_end, time_averaging, audit_date
         )
-        self.blank_end = self.analysis_tools.localize_time_inputs(blank_end, audit_date)
         self.compound = compound
-        time_bin = {
-            "None": None,
-            "1 minute": 1,
-            "5 minutes": 5,
-        }
-        self.time_averaging = time_bin[time_averaging]
 
         # curve fit for t-stat data
         epa_t_statistic = {
@@ -245,17 +549,34 @@ class MDLCheckAnalysis:
             epa_t_statistic["n"], epa_t_statistic["t"]
         )
 
-        # flag the display data (and update state)
-        FlagData(display_data, self.spike_start, self.spike_end, type="mdl")
+        self.run(background, display_data, self.mdl_analysis, analysis_data)
 
-        self.mdl_analysis(analysis_data)
+    def flag(self, display_data):
+        """
+        Flags the spike window
+        """
 
+        FlagData(
+            display_data,
+            self.spike_start,
+            self.spike_end,
+            type="mdl",
+            parameters={
+                "compound": self.compound,
+                "blank_start": self.blank_start,
+                "blank_end": self.blank_end,
+                "time_averaging": self.time_averaging_label,
+            },
+        )
+
+    @monitor.timed("analysis.mdl")
     def mdl_analysis(self, analysis_data):
         """
         Performs analysis
         """
 
         # shorted df to the timeframe to analyze
+        self.report.set_progress(0.1, "Finding the ideal spike grouping")
         spike_series = self.analysis_tools.shorten_to_analysis(
             analysis_data, self.spike_start, self.spike_end, self.compound
         )
@@ -263,16 +584,10 @@ class MDLCheckAnalysis:
         spike_data = self.analysis_tools.find_ideal_grouping(spike_series)
 
         # re-shorten data based on ideal grouping
-        if self.time_averaging is not None:
-            spike_start = spike_data.index[0]
-            spike_end = spike_data.index[-1]
-            spike_data = self.analysis_tools.shorten_to_analysis(
-                analysis_data, spike_start, spike_end, self.compound
-            )
-            # group data into x minute long averages
-            spike_data = spike_data.resample(f"{self.time_averaging}T").mean()
+        spike_data = self.time_average(analysis_data, spike_data, self.compound)
 
         # shorted df to the timeframe to analyze
+        self.report.set_progress(0.35, "Finding the ideal blank grouping")
         blank_series = self.analysis_tools.shorten_to_analysis(
             analysis_data, self.blank_start, self.blank_end, self.compound
         )
@@ -280,16 +595,10 @@ class MDLCheckAnalysis:
         blank_data = self.analysis_tools.find_ideal_grouping(blank_series)
 
         # re-shorten based on ideal grouping
-        if self.time_averaging is not None:
-            blank_start = blank_data.index[0]
-            blank_end = blank_data.index[-1]
-            blank_data = self.analysis_tools.shorten_to_analysis(
-                analysis_data, blank_start, blank_end, self.compound
-            )
-            # group data into x minute long averages
-            blank_data = blank_data.resample(f"{self.time_averaging}T").mean()
+        blank_data = self.time_average(analysis_data, blank_data, self.compound)
 
         # plot data
+        self.report.set_progress(0.6, "Plotting")
         self.plot.scatter_selection(
             analysis_data[self.compound],
             spike_series,
@@ -298,67 +607,166 @@ class MDLCheckAnalysis:
             blank_data,
         )
 
-        st.markdown("**Spike**")
+        self.report.markdown("**Spike**")
+        self.report.set_progress(0.8, "Computing the MDL")
 
         # compute stats for both and display
-        spike_stats = self.analysis_tools.compute_basic_stats(spike_data)
+        self.analysis_tools.compute_basic_stats(spike_data)
         self.analysis_tools.display_table(spike_data)
 
-        st.markdown("**Blank**")
+        self.report.markdown("**Blank**")
 
-        blank_stats = self.analysis_tools.compute_basic_stats(blank_data)
+        self.analysis_tools.compute_basic_stats(blank_data)
         self.analysis_tools.display_table(blank_data)
 
         # compute MDL
-
-        st.markdown("**MDL$_s$ Computation**")
-        number_points = len(spike_data)
-        st.write("Number of Points =", number_points)
-        t_stat = round(stats.t.ppf(0.99, number_points - 1), 3)
-        st.write(f"t-statistic = {t_stat}")
-        sd = spike_stats["SD"]
-        st.write(f"SD = {sd}")
-        mdl_s = t_stat * sd
-        st.write(f"MDL$_s$ = {round(mdl_s, 4)}")
-
-        st.markdown("**MDL$_b$ Computation**")
-        number_points = len(blank_data)
-        st.write("Number of Points =", number_points)
-        if number_points <= 100:
-            st.write(
+        mdl = self.analysis_tools.compute_mdl(spike_data, blank_data)
+
+        self.report.markdown("**MDL$_s$ Computation**")
+        self.report.write("Number of Points =", mdl["Spike Points"])
+        self.report.write(f"t-statistic = {mdl['Spike t']}")
+        self.report.write(f"SD = {mdl['Spike SD']}")
+        self.report.write(f"MDL$_s$ = {round(mdl['MDL_s'], 4)}")
+
+        self.report.markdown("**MDL$_b$ Computation**")
+        self.report.write("Number of Points =", mdl["Blank Points"])
+        if mdl["Blank Points"] <= 100:
+            self.report.write(
                 "Since the degrees of freedom are less than 100, the MDL will be computed using the Students t-statistic."
             )
-            x_bar = np.max([blank_stats["Mean"], 0])
-            st.write(f"Mean = {x_bar}")
-            t_stat = round(stats.t.ppf(0.99, number_points - 1), 3)
-            st.write(f"t-statistic = {t_stat}")
-            sd = blank_stats["SD"]
-            st.write(f"SD = {sd}")
-            mdl_b = x_bar + t_stat * sd
-            st.write(f"MDL$_b$ = {round(mdl_b, 4)}")
+            self.report.write(f"Mean = {mdl['Blank Mean']}")
+            self.report.write(f"t-statistic = {mdl['Blank t']}")
+            self.report.write(f"SD = {mdl['Blank SD']}")
+            self.report.write(f"MDL$_b$ = {round(mdl['MDL_b'], 4)}")
         else:
-            st.write(
+            self.report.write(
                 "Since there are more than 100 samples available, the MDL is set to the 99th percentile of the samples, sorted in in rank order. See the EPA MDL Procedure document for a detailed description of this process."
             )
-            ordered_data = np.sort(blank_data)
-            rank = round(number_points * 0.99)
-            mdl_b = ordered_data[rank - 1]
-            st.write(f"MDL$_s$ = {round(mdl_b, 4)}")
-
-        mdl = np.max([mdl_s, mdl_b])
-        lod = blank_stats["SD"] * 3
-        loq = blank_stats["SD"] * 10
+            self.report.write(f"MDL$_s$ = {round(mdl['MDL_b'], 4)}")
 
-        st.info(f"""
-        **MDL = {round(mdl, 4)}**
+        self.report.info(f"""
+        **MDL = {round(mdl["MDL"], 4)}**
 
-        LOD = {round(lod, 4)}
+        LOD = {round(mdl["LOD"], 4)}
 
-        LOQ = {round(loq, 4)}
+        LOQ = {round(mdl["LOQ"], 4)}
         """)
 
 
-class iMetAnalysis:
+class BatchMDLAnalysis(MDLAnalysis):
+    def __init__(
+        self,
+        spike_start,
+        spike_end,
+        blank_start,
+        blank_end,
+        time_averaging,
+        audit_date,
+        compounds,
+        analysis_data,
+        display_data,
+        report=None,
+        background=None,
+        pool=None,
+    ):
+        """
+        MDL check of several compounds with the same spike and blank windows, the results are one table.
+
+        Inputs:
+        - spike_start: start time for spike
+        - spike_end: end time for spike
+        - blank_start: start time for blank
+        - blank_end: end time for blank
+        - time_averaging: time bin averaging for the analysis
+        - audit_date: 'yyyymmdd'
+        - compounds: list of compound headers
+        - analysis_data: df to be used in analysis
+        - display_data: df that is updated with flags
+        - report: AnalysisReport of a previous run to redisplay instead of recomputing
+        - background: function from AnalysisJobs.submitter to run the analysis in, None to run it here
+        - pool: AnalysisPool the groupings run in (all at once), None to run them in this process
+        """
+
+        super().__init__(report, background, pool)
+        self.set_windows(
+            spike_start, spike_end, blank_start, blank_end, time_averaging, audit_date
+        )
+        self.audit_date = audit_date
+        self.compounds = compounds
+
+        self.run(background, display_data, self.batch_mdl_analysis, analysis_data)
+
+    def flag(self, display_data):
+        """
+        Flags the spike window
+        """
+
+        FlagData(
+            display_data,
+            self.spike_start,
+            self.spike_end,
+            type="mdl",
+            parameters={
+                "compounds": self.compounds,
+                "blank_start": self.blank_start,
+                "blank_end": self.blank_end,
+                "time_averaging": self.time_averaging_label,
+            },
+        )
+
+    @monitor.timed("analysis.mdl_batch")
+    def batch_mdl_analysis(self, analysis_data):
+        """
+        Performs analysis of every compound
+        """
+
+        # the spike and blank of every compound are grouped in one pass
+        self.report.set_progress(
+            0.1, f"Finding the ideal groupings of {len(self.compounds)} compounds"
+        )
+        spike_series = [
+            self.analysis_tools.shorten_to_analysis(
+                analysis_data, self.spike_start, self.spike_end, compound
+            )
+            for compound in self.compounds
+        ]
+        blank_series = [
+            self.analysis_tools.shorten_to_analysis(
+                analysis_data, self.blank_start, self.blank_end, compound
+            )
+            for compound in self.compounds
+        ]
+        groupings = self.analysis_tools.find_ideal_groupings(
+            spike_series + blank_series, progress=(0.1, 0.9)
+        )
+
+        self.report.set_progress(0.9, "Computing the MDLs")
+        rows = []
+        for compound, spike_data, blank_data in zip(
+            self.compounds,
+            groupings[: len(self.compounds)],
+            groupings[len(self.compounds) :],
+        ):
+            spike_data = self.time_average(analysis_data, spike_data, compound)
+            blank_data = self.time_average(analysis_data, blank_data, compound)
+            mdl = self.analysis_tools.compute_mdl(spike_data, blank_data)
+            rows.append({"Compound": compound} | mdl)
+
+        mdl_df = pd.DataFrame(rows)
+
+        self.report.markdown(f"**MDL of {len(mdl_df)} compounds**")
+        self.report.dataframe(
+            mdl_df.round(4), hide_index=True, use_container_width=True
+        )
+        self.report.download_button(
+            "Download MDL Table",
+            mdl_df.to_csv(index=False).encode("utf-8"),
+            f"{self.audit_date}_mdl.csv",
+            key="download-mdl",
+        )
+
+
+class iMetAnalysis(AuditAnalysis):
     def __init__(
         self,
         start_time,
@@ -367,6 +775,9 @@ class iMetAnalysis:
         kestrel_data,
         analysis_data,
         display_data,
+        report=None,
+        background=None,
+        pool=None,
     ):
         """
         Inputs:
@@ -376,10 +787,12 @@ class iMetAnalysis:
         - upload: kestral data upload
         - analysis_data: dataframe of data to be analyzed
         - display_data: data to be flagged
+        - report: AnalysisReport of a previous run to redisplay instead of recomputing
+        - background: function from AnalysisJobs.submitter to run the analysis in, None to run it here
+        - pool: AnalysisPool the grouping runs in, None to run it in this process
         """
 
-        self.analysis_tools = DataAnalysisTools()
-        self.plot = DataVisualization()
+        super().__init__(report, background, pool)
 
         # convert times to datetimes
         self.start_time = self.analysis_tools.localize_time_inputs(
@@ -387,21 +800,30 @@ class iMetAnalysis:
         )
         self.end_time = self.analysis_tools.localize_time_inputs(end_time, audit_date)
 
-        # flag the display data (and update state)
-        FlagData(display_data, self.start_time, self.end_time, type="imet")
+        self.run(
+            background, display_data, self.imet_analysis, analysis_data, kestrel_data
+        )
 
-        self.imet_analysis(analysis_data, kestrel_data)
+    def flag(self, display_data):
+        """
+        Flags the comparison window
+        """
+
+        FlagData(display_data, self.start_time, self.end_time, type="imet")
 
+    @monitor.timed("analysis.imet")
     def imet_analysis(self, analysis_data, kestrel_data):
         """
         Performs the analysis
         """
 
         # shorted df to the timeframe to analyze
-        analysis_data = analysis_data[
-            (analysis_data.index >= self.start_time)
-            & (analysis_data.index <= self.end_time)
-        ]
+        self.report.set_progress(0.1, "Converting units")
+        analysis_data = to_float64(
+            analysis_data.iloc[
+                time_rows(analysis_data.index, self.start_time, self.end_time)
+            ].copy()
+        )
 
         kestrel_data["FORMATTED DATE_TIME"] = pd.to_datetime(
             kestrel_data["FORMATTED DATE_TIME"]
@@ -422,20 +844,31 @@ class iMetAnalysis:
         )  # hPa -> mmHg
 
         # plot timeseries for all variables
+        self.report.set_progress(0.5, "Plotting")
         self.plot.met_plot(analysis_data, kestrel_data)
 
         # compute the mean, min, and max of the absolute differences and display table
+        self.report.set_progress(0.8, "Computing differences")
         self.analysis_tools.met_difference_computations(analysis_data, kestrel_data)
 
 
 class GPSCheck:
-    def __init__(self, analysis_data):
+    def __init__(self, analysis_data, cell_size=250, min_satellites=4):
         """
-        Plots the GPS locations for the entire audit
+        Maps GPS fix quality for the entire audit on a square grid
+
+        Inputs:
+        - analysis_data: dataframe of data to be analyzed
+        - cell_size: width of the grid cells in meters
+        - min_satellites: fixes with fewer satellites than this count as dropouts
         """
 
+        self.analysis_tools = DataAnalysisTools()
         self.plot = DataVisualization()
 
+        self.cell_size = cell_size
+        self.min_satellites = min_satellites
+
         # just saves GPS related columns
         df = analysis_data[
             [
@@ -447,21 +880,47 @@ class GPSCheck:
 
         self.gps_analysis(df)
 
+    @monitor.timed("analysis.gps")
     def gps_analysis(self, df):
         """
         Performs GPS analysis
         """
 
-        # convert into geopandas df
-        gdf = gpd.GeoDataFrame(
-            df,
-            geometry=gpd.points_from_xy(
-                df["GPS Longitude (\u00b0E)"], df["GPS Latitude (\u00b0N)"]
-            ),
-            crs=CRS("EPSG:4326"),
+        # pyproj is only loaded once the GPS check is run
+        from pyproj import CRS, Transformer
+
+        latitude = df["GPS Latitude (\u00b0N)"].to_numpy(dtype=float)
+        longitude = df["GPS Longitude (\u00b0E)"].to_numpy(dtype=float)
+        satellites = df["GPS Number Of Satellites"].to_numpy(dtype=float)
+
+        # only keep rows with a reported position (other instruments leave these empty)
+        valid = (
+            np.isfinite(latitude)
+            & np.isfinite(longitude)
+            & np.isfinite(satellites)
+            & ~((latitude == 0) & (longitude == 0))
+        )
+        if not valid.any():
+            st.write("No GPS fixes to display.")
+            return
+
+        # project to web mercator so the grid cells are in meters
+        transformer = Transformer.from_crs(
+            CRS("EPSG:4326"), CRS("EPSG:3857"), always_xy=True
+        )
+        x, y = transformer.transform(longitude[valid], latitude[valid])
+
+        # aggregate the fixes into grid cells
+        grid = self.analysis_tools.grid_bin(
+            x, y, satellites[valid], self.cell_size, self.min_satellites
+        )
+
+        st.write(
+            f"{valid.sum()} GPS fixes in {len(grid)} grid cells, "
+            f"{int(grid['Dropouts'].sum())} with fewer than {self.min_satellites} satellites."
         )
-        gdf_wm = gdf.to_crs("EPSG:3857")
 
-        st.write("Page under developement. No map to display.")
+        # scale bar correction for the mercator stretch at this latitude
+        scale = np.cos(np.radians(np.mean(latitude[valid])))
 
-        self.plot.gps_map(df, gdf_wm)
+        self.plot.gps_grid_map(grid, self.cell_size, scale)
@@ -0,0 +1,338 @@
+"""
+Benchmarks the audit pipeline on synthetic data and writes a JSON report.
+
+For every timestamp format the suite times ingest, a rerun with the data cached, find_ideal_grouping, window detection, the MDL check, the iMet comparison,
+flagging and the CSV export. Keep the reports from different commits to track regressions.
+
+With --memory every stage is run once more with memory tracking on, recording the peak and retained memory of
+the stage and of its nested spans (e.g. the steps of ingest).
+
+Usage:
+    python benchmarks/auditBenchmark.py --rows 14400 --files 4 --compounds 10 --output report.json
+    python benchmarks/auditBenchmark.py --memory --formats DateTime
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import argparse
+import platform
+import tempfile
+import warnings
+import statistics
+import subprocess
+import contextlib
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import matplotlib
+
+# no display needed for the plots
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import streamlit.logger
+from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+from syntheticData import FORMATS, generate_audit_files
+from dataHandling import (
+    ProcessRawFiles,
+    DataAnalysisTools,
+    FlagData,
+    AnalysisFinisher,
+)
+from auditAnalysis import MDLCheckAnalysis, iMetAnalysis
+from analysisResults import AnalysisReport
+from performanceMonitor import monitor
+
+
+def load_uploads(paths):
+    """
+    Reads files into the same objects the streamlit file uploader returns
+
+    Returns: list of UploadedFile
+    """
+
+    uploads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        name = os.path.basename(path)
+        # every upload gets a new file id, like in the app
+        file_id = uuid.uuid4().hex
+        uploads.append(UploadedFile(UploadedFileRec(file_id, name, "", data), None))
+
+    return uploads
+
+
+def time_stage(function, repeats):
+    """
+    Times a stage, the output printed by the app is discarded.
+
+    Inputs:
+    - function: function with no inputs that runs the stage
+    - repeats: number of timed runs
+
+    Returns: dict of median, min and max seconds
+    """
+
+    timings = []
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        plt.close("all")
+
+    return {
+        "median_s": round(statistics.median(timings), 5),
+        "min_s": round(min(timings), 5),
+        "max_s": round(max(timings), 5),
+    }
+
+
+def profile_memory(name, function):
+    """
+    Runs a stage once with memory tracking on.
+
+    Inputs:
+    - name: name of the stage
+    - function: function with no inputs that runs the stage
+
+    Returns: list of the memory of the stage and of its nested spans, in the order they started
+    """
+
+    monitor.set_memory_tracking(True)
+    monitor.start_run()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with monitor.span(f"benchmark.{name}"):
+            function()
+    monitor.set_memory_tracking(False)
+    plt.close("all")
+
+    memory_keys = ["peak_mb", "retained_mb", "rss_peak_mb", "rss_retained_mb"]
+    return [
+        {"name": span["name"], "depth": span["depth"]}
+        | {key: span[key] for key in memory_keys if key in span}
+        for span in sorted(monitor.spans, key=lambda span: span["start"])
+    ]
+
+
+def benchmark_format(
+    time_format, directory, rows, files, compounds, repeats, memory=False
+):
+    """
+    Generates the data of one timestamp format and times every stage on it.
+
+    Returns: dict of stage timings (and memory) and dataset size
+    """
+
+    paths, scenario = generate_audit_files(
+        directory, time_format, rows=rows, files=files, compounds=compounds
+    )
+    uploads = load_uploads(paths)
+    processor = ProcessRawFiles.__new__(ProcessRawFiles)
+    tools = DataAnalysisTools(display=AnalysisReport(live=False))
+
+    # the uncached loader
+    load_and_merge_data = ProcessRawFiles.load_and_merge_data.__wrapped__
+
+    def rewind():
+        # uploads are read like streams, rewind them for every run
+        for upload in uploads:
+            upload.seek(0)
+        return uploads
+
+    def ingest():
+        rewind()
+        return load_and_merge_data(processor, processor.dataset_key(uploads), uploads)
+
+    def rerun():
+        # a cache miss parses the uploads again
+        ProcessRawFiles(rewind()).select_partition(partition)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        partition_files, _, downcast_report = ingest()
+
+    # the audit day of the scenario
+    partition = (scenario["audit_date"], None)
+    audit_date = partition[0]
+    analysis_data, display_data = processor.read_partition(
+        *partition_files[partition][:2]
+    )
+    display_data = processor.add_flag_column(display_data)
+    compound = scenario["compound"]
+
+    results = {
+        "rows": len(display_data),
+        "partitions": len(partition_files),
+        "columns": display_data.shape[1],
+        "file_bytes": sum(upload.size for upload in uploads),
+        "display_mb": round(
+            display_data.memory_usage(index=True, deep=True).sum() / 1024**2, 3
+        ),
+        "downcast_saved_mb": round(downcast_report["Saved (MB)"].sum(), 3),
+    }
+
+    def run_stage(name, function):
+        results[name] = time_stage(function, repeats)
+        if memory:
+            results[name]["memory"] = profile_memory(name, function)
+
+    run_stage("ingest", ingest)
+    # what every session pays on every rerun once the data is cached
+    with contextlib.redirect_stdout(io.StringIO()):
+        rerun()
+    run_stage("rerun", rerun)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        zero_start = tools.localize_time_inputs(scenario["zero"][0], audit_date)
+        zero_end = tools.localize_time_inputs(scenario["zero"][1], audit_date)
+    zero_series = tools.shorten_to_analysis(
+        analysis_data, zero_start, zero_end, compound
+    )
+    run_stage("find_ideal_grouping", lambda: tools.find_ideal_grouping(zero_series))
+    run_stage("detect_windows", lambda: tools.detect_windows(analysis_data, compound))
+
+    run_stage(
+        "mdl",
+        lambda: MDLCheckAnalysis(
+            *scenario["spike"],
+            *scenario["blank"],
+            "None",
+            audit_date,
+            compound,
+            analysis_data,
+            display_data,
+            report=AnalysisReport(live=False),
+        ),
+    )
+
+    kestrel_df = pd.read_csv(scenario["kestrel"], skiprows=[0, 1, 2, 4])
+    run_stage(
+        "imet",
+        lambda: iMetAnalysis(
+            *scenario["imet"],
+            audit_date,
+            kestrel_df.copy(),
+            analysis_data,
+            display_data,
+            report=AnalysisReport(live=False),
+        ),
+    )
+
+    run_stage(
+        "flagging", lambda: FlagData(display_data, zero_start, zero_end, type="zero")
+    )
+
+    run_stage("export", lambda: AnalysisFinisher().download_csv(display_data))
+
+    return results
+
+
+def git_commit():
+    """
+    Returns the checked out commit, or None outside of a git repo
+    """
+
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return result.stdout.strip()
+
+
+def run_suite(formats, rows, files, compounds, repeats, data_dir, memory=False):
+    """
+    Runs the benchmark for every format.
+
+    Returns: dict report
+    """
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "versions": {
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "polars": pl.__version__,
+        },
+        "parameters": {
+            "rows": rows,
+            "files": files,
+            "compounds": compounds,
+            "repeats": repeats,
+            "memory": memory,
+        },
+        "results": {},
+    }
+
+    for time_format in formats:
+        directory = os.path.join(
+            data_dir, time_format.replace("/", "_").replace(" ", "_")
+        )
+        report["results"][time_format] = benchmark_format(
+            time_format, directory, rows, files, compounds, repeats, memory
+        )
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--formats", nargs="+", choices=list(FORMATS), default=list(FORMATS)
+    )
+    parser.add_argument("--rows", type=int, default=14400)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--compounds", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--memory", action="store_true", help="also record memory of every stage"
+    )
+    parser.add_argument("--data-dir", help="keep the generated files here")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    # the app warns when streamlit is used outside of `streamlit run`
+    warnings.filterwarnings("ignore")
+    streamlit.logger.set_log_level("error")
+
+    # keep benchmark spans out of the app's performance log
+    monitor.log_path = os.devnull
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # and the merged data out of the app's data store
+        os.environ["AUDIT_DATA_STORE"] = os.path.join(temp_dir, "store")
+        # and the benchmark flags out of the flag journal
+        os.environ["AUDIT_FLAG_JOURNAL"] = os.path.join(temp_dir, "flags.sqlite")
+        report = run_suite(
+            args.formats,
+            args.rows,
+            args.files,
+            args.compounds,
+            args.repeats,
+            args.data_dir or temp_dir,
+            args.memory,
+        )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
@@ -0,0 +1,246 @@
+"""
+Benchmarks how many bytes are copied when the merged data crosses between polars, pandas and arrow.
+
+Loads synthetic audit files with the uncached loader and counts the memory allocated in each conversion step:
+- numpy: bytes allocated through numpy/Python (tracemalloc), e.g. 2D pandas blocks and Python strings
+- arrow: bytes allocated by the pyarrow memory pool, e.g. arrow tables built from pandas
+
+Steps a revision does not have are counted as 0.
+
+The display data is also converted the way st.dataframe sends it to the browser (pa.Table.from_pandas).
+
+Usage:
+    python benchmarks/conversionCopies.py --rows 57600 --compounds 100
+    python benchmarks/conversionCopies.py --compare <git revision>
+"""
+
+import os
+import io
+import sys
+import json
+import argparse
+import tempfile
+import warnings
+import contextlib
+import subprocess
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# conversion steps counted, spans of the loader (ingest.to_pandas before the data store), mapping the store and
+# the streamlit hop
+COUNTED_STEPS = [
+    "ingest.parse",
+    "ingest.to_pandas",
+    "ingest.store",
+    "store.map",
+    "display.arrow",
+]
+
+MB = 1024**2
+
+
+def count_copies(source_dir, time_format, rows, files, compounds, data_dir):
+    """
+    Loads the synthetic files with the app modules in source_dir and counts the bytes each step allocates.
+
+    Returns: dict of allocated MB per step
+    """
+
+    sys.path[:0] = [source_dir, BENCHMARK_DIR]
+
+    import pyarrow as pa
+    import streamlit.logger
+    from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+    from syntheticData import generate_audit_files
+    from dataHandling import ProcessRawFiles
+    from performanceMonitor import monitor
+
+    streamlit.logger.set_log_level("error")
+    monitor.log_path = os.devnull
+    os.environ["AUDIT_DATA_STORE"] = os.path.join(data_dir, "store")
+
+    paths, _ = generate_audit_files(
+        data_dir, time_format, rows=rows, files=files, compounds=compounds
+    )
+    uploads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            name = os.path.basename(path)
+            uploads.append(
+                UploadedFile(UploadedFileRec(path, name, "", f.read()), None)
+            )
+
+    allocated = {step: {"numpy_mb": 0.0, "arrow_mb": 0.0} for step in COUNTED_STEPS}
+    span = monitor.span
+
+    @contextlib.contextmanager
+    def counting_span(name, **attributes):
+        # the counted steps are not nested in each other, so the single tracemalloc peak can be reset
+        traced_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        arrow_start = pa.total_allocated_bytes()
+        with span(name, **attributes) as record:
+            yield record
+        if name in allocated:
+            allocated[name]["numpy_mb"] += (
+                tracemalloc.get_traced_memory()[1] - traced_start
+            ) / MB
+            allocated[name]["arrow_mb"] += (
+                max(pa.total_allocated_bytes() - arrow_start, 0) / MB
+            )
+
+    monitor.span = counting_span
+    tracemalloc.start()
+
+    processor = ProcessRawFiles.__new__(ProcessRawFiles)
+    load_and_merge_data = ProcessRawFiles.load_and_merge_data.__wrapped__
+    arguments = [uploads]
+    if hasattr(processor, "dataset_key"):
+        # revisions with a resource cache are keyed by the file ids
+        arguments.insert(0, processor.dataset_key(uploads))
+    with contextlib.redirect_stdout(io.StringIO()):
+        loaded = load_and_merge_data(processor, *arguments)
+
+    if isinstance(loaded[0], dict):
+        # revisions with audit day partitions map the first one
+        partition_files = loaded[0]
+        display_data = processor.read_partition(
+            *partition_files[min(partition_files)][:2]
+        )[1]
+    elif isinstance(loaded[1], str):
+        # revisions with the data store return its path
+        with monitor.span("store.map"):
+            display_data = processor.read_from_store(loaded[1])
+    else:
+        display_data = loaded[1]
+
+    # what st.dataframe does with the display data
+    with monitor.span("display.arrow"):
+        table = pa.Table.from_pandas(display_data)
+    del table
+
+    tracemalloc.stop()
+
+    steps = {
+        step: {key: round(value, 2) for key, value in counts.items()}
+        for step, counts in allocated.items()
+    }
+    steps["total"] = {
+        key: round(sum(counts[key] for counts in allocated.values()), 2)
+        for key in ["numpy_mb", "arrow_mb"]
+    }
+
+    return {
+        "frame_mb": round(
+            display_data.memory_usage(index=True, deep=True).sum() / MB, 2
+        ),
+        "allocated": steps,
+    }
+
+
+def export_revision(revision, directory):
+    """
+    Writes the tracked files of a git revision to directory
+    """
+
+    archive = subprocess.run(
+        ["git", "archive", revision], cwd=REPO_DIR, capture_output=True, check=True
+    )
+    subprocess.run(["tar", "-x", "-C", directory], input=archive.stdout, check=True)
+
+
+def run_in_subprocess(source_dir, args, data_dir):
+    """
+    Counts the copies of another source tree in a fresh interpreter, so its modules are not mixed with these.
+
+    Returns: dict of allocated MB per step
+    """
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--source",
+            source_dir,
+            "--format",
+            args.format,
+            "--rows",
+            str(args.rows),
+            "--files",
+            str(args.files),
+            "--compounds",
+            str(args.compounds),
+            "--data-dir",
+            data_dir,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return json.loads(result.stdout)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, BENCHMARK_DIR)
+    from syntheticData import FORMATS
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--format", choices=list(FORMATS), default="DateTime")
+    parser.add_argument("--rows", type=int, default=14400)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--compounds", type=int, default=10)
+    parser.add_argument("--compare", help="git revision to compare the copies to")
+    # set when run_in_subprocess counts another source tree
+    parser.add_argument("--source", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help="keep the generated files here")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    # the app warns when streamlit is used outside of `streamlit run`
+    warnings.filterwarnings("ignore")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data_dir or temp_dir
+
+        if args.source:
+            print(
+                json.dumps(
+                    count_copies(
+                        args.source,
+                        args.format,
+                        args.rows,
+                        args.files,
+                        args.compounds,
+                        data_dir,
+                    )
+                )
+            )
+            sys.exit()
+
+        report = {
+            "parameters": {
+                "format": args.format,
+                "rows": args.rows,
+                "files": args.files,
+                "compounds": args.compounds,
+            },
+            "current": run_in_subprocess(REPO_DIR, args, data_dir)
+            if args.compare
+            else count_copies(
+                REPO_DIR, args.format, args.rows, args.files, args.compounds, data_dir
+            ),
+        }
+
+        if args.compare:
+            with tempfile.TemporaryDirectory() as old_dir:
+                export_revision(args.compare, old_dir)
+                report[args.compare] = run_in_subprocess(old_dir, args, data_dir)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
@@ -0,0 +1,128 @@
+"""
+Benchmarks the cold-start import time of the app modules.
+
+Every measurement runs in a fresh interpreter so nothing is already imported.
+
+Usage:
+    python benchmarks/importTime.py
+    python benchmarks/importTime.py --compare <git revision>
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+import statistics
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules main.py imports before the upload widget renders
+APP_MODULES = ["dataHandling", "auditAnalysis", "analysisResults"]
+
+# modules that should only load with the tab that needs them
+DEFERRED_MODULES = {
+    "GPS Check": ["pyproj"],
+    "MDL Check": ["scipy.stats", "scipy.optimize"],
+    "Plots": ["matplotlib.pyplot", "seaborn", "matplotlib_scalebar.scalebar"],
+}
+
+# run in the fresh interpreter, prints the import time and which deferred modules got loaded
+MEASURE_SCRIPT = """
+import sys, json, time, warnings
+warnings.filterwarnings("ignore")
+start = time.perf_counter()
+for module in {modules!r}:
+    try:
+        __import__(module)
+    except ImportError:
+        pass
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {watch!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(modules, source_dir, repeats):
+    """
+    Imports modules in fresh interpreters.
+
+    Inputs:
+    - modules: list of module names to import
+    - source_dir: directory the app modules are imported from
+    - repeats: number of fresh interpreters to time
+
+    Returns: dict of median and min seconds and the deferred modules that were loaded
+    """
+
+    watch = [module for group in DEFERRED_MODULES.values() for module in group]
+    script = MEASURE_SCRIPT.format(modules=modules, watch=watch)
+
+    timings = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=source_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(measurement["seconds"])
+
+    return {
+        "median_s": round(statistics.median(timings), 4),
+        "min_s": round(min(timings), 4),
+        "deferred_loaded": measurement["loaded"],
+    }
+
+
+def run_benchmark(source_dir, repeats):
+    """
+    Times the app cold start and the first use cost of each tab.
+
+    Returns: dict report
+    """
+
+    report = {"cold_start": measure_import(APP_MODULES, source_dir, repeats)}
+
+    # what a tab pays the first time it is used
+    report["first_use"] = {}
+    for tab, modules in DEFERRED_MODULES.items():
+        report["first_use"][tab] = measure_import(modules, source_dir, repeats)
+
+    return report
+
+
+def export_revision(revision, directory):
+    """
+    Writes the tracked files of a git revision to directory
+    """
+
+    archive = subprocess.run(
+        ["git", "archive", revision], cwd=REPO_DIR, capture_output=True, check=True
+    )
+    subprocess.run(["tar", "-x", "-C", directory], input=archive.stdout, check=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--compare", help="git revision to compare the cold start to")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {"current": run_benchmark(REPO_DIR, args.repeats)}
+
+    if args.compare:
+        with tempfile.TemporaryDirectory() as old_dir:
+            export_revision(args.compare, old_dir)
+            report[args.compare] = {
+                "cold_start": measure_import(APP_MODULES, old_dir, args.repeats)
+            }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
@@ -0,0 +1,305 @@
+"""
+Writes synthetic audit data files for benchmarking.
+
+One writer per timestamp format that ProcessRawFiles.add_datetimes recognizes. Every dataset holds the same
+audit day (zero air, cal gas, MDL spike and blank, and an iMet comparison window) so the analyses have realistic
+plateaus to work on.
+
+Usage:
+    python benchmarks/syntheticData.py <directory> --format DateTime --rows 3600 --files 4 --compounds 10
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import polars as pl
+
+# audit day, written in the file formats below
+AUDIT_START = pd.Timestamp("2025-07-15 08:00", tz="America/Denver")
+
+# audit windows as fractions of the dataset duration
+WINDOWS = {
+    "zero": (0.10, 0.20),
+    "cal": (0.30, 0.40),
+    "spike": (0.50, 0.60),
+    "blank": (0.70, 0.80),
+    "imet": (0.85, 0.95),
+}
+
+# compound level during each window (ppb)
+CAL_GAS_CONC = 5.0
+SPIKE_CONC = 0.5
+BACKGROUND_CONC = 0.3
+
+# extension and separator of each format
+FORMATS = {
+    "DateTime": ("csv", ","),
+    "UTC Date/Time": ("csv", ","),
+    "frozen UTC Time": ("csv", ","),
+    "time": ("csv", ","),
+    "DATE/TIME": ("dat", " "),
+    "Datetime (UTC)": ("txt", "\t"),
+}
+
+MET_COLUMNS = {
+    "Temperature (°C)": (25, 0.5),
+    "Corrected Wind Direction (°)": (180, 20),
+    "Pressure (hPa)": (840, 1),
+    "Relative Humidity (%)": (30, 2),
+    "Corrected Wind Speed (m/s)": (3, 1),
+}
+
+
+def compound_names(compounds):
+    """
+    Header names of the compound columns, the first one is always benzene
+
+    Inputs:
+    - compounds: number of compound columns
+
+    Returns: list of names
+    """
+
+    return ["Benzene C6H6+"] + [f"Compound {i}" for i in range(1, compounds)]
+
+
+def make_audit_frame(rows, compounds, frequency, rng):
+    """
+    Builds the measurements of the audit day.
+
+    Inputs:
+    - rows: total number of rows
+    - compounds: number of compound columns
+    - frequency: samples per second
+    - rng: numpy random generator
+
+    Returns: df indexed by UTC time and the scenario (windows as hh:mm, compound name)
+    """
+
+    times = AUDIT_START.tz_convert("UTC") + pd.to_timedelta(
+        np.arange(rows) / frequency, unit="s"
+    )
+    position = np.arange(rows) / rows
+
+    # window times rounded inwards to whole minutes for the forms
+    scenario = {}
+    for window, (start, end) in WINDOWS.items():
+        local = times.tz_convert("America/Denver")
+        scenario[window] = (
+            local[int(start * rows)].ceil("min").strftime("%H:%M"),
+            local[int(end * rows) - 1].floor("min").strftime("%H:%M"),
+        )
+
+    def in_window(window):
+        start, end = WINDOWS[window]
+        return (position >= start) & (position < end)
+
+    names = compound_names(compounds)
+    data = {}
+    for i, name in enumerate(names):
+        level = np.full(rows, BACKGROUND_CONC * (1 + i % 5))
+        level[in_window("zero") | in_window("blank")] = 0.0
+        level[in_window("cal")] = CAL_GAS_CONC
+        level[in_window("spike")] = SPIKE_CONC
+        noise = rng.normal(0, 0.02 + 0.01 * level, rows)
+        # a few spikes for the outlier removal to find
+        spikes = rng.random(rows) < 0.002
+        noise[spikes] += rng.normal(0, 1, spikes.sum())
+        data[name] = np.round(level + noise, 4)
+
+    # autocalibration valves, outside of the audit windows
+    autocal = (position >= 0.96) & (position < 0.98)
+    data["GSU_PUMP_ON monitor []"] = np.ones(rows, dtype=int)
+    data["GSU_VALVE_PR1 monitor []"] = autocal.astype(int)
+    data["GSU_VALVE_PR2 monitor []"] = np.zeros(rows, dtype=int)
+
+    for name, (mean, sd) in MET_COLUMNS.items():
+        data[name] = np.round(mean + rng.normal(0, sd, rows), 3)
+
+    # vehicle drives a loop, losing satellites on part of it
+    angle = 2 * np.pi * position * 3
+    satellites = rng.integers(6, 13, rows)
+    dropout = np.sin(angle) > 0.9
+    satellites[dropout] = rng.integers(0, 4, dropout.sum())
+    data["GPS Number Of Satellites"] = satellites
+    data["GPS Latitude (°N)"] = np.round(39.74 + 0.02 * np.sin(angle), 7)
+    data["GPS Longitude (°E)"] = np.round(-104.99 + 0.03 * np.cos(angle), 7)
+
+    scenario["compound"] = names[0]
+    scenario["cal_gas_conc"] = CAL_GAS_CONC
+    scenario["audit_date"] = AUDIT_START.strftime("%Y%m%d")
+
+    return pd.DataFrame(data, index=times), scenario
+
+
+def add_time_columns(df, time_format):
+    """
+    Adds the timestamp columns of a format, as the instrument would write them.
+
+    Inputs:
+    - df: df indexed by UTC time
+    - time_format: key of FORMATS
+
+    Returns: df with the time columns first
+    """
+
+    utc = df.index
+    if time_format == "DateTime":
+        time_columns = {"DateTime": utc.strftime("%Y-%m-%d %H:%M:%S.%f+00:00")}
+    elif time_format == "UTC Date/Time":
+        time_columns = {
+            "UTC Date": utc.strftime("%d%m%Y").astype(int),
+            "UTC Time": utc.strftime("%H%M%S").astype(float),
+            "UNIX timestamp of the measure time (s)": utc.asi8 / 1e9,
+        }
+    elif time_format == "frozen UTC Time":
+        # UTC Time stuck on the first value, the UNIX timestamp is ahead of UTC by the mountain time offset
+        # (6 hours in MDT, 7 in MST)
+        mountain = utc.tz_convert("America/Denver")
+        offset_s = (utc.tz_localize(None) - mountain.tz_localize(None)).total_seconds()
+        time_columns = {
+            "UTC Date": utc.strftime("%d%m%Y").astype(int),
+            "UTC Time": np.full(len(utc), float(utc[0].strftime("%H%M%S"))),
+            "UNIX timestamp of the measure time (s)": utc.asi8 / 1e9
+            + offset_s.to_numpy(),
+        }
+    elif time_format == "time":
+        # naive mountain standard time
+        mst = utc.tz_convert("Etc/GMT+7")
+        time_columns = {"time": mst.strftime("%Y-%m-%dT%H:%M:%S.%f")}
+    elif time_format == "DATE/TIME":
+        time_columns = {
+            "DATE": utc.strftime("%Y-%m-%d"),
+            "TIME": utc.strftime("%H:%M:%S.%f").str[:-3],
+        }
+    elif time_format == "Datetime (UTC)":
+        time_columns = {"Datetime (UTC)": utc.strftime("%Y-%m-%d %H:%M:%S.%f")}
+    else:
+        raise ValueError(f"Unknown time format {time_format}")
+
+    time_df = pd.DataFrame(time_columns)
+    data_df = df.reset_index(drop=True)
+
+    return pd.concat([time_df, data_df], axis=1)
+
+
+def generate_audit_files(
+    directory, time_format, rows=14400, files=4, compounds=10, frequency=1.0, seed=0
+):
+    """
+    Writes an audit day split into hourly style files.
+
+    Inputs:
+    - directory: where the files are written
+    - time_format: key of FORMATS
+    - rows: total number of rows over all files
+    - files: number of files the rows are split into
+    - compounds: number of compound columns
+    - frequency: samples per second
+    - seed: random seed
+
+    Returns: list of file paths and the scenario of the audit (windows, compound, concentrations)
+    """
+
+    extension, separator = FORMATS[time_format]
+    rng = np.random.default_rng(seed)
+
+    measurements, scenario = make_audit_frame(rows, compounds, frequency, rng)
+    df = add_time_columns(measurements, time_format)
+
+    os.makedirs(directory, exist_ok=True)
+    name = (
+        time_format.replace("/", "_")
+        .replace(" ", "_")
+        .replace("(", "")
+        .replace(")", "")
+    )
+
+    paths = []
+    for i, chunk in enumerate(np.array_split(np.arange(len(df)), files)):
+        path = os.path.join(directory, f"{name}_{i:02d}.{extension}")
+        pl.from_pandas(df.iloc[chunk]).write_csv(path, separator=separator)
+        paths.append(path)
+
+    scenario["kestrel"] = generate_kestrel_file(directory, measurements, scenario, rng)
+
+    return paths, scenario
+
+
+def generate_kestrel_file(directory, measurements, scenario, rng):
+    """
+    Writes the Kestrel met export for the iMet window, in the units the Kestrel reports.
+
+    Inputs:
+    - directory: where the file is written
+    - measurements: df of the audit day indexed by UTC time
+    - scenario: scenario of the audit day
+    - rng: numpy random generator
+
+    Returns: path to the csv
+    """
+
+    local_day = AUDIT_START.strftime("%Y-%m-%d ")
+    start = pd.Timestamp(local_day + scenario["imet"][0], tz="America/Denver")
+    end = pd.Timestamp(local_day + scenario["imet"][1], tz="America/Denver")
+
+    # one reading per whole second, matching the iMet timestamps
+    times = measurements.index.tz_convert("America/Denver")
+    window = (times >= start) & (times <= end) & (times == times.floor("s"))
+
+    imet = measurements.loc[window]
+    n = len(imet)
+    kestrel = pd.DataFrame(
+        {
+            "FORMATTED DATE_TIME": times[window].strftime("%Y-%m-%d %H:%M:%S"),
+            "Temperature": (imet["Temperature (°C)"].to_numpy() + rng.normal(0, 0.3, n))
+            * 9
+            / 5
+            + 32,
+            "Compass True Direction": imet["Corrected Wind Direction (°)"].to_numpy()
+            + rng.normal(0, 5, n),
+            "Barometric Pressure": imet["Pressure (hPa)"].to_numpy()
+            * 0.7500637554
+            / 25.3,
+            "Relative Humidity": imet["Relative Humidity (%)"].to_numpy()
+            + rng.normal(0, 1, n),
+            "Wind Speed": imet["Corrected Wind Speed (m/s)"].to_numpy()
+            * 3600
+            / 1609.34,
+        }
+    ).round(3)
+
+    path = os.path.join(directory, "kestrel.csv")
+    with open(path, "w") as f:
+        # device header lines and the units row are skipped when read
+        f.write("Device Name,Synthetic Kestrel\nDevice Model,5500\nSerial Number,0\n")
+        f.write(",".join(kestrel.columns) + "\n")
+        f.write("yyyy-MM-dd hh:mm:ss a,°F,Deg,inHg,%,mph\n")
+        kestrel.to_csv(f, header=False, index=False)
+
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directory")
+    parser.add_argument("--format", choices=list(FORMATS), default="DateTime")
+    parser.add_argument("--rows", type=int, default=14400)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--compounds", type=int, default=10)
+    parser.add_argument("--frequency", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths, scenario = generate_audit_files(
+        args.directory,
+        args.format,
+        args.rows,
+        args.files,
+        args.compounds,
+        args.frequency,
+        args.seed,
+    )
+    print(json.dumps({"files": paths, "scenario": scenario}, indent=2))
@@ -5,16 +5,256 @@ All handling of all incoming data done here:
 """
 
 import os
+import gzip
+import zipfile
 import base64
 import re
 import io
-import pytz
+import time
+import hashlib
+import logging
 import pandas as pd
 import polars as pl
+import pyarrow as pa
 import numpy as np
 import streamlit as st
-from datetime import datetime
-from scipy.optimize import curve_fit
+from datetime import datetime, timedelta
+from performanceMonitor import monitor
+from flagJournal import get_flag_journal
+from quantileSketch import QuantileSketch
+
+# debug messages, e.g. how time inputs were read
+logger = logging.getLogger(__name__)
+
+# decimal values with at most this many significant digits survive a round trip through float32
+FLOAT32_DIGITS = 6
+
+# integers float32 holds exactly
+FLOAT32_MAX_EXACT_INT = 2**24
+
+# values checked before the whole float column, to reject full precision data quickly
+FLOAT32_SAMPLE = 1000
+
+# values ProcessRawFiles._number_stats computes for every number column
+NUMBER_STATS = ["gaps", "whole", "smallest", "largest", "tiniest"]
+
+# int types tried when downcasting whole numbers, by whether the column has no negatives
+INT_TYPES = {
+    True: [(pl.UInt8, np.uint8), (pl.UInt16, np.uint16), (pl.UInt32, np.uint32)],
+    False: [(pl.Int8, np.int8), (pl.Int16, np.int16), (pl.Int32, np.int32)],
+}
+
+# text columns become categoricals when at most this fraction of the values is unique
+CATEGORY_MAX_UNIQUE = 0.5
+
+# monitor values of the gas standard unit during an autocalibration
+AUTOCAL_MONITORS = {
+    "GSU_PUMP_ON monitor []": 0,
+    "GSU_VALVE_PR1 monitor []": 1,
+    "GSU_VALVE_PR2 monitor []": 1,
+}
+
+# cleaning rules, applied in order by clean_data:
+# - conditions: monitor column -> value, the rule applies to rows where any of them has its value (all rows when
+#   there are none, missing monitor values do not count)
+# - targets: columns the action is applied to, missing ones are skipped
+# - action: "drop" sets the value to null, "scale" multiplies it by factor
+CLEANING_RULES = [
+    # autocalibrations
+    {"conditions": AUTOCAL_MONITORS, "targets": ["Benzene C6H6+"], "action": "drop"},
+    # HCN to ppb
+    {
+        "conditions": {},
+        "targets": ["HCNI-", "HCNI- [pptv]"],
+        "action": "scale",
+        "factor": 1e-3,
+    },
+]
+
+# arrow text types kept in arrow memory by pandas instead of copied into python strings
+ARROW_TEXT_TYPES = [pa.string(), pa.large_string(), pa.string_view()]
+
+# merged datasets are written here as arrow files and memory mapped by every session, can be moved with the
+# AUDIT_DATA_STORE environment variable
+DEFAULT_DATA_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "store")
+
+# store files not written for this long are deleted
+DATA_STORE_MAX_AGE_S = 7 * 24 * 3600
+
+# merged datasets and audit day partitions kept mapped for all sessions, and content hashes of uploaded files
+DATASET_CACHE_ENTRIES = 8
+PARTITION_CACHE_ENTRIES = 16
+FILE_HASH_CACHE_ENTRIES = 256
+
+# seconds a merged dataset or partition stays cached, well below DATA_STORE_MAX_AGE_S so a cached store path is
+# never one that was pruned; an upload after that is ingested (and written) again
+STORE_CACHE_TTL_S = 24 * 3600
+
+# columns naming the vehicle a row was measured on, when the files have one the data is also partitioned by it
+VEHICLE_COLUMNS = ["Vehicle", "Vehicle ID", "vehicle", "vehicle_id"]
+
+# grouping iterations between progress updates of a background analysis
+GROUPING_PROGRESS_EVERY = 25
+
+# window detection: rows are summed into blocks of this many seconds before the change point search
+WINDOW_BLOCK_S = 10
+
+# shortest segment the change point search makes, shorter bumps (spikes) stay in their segment
+WINDOW_MIN_SEGMENT_S = 60
+
+# change point penalty, in noise variances times log(rows)
+WINDOW_PENALTY = 2.0
+
+# neighbouring segments with levels closer than this many noise standard deviations are the same plateau
+WINDOW_MERGE_SD = 3.0
+
+# shortest window proposed for an audit
+WINDOW_MIN_MINUTES = 5
+
+# monitor columns of the gas standard unit, a window never spans one of them switching
+VALVE_PREFIX = "GSU_"
+
+# hours mountain time is behind UTC, in daylight saving time and standard time
+MOUNTAIN_UTC_OFFSETS_H = [6, 7]
+
+# data files the app reads, also inside .zip archives and as .gz or .zst files
+DATA_EXTENSIONS = ("csv", "dat", "txt")
+
+# bytes of decompressed text parsed at a time, the parse holds about four times this
+CSV_CHUNK_BYTES = 1024**2
+
+# instruments are aligned onto the timeline of the one with the most rows, rows of the others match the nearest
+# time within this many seconds
+ALIGN_TOLERANCE_S = 1.0
+
+# time columns add_datetimes reads, in the order it checks them; files of one instrument have the same one
+TIME_COLUMNS = ["DateTime", "UTC Time", "time", "DATE", "Datetime (UTC)"]
+
+# series longer than this get their outlier quartiles from a QuantileSketch (bounded memory, see SKETCH_K for
+# the error), e.g. zero air windows spanning several days; None always computes them exactly
+OUTLIER_SKETCH_ROWS = None
+
+# parts of the names of number columns that are not compounds, in lower case: instrument monitors, times and the
+# iMet and GPS readings
+NON_COMPOUND_MARKERS = [
+    "monitor",
+    "time",
+    "date",
+    "unix",
+    "gps",
+    "temperature",
+    "pressure",
+    "humidity",
+    "wind",
+]
+
+# rows per page of the data table offered to the user, only one page is sent to the browser
+TABLE_PAGE_ROWS = [100, 500, 1000, 5000]
+
+# audit flag filters of the data table, None keeps every row
+TABLE_FLAG_FILTERS = {
+    "All rows": None,
+    "Unflagged": "unflagged",
+    "Any flag": "flagged",
+    "Zero (0)": 0,
+    "Cal (1)": 1,
+    "MDL (2)": 2,
+    "iMet (3)": 3,
+}
+
+
+def round_significant(values, digits):
+    """
+    Rounds every value to a number of significant digits, zeros and NaNs are left as they are.
+
+    Inputs:
+    - values: numpy array of floats
+    - digits: number of significant digits
+
+    Returns: numpy array
+    """
+
+    magnitude = np.abs(values)
+    usable = np.isfinite(magnitude) & (magnitude > 0)
+    exponent = np.floor(np.log10(np.where(usable, magnitude, 1.0)))
+    scale = 10.0 ** (digits - 1 - exponent)
+
+    return np.where(usable, np.round(values * scale) / scale, values)
+
+
+def to_float64(data):
+    """
+    Casts float32 data back to float64, so it is computed with and written at full precision.
+
+    float32 only holds whole numbers or values with at most FLOAT32_DIGITS significant digits (see
+    ProcessRawFiles.downcast_numbers), so rounding gets the values back exactly as they were written.
+
+    Inputs:
+    - data: series or df
+
+    Returns: series or df
+    """
+
+    if isinstance(data, pd.Series):
+        if data.dtype != np.float32:
+            return data
+
+        values = data.to_numpy(dtype=np.float64)
+        values = np.where(
+            values == np.round(values),
+            values,
+            round_significant(values, FLOAT32_DIGITS),
+        )
+
+        return pd.Series(values, index=data.index, name=data.name)
+
+    float32_columns = data.columns[data.dtypes == np.float32]
+    if len(float32_columns) == 0:
+        return data
+
+    data = data.copy()
+    for column in float32_columns:
+        data[column] = to_float64(data[column])
+
+    return data
+
+
+def time_rows(index, start_time=None, end_time=None):
+    """
+    Finds the rows of a time range, both ends included.
+
+    The index is compared as UTC epoch integers (how pandas stores it, in the unit of the index), the
+    America/Denver time zone is only used to display it.
+
+    Inputs:
+    - index: timezone aware pandas DatetimeIndex
+    - start_time, end_time: timezone aware datetimes, None for no limit
+
+    Returns: slice when the index is in time order, else numpy array of row positions
+    """
+
+    times = index.asi8
+
+    # epoch nanoseconds of the range in the unit of the index, rounded inwards
+    unit_ns = pd.Timedelta(1, unit=index.unit).value
+    start = (
+        None if start_time is None else -(-pd.Timestamp(start_time).value // unit_ns)
+    )
+    end = None if end_time is None else pd.Timestamp(end_time).value // unit_ns
+
+    if index.is_monotonic_increasing:
+        # the merged data is in time order, the range is found without a full scan
+        first = 0 if start is None else np.searchsorted(times, start, "left")
+        last = len(times) if end is None else np.searchsorted(times, end, "right")
+        return slice(first, max(first, last))
+
+    in_range = np.ones(len(times), dtype=bool)
+    if start is not None:
+        in_range &= times >= start
+    if end is not None:
+        in_range &= times <= end
+
+    return np.flatnonzero(in_range)
 
 
 class ProcessRawFiles:
@@ -24,223 +264,1200 @@ class ProcessRawFiles:
     - adding new columns and flags to the data
     """
 
-    def __init__(self, uploaded_files):
+    def __init__(self, uploaded_files, align=False):
+        """
+        Processes uploaded data files
+
+        The merged data is split into partitions by local date (and vehicle), pick one with select_partition.
+        It then has two dfs; one with the cleaned data for analysis (analysis data), and the second is the working
+        df that is used to add new columns and flags, and is also displayed at the top of the UI.
+
+        Inputs:
+        - uploaded_files: list of uploaded files from streamlit
+        - align: put the rows of different instruments on a common timeline instead of stacking them
+
+        Returns: none
+        """
+
+        # shared by all sessions, the per rerun cost is hashing the file ids
+        (
+            self.partition_files,
+            self.dataset_hash,
+            self.downcast_report,
+        ) = self.load_and_merge_data(
+            self.dataset_key(uploaded_files), uploaded_files, align
+        )
+
+        self.partitions = sorted(
+            self.partition_files,
+            key=lambda partition: (partition[0], str(partition[1])),
+        )
+
+    def select_partition(self, partition):
+        """
+        Loads one audit day (and vehicle) of the merged data, only this partition is mapped into pandas.
+
+        Inputs:
+        - partition: (yyyymmdd date, vehicle or None) from self.partitions
+
+        Returns: none
+        """
+
+        analysis_path, display_path, _ = self.partition_files[partition]
+        analysis_data, display_data = self.read_partition(analysis_path, display_path)
+
+        self.partition = partition
+        self.audit_date = partition[0]
+
+        # keys the cached analysis results, the same times on another day are a different analysis
+        self.partition_hash = self.partition_key(partition)
+
+        # sessions work on shallow copies, the shared columns are read only
+        self.analysis_data = analysis_data.copy(deep=False)
+
+        # preserve flags of every partition after button clicks and if user adds/removes files
+        self.display_data = self.flag_partition(partition, display_data)
+        st.session_state.audit_flags[partition] = self.display_data["Audit Flag"]
+        st.session_state.audit_partition = partition
+        st.session_state.audit_partition_hash = self.partition_hash
+
+        self.session_state_data = self.display_data
+
+    def partition_key(self, partition):
+        """
+        Hash of one partition of the dataset, keys its analysis results and journaled flags
+        """
+
+        return hashlib.blake2b(
+            f"{self.dataset_hash} {partition}".encode("utf-8"), digest_size=20
+        ).hexdigest()
+
+    def flag_partition(self, partition, display_data):
+        """
+        Adds the flags of a partition to its display data: the flags made in this session, or the journaled flags
+        when the partition was not opened in this session yet.
+
+        Inputs:
+        - partition: (yyyymmdd date, vehicle or None) from self.partitions
+        - display_data: display df of the partition from read_partition
+
+        Returns: pandas dataframe with an Audit Flag column
+        """
+
+        old_flags = st.session_state.setdefault("audit_flags", {}).get(partition)
+        display_data = self.add_flag_column(display_data, old_flags)
+        if old_flags is None:
+            # flags made before a refresh or a server restart
+            with monitor.span("flags.replay"):
+                get_flag_journal().replay(self.partition_key(partition), display_data)
+
+        return display_data
+
+    def clear_flags(self, last_only=False):
+        """
+        Removes the flags of the selected partition from the journal and the session, the flags that are left are
+        replayed from the journal when the partition is selected on the next rerun. Used as a button callback.
+
+        Inputs:
+        - last_only: only undo the latest flagged interval
+
+        Returns: none
+        """
+
+        get_flag_journal().remove(self.partition_hash, last_only)
+        st.session_state.setdefault("audit_flags", {}).pop(self.partition, None)
+
+        # a prepared download no longer has the same flags
+        st.session_state.flag_version = st.session_state.get("flag_version", 0) + 1
+
+    def export_data(self):
+        """
+        Display data of every partition with its flags, for the download. Call after select_partition.
+
+        Returns: pandas dataframe in time order
+        """
+
+        frames = []
+        for partition in self.partitions:
+            if partition == self.partition:
+                frames.append(self.display_data)
+            else:
+                analysis_path, display_path, _ = self.partition_files[partition]
+                _, display_data = self.read_partition(analysis_path, display_path)
+                frames.append(self.flag_partition(partition, display_data))
+
+        if len(frames) == 1:
+            return frames[0]
+
+        export = pd.concat(frames)
+        if not export.index.is_monotonic_increasing:
+            # vehicles measure at the same times
+            export = export.sort_index(kind="stable")
+
+        return export
+
+    def partition_label(self, partition):
+        """
+        Name of a partition for the date selector, e.g. "2025-07-15, Vehicle 2 (14400 rows)"
+        """
+
+        date, vehicle = partition
+        label = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
+        if vehicle is not None:
+            label += f", {vehicle}"
+
+        return f"{label} ({self.partition_files[partition][2]} rows)"
+
+    @st.cache_resource(max_entries=DATASET_CACHE_ENTRIES, ttl=STORE_CACHE_TTL_S)
+    @monitor.timed("ingest")
+    def load_and_merge_data(_self, dataset_key, _list_of_uploaded_files, align=False):
+        """
+        Loads and merges data files for the specified vehile and date.
+        If there is no data, tells user there was an error and end program.
+        If all dates are not the same, tells user to upload data from the same day.
+
+        Adds column "DateTime" with time in human reasable format.
+
+        Cached as a resource, every session gets the same objects instead of a copy. The two dfs are memory mapped
+        from the data store, so they are read only.
+
+        Inputs:
+        - dataset_key: key of the uploaded files from dataset_key, the cache is keyed by it
+        - _list_of_uploaded_files: list from streamlit uplorad button, not hashed by the cache
+        - align: files of different instruments (different columns) are aligned on a common timeline with
+          align_instruments, otherwise their rows are stacked
+
+        The data is written to the store in one pair of files per local date (and vehicle), see write_partitions.
+
+        Returns: dict of (yyyymmdd date, vehicle or None) -> (path of the cleaned data for analysis, path of the raw
+        data with only datetime and flag columns added, rows), a hash of the uploaded file contents and a df of the
+        memory saved by downcasting each column
+        """
+
+        list_of_uploaded_files = _list_of_uploaded_files
+
+        with monitor.span("ingest.hash"):
+            dataset_hash = _self.hash_uploaded_files(list_of_uploaded_files)
+
+        # load data, compressed files are decompressed while they are parsed
+        combined_dfs = []
+        names = []
+        for name, file, size, compressed in _self.open_uploads(list_of_uploaded_files):
+            if size > 0:
+                with monitor.span("ingest.parse", file=name, bytes=size) as span:
+                    if name.endswith("csv"):
+                        df = _self.read_csv(file, compressed)
+                    elif name.endswith("dat"):
+                        # polars has no whitespace separator, pandas' C parser is still the fastest here
+                        # (it reads streams in chunks)
+                        df = pd.read_csv(file, sep=r"\s+")
+                        df = pl.from_pandas(df)
+                    elif name.endswith("txt"):
+                        df = _self.read_csv(file, compressed, separator="\t")
+                    span["rows"] = df.height
+
+                combined_dfs.append(df)
+                names.append(name)
+
+        # sizes as loaded, summed over the files
+        loaded_sizes = (
+            pd.concat([_self.column_sizes(df) for df in combined_dfs])
+            .groupby(level=0, sort=False)
+            .agg({"dtype": "first", "MB": "sum"})
+        )
+
+        # files with the same time columns and file name (up to a number) come from the same instrument
+        instruments = (
+            _self.group_instruments(combined_dfs, names)
+            if align
+            else {None: combined_dfs}
+        )
+
+        # add datetimes to every file and merge them in time order, one timeline per instrument
+        for pandas_times in [False, True]:
+            try:
+                with monitor.span(
+                    "ingest.merge",
+                    files=len(combined_dfs),
+                    instruments=len(instruments),
+                    pandas_times=pandas_times,
+                ) as span:
+                    frames = _self.stack_instruments(
+                        {
+                            instrument: _self.merge_files(dfs, pandas_times)
+                            for instrument, dfs in instruments.items()
+                        }
+                    )
+                    if len(frames) > 1:
+                        datetime_df = _self.align_instruments(frames)
+                    elif len(instruments) > 1:
+                        # the instruments never measure at the same time, the same rows as without aligning
+                        datetime_df = _self.merge_files(combined_dfs, pandas_times)
+                    else:
+                        datetime_df = frames.popitem()[1]
+                    span["aligned"] = len(frames)
+                    span["rows"] = datetime_df.height
+                break
+            except (pl.exceptions.ComputeError, pl.exceptions.InvalidOperationError):
+                # timestamps polars cannot parse are parsed by pandas instead
+                if pandas_times:
+                    raise
+
+        if len(frames) > 1:
+            # the stacked and the aligned data of the same files are stored apart
+            dataset_hash = hashlib.blake2b(
+                f"{dataset_hash} aligned".encode("ascii"), digest_size=20
+            ).hexdigest()
+
+        # shrink number columns to the narrowest types that keep the values
+        with monitor.span("ingest.downcast", kind="numeric"):
+            datetime_df = _self.downcast_numbers(datetime_df)
+
+        with monitor.span("ingest.clean"):
+            cleaned_df = _self.clean_data(datetime_df.lazy()).collect()
+
+        # repeated text (dates, status strings) to categoricals
+        with monitor.span("ingest.downcast", kind="text"):
+            cleaned_df = _self.downcast_text(cleaned_df)
+            datetime_df = _self.downcast_text(datetime_df)
+        downcast_report = _self.downcast_report(
+            loaded_sizes, datetime_df.drop("DateTime", strict=False)
+        )
+
+        # add flag column, each session replaces it with its own flags
+        datetime_df = datetime_df.with_columns(pl.lit(float("nan")).alias("Audit Flag"))
+
+        with monitor.span("ingest.store") as span:
+            partition_files = _self.write_partitions(
+                cleaned_df, datetime_df, dataset_hash
+            )
+            span["partitions"] = len(partition_files)
+
+        return partition_files, dataset_hash, downcast_report
+
+    def write_partitions(self, cleaned_df, datetime_df, dataset_hash):
+        """
+        Splits the processed data by local date, and by vehicle when the files have a vehicle column, and writes each
+        partition to the data store. Rows without a time cannot be audited and are left out.
+
+        Inputs:
+        - cleaned_df: polars dataframe of the cleaned data for analysis
+        - datetime_df: polars dataframe of the display data, same rows as cleaned_df
+        - dataset_hash: hash of the uploaded files
+
+        Returns: dict of (yyyymmdd date, vehicle or None) -> (analysis path, display path, rows)
+        """
+
+        vehicle = next(
+            (column for column in VEHICLE_COLUMNS if column in datetime_df.columns),
+            None,
+        )
+        keys = ["Audit Date"] + ([vehicle] if vehicle else [])
+
+        def split(df):
+            df = df.filter(pl.col("DateTime").is_not_null()).with_columns(
+                pl.col("DateTime").dt.strftime("%Y%m%d").alias("Audit Date")
+            )
+            return {
+                (key[0], key[1] if vehicle else None): part.drop("Audit Date")
+                for key, part in df.partition_by(
+                    keys, maintain_order=True, as_dict=True
+                ).items()
+            }
+
+        cleaned_parts = split(cleaned_df)
+        datetime_parts = split(datetime_df)
+
+        partition_files = {}
+        for partition, cleaned_part in cleaned_parts.items():
+            date, vehicle_name = partition
+            name = date
+            if vehicle_name is not None:
+                name += "_" + re.sub(r"[^\w.-]+", "-", str(vehicle_name))
+
+            partition_files[partition] = (
+                self.write_to_store(cleaned_part, dataset_hash, f"analysis_{name}"),
+                self.write_to_store(
+                    datetime_parts[partition], dataset_hash, f"display_{name}"
+                ),
+                cleaned_part.height,
+            )
+
+        return partition_files
+
+    @st.cache_resource(max_entries=PARTITION_CACHE_ENTRIES, ttl=STORE_CACHE_TTL_S)
+    def read_partition(_self, analysis_path, display_path):
+        """
+        Memory maps a partition of the data store, shared by all sessions that audit it.
+
+        Inputs:
+        - analysis_path: store file of the cleaned data for analysis
+        - display_path: store file of the display data
+
+        Returns: analysis df and display df, read only
+        """
+
+        with monitor.span("store.map"):
+            analysis_data = _self.read_from_store(analysis_path)
+            display_data = _self.read_from_store(display_path)
+
+        return analysis_data, display_data
+
+    def dataset_key(self, list_of_uploaded_files):
+        """
+        Cheap key of the uploaded files, the contents are only hashed once per upload.
+
+        Inputs:
+        - list_of_uploaded_files: list from streamlit uplorad button
+
+        Returns: sorted tuple of (name, size, content hash) per file
+        """
+
+        return tuple(
+            sorted(
+                (file.name, file.size, self.hash_file(file.file_id, file.size, file))
+                for file in list_of_uploaded_files
+            )
+        )
+
+    @st.cache_resource(max_entries=FILE_HASH_CACHE_ENTRIES)
+    def hash_file(_self, file_id, size, _file):
+        """
+        Hashes the contents of an uploaded file. Cached by the file id streamlit gives every upload, so reruns do not
+        read the bytes again.
+
+        Inputs:
+        - file_id: id of the upload
+        - size: bytes in the file
+        - _file: file from streamlit upload button, not hashed by the cache
+
+        Returns: hex digest string
+        """
+
+        return hashlib.blake2b(_file.getvalue(), digest_size=16).hexdigest()
+
+    def hash_uploaded_files(self, list_of_uploaded_files):
+        """
+        Hashes the names and contents of the uploaded files, used to key cached analysis results.
+
+        Inputs:
+        - list_of_uploaded_files: list from streamlit uplorad button
+
+        Returns: hex digest string
+        """
+
+        file_hash = hashlib.blake2b(digest_size=20)
+        for name, _, content_hash in self.dataset_key(list_of_uploaded_files):
+            file_hash.update(name.encode("utf-8"))
+            file_hash.update(content_hash.encode("ascii"))
+
+        return file_hash.hexdigest()
+
+    def clean_data(self, df, rules=CLEANING_RULES):
+        """
+        Cleans data for autocalibrations and converts units, following the rule table.
+
+        The rules are compiled into one expression per target column, so every column is cleaned in a single
+        pass and only the targeted columns are rewritten.
+
+        Inputs:
+        - df: polars LazyFrame
+        - rules: list of cleaning rules, see CLEANING_RULES
+
+        Returns: polars LazyFrame
+        """
+
+        schema = df.collect_schema()
+        cleaned = {}
+
+        for rule in rules:
+            # rows the rule applies to (missing monitor values count as not matching)
+            monitors = [
+                pl.col(monitor) == value
+                for monitor, value in rule["conditions"].items()
+                if monitor in schema
+            ]
+            if rule["conditions"] and not monitors:
+                continue
+            matched = pl.any_horizontal(monitors).fill_null(False) if monitors else None
+
+            for target in rule["targets"]:
+                if target not in schema:
+                    continue
+
+                # builds on the earlier rules of the same column
+                value = cleaned.get(target, pl.col(target))
+                if rule["action"] == "drop":
+                    changed = pl.lit(None, dtype=schema[target])
+                elif rule["action"] == "scale":
+                    changed = value * rule["factor"]
+                else:
+                    raise ValueError(f"Unknown cleaning action {rule['action']}")
+
+                if matched is not None:
+                    changed = pl.when(matched).then(changed).otherwise(value)
+                cleaned[target] = changed.alias(target)
+
+        return df.with_columns(list(cleaned.values())) if cleaned else df
+
+    def open_uploads(self, list_of_uploaded_files):
+        """
+        Opens the data files of the uploads. Compressed files are decompressed as a stream while the reader
+        parses them, there are no temp files and only a chunk of the decompressed text is held at a time
+        (see read_csv).
+
+        - .gz, .zst: one compressed data file, e.g. audit.dat.gz (zstd is read with pyarrow's codec), other files
+          are skipped with an error
+        - .zip: every data file in the archive, folders, empty and hidden files are skipped
+
+        Inputs:
+        - list_of_uploaded_files: list from streamlit upload button
+
+        Returns: generator of (data file name, readable file, bytes uploaded, whether it is decompressed)
+        """
+
+        for file in list_of_uploaded_files:
+            if file.name.endswith(".zip"):
+                with zipfile.ZipFile(file) as archive:
+                    for member in archive.infolist():
+                        name = os.path.basename(member.filename)
+                        if (
+                            member.is_dir()
+                            or member.file_size == 0
+                            or name.startswith(".")
+                            or not name.endswith(DATA_EXTENSIONS)
+                        ):
+                            continue
+                        with archive.open(member) as stream:
+                            yield name, stream, member.compress_size, True
+
+            elif file.name.endswith((".gz", ".zst")):
+                name = os.path.splitext(file.name)[0]
+                if not name.endswith(DATA_EXTENSIONS):
+                    st.error(
+                        f"{file.name} was skipped, only compressed .csv, .dat and .txt files can be read"
+                    )
+                    continue
+
+                if file.name.endswith(".gz"):
+                    stream = gzip.GzipFile(fileobj=file)
+                else:
+                    stream = pa.CompressedInputStream(
+                        pa.PythonFile(file, mode="r"), "zstd"
+                    )
+                with stream:
+                    yield name, stream, file.size, True
+
+            else:
+                yield file.name, file, file.size, False
+
+    def read_csv(self, file, stream=False, separator=","):
+        """
+        Parses a delimited data file with polars.
+
+        A decompressed stream is parsed CSV_CHUNK_BYTES of lines at a time, so its text is never held whole. Every
+        chunk gets the column types of the first one, which polars infers from the first rows like it does for a
+        whole file. Quoted values cannot span lines.
+
+        Inputs:
+        - file: uploaded file or decompressed stream
+        - stream: parse the file in chunks
+        - separator: column separator
+
+        Returns: polars dataframe
+        """
+
+        if not stream:
+            # the upload is in memory already
+            return pl.read_csv(file, separator=separator)
+
+        frames = []
+        schema = None
+        header = None
+        rest = b""
+        while True:
+            chunk = file.read(CSV_CHUNK_BYTES)
+            text = rest + chunk
+
+            if header is None:
+                # the header line is put in front of every chunk
+                end = text.find(b"\n") + 1
+                if end == 0 and chunk:
+                    rest = text
+                    continue
+                header, text = (text[:end], text[end:]) if end else (text, b"")
+
+            if chunk:
+                # a line cut at the end of the chunk goes with the next one
+                end = text.rfind(b"\n") + 1
+                text, rest = text[:end], text[end:]
+
+            if text:
+                frame = pl.read_csv(header + text, separator=separator, schema=schema)
+                schema = frame.schema
+                frames.append(frame)
+
+            if not chunk:
+                break
+
+        if not frames:
+            # header only
+            return pl.read_csv(header or b"", separator=separator)
+
+        return pl.concat(frames)
+
+    def group_instruments(self, dfs, names):
+        """
+        Groups the files by instrument. Files of one instrument have the same time columns (TIME_COLUMNS) and file
+        names that only differ in a trailing number or date, e.g. ptr_00.csv and ptr_01.csv. Other columns may
+        differ, e.g. a compound added in a later file.
+
+        Inputs:
+        - dfs: list of polars dataframes, one per file
+        - names: file names of the dfs
+
+        Returns: dict of instrument name (file name without the number) -> list of its dfs, in upload order
+        """
+
+        groups = {}
+        for df, name in zip(dfs, names):
+            time_column = next(
+                (column for column in TIME_COLUMNS if column in df.columns), None
+            )
+            # e.g. "ptr" for ptr_00.csv, ptr_01.csv
+            prefix = os.path.splitext(name)[0].rstrip(" _-0123456789")
+            groups.setdefault((time_column, prefix), []).append(df)
+
+        instruments = {}
+        for number, ((_, prefix), group) in enumerate(groups.items(), start=1):
+            instrument = prefix
+            if not instrument or instrument in instruments:
+                instrument = f"instrument {number}"
+            instruments[instrument] = group
+
+        return instruments
+
+    def stack_instruments(self, frames):
+        """
+        Stacks instruments that do not measure at the same time, e.g. hourly files of one instrument with different
+        names. Only instruments whose times overlap are aligned.
+
+        Every instrument, in order of its first time, goes after the first stack that ends before it starts.
+
+        Inputs:
+        - frames: dict of instrument name -> polars dataframe sorted by DateTime (from merge_files)
+
+        Returns: dict of instrument name (the first of the stack) -> polars dataframe sorted by DateTime
+        """
+
+        if any(
+            "DateTime" not in frame.columns or frame.height == 0
+            for frame in frames.values()
+        ):
+            # no times to compare
+            return frames
+
+        stacks = {}
+        for instrument in sorted(
+            frames, key=lambda instrument: frames[instrument]["DateTime"][0]
+        ):
+            frame = frames[instrument]
+            for stack in stacks.values():
+                if stack[-1]["DateTime"][-1] < frame["DateTime"][0]:
+                    stack.append(frame)
+                    break
+            else:
+                stacks[instrument] = [frame]
+
+        return {
+            instrument: pl.concat(stack, how="diagonal_relaxed")
+            for instrument, stack in stacks.items()
+        }
+
+    def align_instruments(self, frames):
+        """
+        Puts the data of several instruments on one timeline.
+
+        The instrument with the most rows sets the timeline, the rows of the others are joined to its rows by
+        the nearest time within ALIGN_TOLERANCE_S (and the same vehicle). Rows of the other instruments with no
+        row of the main instrument that close are added as rows of their own, so no data is dropped. Columns both
+        have keep the main instrument's name, the others get the instrument's name appended.
+
+        Inputs:
+        - frames: dict of instrument name -> polars dataframe sorted by DateTime (from merge_files)
+
+        Returns: polars dataframe sorted by DateTime, one row per row of the main instrument and per unmatched row
+        """
+
+        if any("DateTime" not in frame.columns for frame in frames.values()):
+            # no time columns to align on
+            return pl.concat(list(frames.values()), how="diagonal")
+
+        main = max(frames, key=lambda instrument: frames[instrument].height)
+        aligned = frames[main]
+
+        for instrument, frame in frames.items():
+            if instrument == main:
+                continue
+
+            vehicles = [
+                column
+                for column in VEHICLE_COLUMNS
+                if column in aligned.columns and column in frame.columns
+            ][:1]
+            frame = frame.rename(
+                {
+                    column: f"{column} ({instrument})"
+                    for column in frame.columns
+                    if column in aligned.columns
+                    and column not in ["DateTime"] + vehicles
+                }
+            )
+            timeline = aligned.select(
+                pl.col(["DateTime"] + vehicles), pl.col("DateTime").alias("matched")
+            )
+            aligned = aligned.join_asof(
+                frame,
+                on="DateTime",
+                by=vehicles or None,
+                strategy="nearest",
+                tolerance=timedelta(seconds=ALIGN_TOLERANCE_S),
+                check_sortedness=False,
+            )
+
+            # rows outside the timeline, e.g. the instrument ran longer than the main one
+            unmatched = (
+                frame.join_asof(
+                    timeline,
+                    on="DateTime",
+                    by=vehicles or None,
+                    strategy="nearest",
+                    tolerance=timedelta(seconds=ALIGN_TOLERANCE_S),
+                    check_sortedness=False,
+                )
+                .filter(pl.col("matched").is_null())
+                .drop("matched")
+            )
+            if unmatched.height > 0:
+                aligned = pl.concat([aligned, unmatched], how="diagonal_relaxed").sort(
+                    "DateTime", maintain_order=True
+                )
+
+        return aligned
+
+    def merge_files(self, dfs, pandas_times=False):
+        """
+        Adds datetimes to every file and merges the files in time order.
+
+        Every file is sorted and deduplicated on its own, instrument files are already in order so this is close
+        to linear. Files whose times do not overlap are put one after the other without sorting, overlapping
+        files are merged k ways (merge_sorted in a balanced tree). Rows without a time are dropped.
+
+        Inputs:
+        - dfs: list of polars dataframes, one per file
+        - pandas_times: parse timestamp text with pandas, for formats polars does not recognize
+
+        Returns: polars dataframe sorted by DateTime and without duplicate times
+        """
+
+        frames = pl.collect_all([self.add_datetimes(df, pandas_times) for df in dfs])
+        if not frames or any("DateTime" not in frame.columns for frame in frames):
+            # no time columns, nothing to sort by
+            return pl.concat(frames, how="diagonal")
+
+        # the same columns in every file, in the order they first appear
+        schema = {}
+        for frame in frames:
+            for column, dtype in frame.schema.items():
+                schema.setdefault(column, dtype)
+
+        # sort and deduplicate every file on its own, times shared by files keep the row of the file uploaded first
+        frames = [
+            frame.drop_nulls("DateTime").select(
+                pl.col(column)
+                if column in frame.columns
+                else pl.lit(None, dtype).alias(column)
+                for column, dtype in schema.items()
+            )
+            for frame in frames
+        ]
+        frames = [
+            frame
+            if frame["DateTime"].is_sorted()
+            else frame.sort("DateTime", maintain_order=True)
+            for frame in frames
+            if frame.height > 0
+        ] or frames[:1]
+
+        # files that each end before the next one starts go one after the other
+        in_time_order = sorted(frames, key=lambda frame: frame["DateTime"][0])
+        if all(
+            earlier["DateTime"][-1] < later["DateTime"][0]
+            for earlier, later in zip(in_time_order[:-1], in_time_order[1:])
+        ):
+            return pl.concat(in_time_order)
+
+        # k way merge, neighbours are merged so every row is merged log(k) times
+        while len(frames) > 1:
+            frames = [
+                frames[i].merge_sorted(frames[i + 1], key="DateTime")
+                if i + 1 < len(frames)
+                else frames[i]
+                for i in range(0, len(frames), 2)
+            ]
+
+        vehicles = [column for column in VEHICLE_COLUMNS if column in schema][:1]
+        return frames[0].unique(
+            subset=["DateTime"] + vehicles, keep="first", maintain_order=True
+        )
+
+    def add_datetimes(self, df, pandas_times=False):
+        """
+        Adds datetime column to data, in local time.
+
+        Inputs:
+        - df: polars dataframe of one file
+        - pandas_times: parse timestamp text with pandas, for formats polars does not recognize
+
+        Returns: polars LazyFrame without duplicate times, merge_files sorts it
+        """
+
+        mountain_time = "America/Denver"
+        query = df.lazy()
+
+        if "DateTime" in df.columns:
+            query = query.with_columns(
+                self._parse_times(pl.col("DateTime"), pandas_times, has_offset=True)
+                .dt.convert_time_zone(mountain_time)
+                .alias("DateTime")
+            )
+
+        elif "UTC Time" in df.columns:
+            # check if UTC Time column frozen
+            utc_time = df["UTC Time"]
+            all_same = bool((utc_time == utc_time[0]).fill_null(False).all())
+            if all_same:
+                monitor.annotate(frozen_utc_time=True)
+                # use UNIX timestemp column instead, it is ahead of UTC by the UTC offset of mountain time
+                query = query.with_columns(
+                    self._from_skewed_unix_seconds(
+                        pl.col("UNIX timestamp of the measure time (s)"), mountain_time
+                    )
+                    .dt.convert_time_zone(mountain_time)
+                    .alias("DateTime")
+                )
+
+            else:
+                # change type of UTC columns from floats -> ints -> strings
+                query = query.with_columns(
+                    pl.col("UTC Date").cast(pl.Int64).cast(pl.String),
+                    pl.col("UTC Time")
+                    .cast(pl.Float64)
+                    .round(0)
+                    .cast(pl.Int64)
+                    .cast(pl.String)
+                    .str.zfill(6),  # adding padding for correct dates
+                )
+
+                # convert times to datetimes (in UTC for now)
+                query = query.with_columns(
+                    pl.concat_str(pl.col("UTC Date").str.zfill(8), pl.col("UTC Time"))
+                    .str.to_datetime("%d%m%Y%H%M%S", time_unit="ns", time_zone="UTC")
+                    .dt.convert_time_zone(mountain_time)
+                    .alias("DateTime")
+                )
+
+        elif "time" in df.columns:
+            # naive mountain standard time, the time column is dropped
+            query = query.with_columns(
+                self._parse_times(pl.col("time"), pandas_times)
+                .dt.replace_time_zone("Etc/GMT+7")
+                .dt.convert_time_zone(mountain_time)
+                .alias("DateTime")
+            ).drop("time")
+
+        elif "DATE" in df.columns:
+            # Combine the "DATE" and "TIME" columns
+            query = query.with_columns(
+                self._parse_times(
+                    pl.concat_str(
+                        pl.col("DATE").cast(pl.String),
+                        pl.col("TIME").cast(pl.String),
+                        separator=" ",
+                    ),
+                    pandas_times,
+                )
+                .dt.replace_time_zone("UTC")
+                .dt.convert_time_zone(mountain_time)
+                .alias("DateTime")
+            )
+
+        # AIM txt files
+        elif "Datetime (UTC)" in df.columns:
+            query = query.with_columns(
+                self._parse_times(pl.col("Datetime (UTC)"), pandas_times)
+                .dt.replace_time_zone("UTC")
+                .dt.convert_time_zone(mountain_time)
+                .alias("DateTime")
+            )
+
+        else:
+            return query
+
+        # remove duplicate times, vehicles measure at the same times
+        vehicles = [column for column in VEHICLE_COLUMNS if column in df.columns][:1]
+        return query.unique(
+            subset=["DateTime"] + vehicles, keep="first", maintain_order=True
+        )
+
+    def _parse_times(self, text, pandas_times, has_offset=False):
+        """
+        Parses timestamp text to datetimes.
+
+        Inputs:
+        - text: polars expression of the timestamp strings
+        - pandas_times: parse with pandas (any format pandas recognizes) instead of polars
+        - has_offset: the strings end with a UTC offset, the result is in UTC
+
+        Returns: polars expression
         """
-        Processes uploaded data files
 
-        Created two dfs; one with the cleaned data for analysis (analysis data), and the second is the working df
-        that is used to add new columns and flags, and is also displayed at the top of the UI.
+        time_zone = "UTC" if has_offset else None
+        if not pandas_times:
+            return text.str.to_datetime(time_unit="ns", time_zone=time_zone)
+
+        return text.map_batches(
+            lambda times: pl.from_pandas(
+                pd.to_datetime(times.to_pandas(), format="mixed", utc=has_offset)
+            ),
+            return_dtype=pl.Datetime("ns", time_zone),
+        )
+
+    def _from_unix_seconds(self, seconds):
+        """
+        Converts UNIX seconds to datetimes, rounding the fraction to nanoseconds the way pandas does.
 
         Inputs:
-        - uploaded_files: list of uploaded files from streamlit
+        - seconds: polars expression
 
-        Returns: none
+        Returns: polars expression of naive datetimes
         """
 
-        self.analysis_data, self.display_data, self.audit_date = (
-            self.load_and_merge_data(uploaded_files)
+        seconds = seconds.cast(pl.Float64)
+        whole = seconds.cast(pl.Int64)
+        fraction = (seconds - whole).round(9)
+
+        return pl.from_epoch(
+            whole * 1_000_000_000 + (fraction * 1e9).cast(pl.Int64), time_unit="ns"
         )
 
-        # preserve display_data after button clicks
-        if "dataframe" not in st.session_state:
-            st.session_state.dataframe = self.display_data
-        else:  # update if user adds/removes files
-            old_flag_col = st.session_state.dataframe["Audit Flag"]
-            self.display_data.update(old_flag_col)
-            st.session_state.dataframe = self.display_data
+    def _from_skewed_unix_seconds(self, seconds, time_zone):
+        """
+        Converts UNIX seconds that are ahead of UTC by the UTC offset of a time zone (6 hours in MDT, 7 in MST)
+        to UTC datetimes, following daylight saving time. The last hour of MST before daylight saving time starts
+        has the same seconds as the first hour of MDT, it is read as MDT.
 
-        self.session_state_data = st.session_state.dataframe
+        Inputs:
+        - seconds: polars expression
+        - time_zone: time zone whose offset the seconds are ahead by
 
-    @st.cache_data
-    def load_and_merge_data(_self, list_of_uploaded_files):
+        Returns: polars expression of UTC datetimes
         """
-        Loads and merges data files for the specified vehile and date.
-        If there is no data, tells user there was an error and end program.
-        If all dates are not the same, tells user to upload data from the same day.
 
-        Adds column "DateTime" with time in human reasable format.
+        skewed = self._from_unix_seconds(seconds).dt.replace_time_zone("UTC")
+
+        # try the daylight saving time offset first, the standard time offset is one hour more
+        daylight_offset, standard_offset = [
+            pl.duration(hours=hours, time_unit="ns") for hours in MOUNTAIN_UTC_OFFSETS_H
+        ]
+        daylight = skewed - daylight_offset
+        local = daylight.dt.convert_time_zone(time_zone)
+        offset = local.dt.base_utc_offset() + local.dt.dst_offset()
+
+        return (
+            pl.when(offset == -daylight_offset)
+            .then(daylight)
+            .otherwise(skewed - standard_offset)
+        )
+
+    def write_to_store(self, df, dataset_hash, name):
+        """
+        Writes processed data to an uncompressed arrow file in the data store, so it can be memory mapped.
+
+        Missing floats are stored as NaN, so the pandas columns can share the arrow buffers (no validity mask to
+        apply). The file is written next to its final path and moved over it, sessions that still map an older
+        file keep reading that one.
 
         Inputs:
-        - list_of_uploaded_files: list from streamlit uplorad button
+        - df: polars dataframe
+        - dataset_hash: hash of the uploaded files
+        - name: which data this is, e.g. "analysis"
 
-        Returns: df of cleaned data for analysis and raw df with only datetime column added and the date of analysis
+        Returns: path to the arrow file
         """
 
-        # load data if not zip file
-        combined_dfs = []
-        for file in list_of_uploaded_files:
-            if file.size > 0:
-                print(f"loading {file.name}")
-                if file.name.endswith("csv"):
-                    df = pl.read_csv(file)
-                elif file.name.endswith("dat"):
-                    df = pd.read_csv(file, delim_whitespace=True)
-                    df = pl.from_pandas(df)
-                elif file.name.endswith("txt"):
-                    df = pl.read_csv(file, separator="\t")
+        store = os.environ.get("AUDIT_DATA_STORE", DEFAULT_DATA_STORE)
+        os.makedirs(store, exist_ok=True)
+        self.prune_store(store)
 
-                combined_dfs.append(df)
+        path = os.path.join(store, f"{dataset_hash}_{name}.arrow")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+
+        df = df.with_columns(pl.col(pl.Float32, pl.Float64).fill_null(float("nan")))
+        df.write_ipc(temp_path, compression="uncompressed")
+        os.replace(temp_path, path)
+
+        return path
+
+    def prune_store(self, store):
+        """
+        Deletes store files that were not written for DATA_STORE_MAX_AGE_S.
+
+        Sessions that still map a deleted file keep reading it, the file is only released after they are done.
+        """
 
-        merged_df = pl.concat(combined_dfs, how="diagonal")
-        merged_df = merged_df.to_pandas()
+        oldest = time.time() - DATA_STORE_MAX_AGE_S
+        for entry in os.scandir(store):
+            try:
+                if entry.stat().st_mtime < oldest:
+                    os.remove(entry.path)
+            except OSError:
+                # already removed by another session, or still open on windows
+                pass
 
-        # clean data
-        cleaned_df = _self.clean_data(merged_df)
-        # add datetimes
-        cleaned_df = _self.add_datetimes(cleaned_df)
-        audit_date = cleaned_df.index[0].date().strftime("%Y%m%d")
+    def read_from_store(self, path):
+        """
+        Memory maps an arrow file of the data store as pandas, indexed by datetime.
 
-        # made column with just datetimes
-        datetime_df = _self.add_datetimes(merged_df)
+        The number columns share the mapped buffers instead of being copied, so every session reads the same
+        page cached copy:
+        - every column is its own block (split_blocks), so nothing is concatenated
+        - text stays in arrow memory as pd.ArrowDtype
 
-        # add flag column
-        datetime_df = _self.add_flag_column(datetime_df)
+        The shared columns are read only, columns are replaced rather than written into.
 
-        return cleaned_df, datetime_df, audit_date
+        Inputs:
+        - path: arrow file written by write_to_store
 
-    def clean_data(self, df):
+        Returns: pandas dataframe
         """
-        Cleans data for autocalibrations
+
+        df = pl.read_ipc(path, memory_map=True, rechunk=False)
+        pandas_df = df.to_pandas(
+            split_blocks=True,
+            types_mapper=lambda arrow_type: (
+                pd.ArrowDtype(arrow_type) if arrow_type in ARROW_TEXT_TYPES else None
+            ),
+        )
+        if "DateTime" in pandas_df.columns:
+            # make Datetimes col the index
+            pandas_df.set_index("DateTime", inplace=True)
+
+        return pandas_df
+
+    def downcast_numbers(self, df):
         """
+        Stores each number column in the narrowest type that keeps all of its values:
+        - whole numbers without gaps (int or float) -> smallest int/uint
+        - whole numbers with gaps up to 2**24, or floats with at most FLOAT32_DIGITS significant digits -> float32
+
+        Timestamps, GPS coordinates and anything else that needs float64 are left as they are.
 
-        df = df.copy()
+        Inputs:
+        - df: polars dataframe
 
-        # clean data
-        if "GSU_PUMP_ON monitor []" in df.columns:
-            df.loc[df["GSU_PUMP_ON monitor []"] == 0, "Benzene C6H6+"] = np.nan
-        if "GSU_VALVE_PR1 monitor []" in df.columns:
-            df.loc[df["GSU_VALVE_PR1 monitor []"] == 1, "Benzene C6H6+"] = np.nan
-        if "GSU_VALVE_PR2 monitor []" in df.columns:
-            df.loc[df["GSU_VALVE_PR2 monitor []"] == 1, "Benzene C6H6+"] = np.nan
+        Returns: polars dataframe
+        """
 
-        # convert HCN to ppb
-        if "HCNI-" in df.columns:
-            df["HCNI-"] = df["HCNI-"] * 1e-3
+        columns = [
+            column
+            for column, dtype in df.schema.items()
+            if dtype.is_integer() or dtype == pl.Float64
+        ]
+        if not columns or df.height == 0:
+            return df
+
+        # stats of all columns in one query
+        stats = (
+            df.lazy()
+            .select(
+                expression
+                for i, column in enumerate(columns)
+                for expression in self._number_stats(pl.col(column), f"{i}:")
+            )
+            .collect()
+            .row(0, named=True)
+        )
 
-        if "HCNI- [pptv]" in df.columns:
-            df["HCNI- [pptv]"] = df["HCNI- [pptv]"] * 1e-3
+        casts = []
+        for i, column in enumerate(columns):
+            new_type = self._narrowest_number_type(
+                df[column], **{key: stats[f"{i}:{key}"] for key in NUMBER_STATS}
+            )
+            if new_type is not None:
+                casts.append(pl.col(column).cast(new_type))
 
-        return df
+        return df.with_columns(casts)
 
-    def add_datetimes(self, df):
+    def _number_stats(self, column, prefix):
         """
-        Adds datetime column to data
+        Expressions for the values downcast_numbers needs to choose the type of a column (see NUMBER_STATS)
         """
 
-        # check if index is already datetimes
-        if isinstance(df.index, pd.DatetimeIndex):
-            pass
+        values = column.cast(pl.Float64)
+        finite = values.filter(values.is_finite())
 
-        else:
-            if "DateTime" in df.columns:
-                df["DateTime"] = pd.to_datetime(df["DateTime"], format="mixed")
-                # make Datetimes col the index
-                df.set_index(["DateTime"], inplace=True)
-
-                # set the timezone to local
-                mountain_time = pytz.timezone("America/Denver")
-                df.index = df.index.tz_convert(mountain_time)
-
-            elif "UTC Time" in df.columns:
-                # check if UTC Time column frozen
-                all_same = (df["UTC Time"] == df["UTC Time"].iloc[0]).all()
-                if all_same:
-                    print("all dates the same")
-                    # use UNIX timestemp column instead
-                    df["DateTime"] = pd.to_datetime(
-                        df["UNIX timestamp of the measure time (s)"], unit="s"
-                    )
+        return [
+            (finite.len() < column.len()).alias(prefix + "gaps"),
+            (finite == finite.round(0)).all().alias(prefix + "whole"),
+            finite.min().alias(prefix + "smallest"),
+            finite.max().alias(prefix + "largest"),
+            finite.abs().filter(finite != 0).min().alias(prefix + "tiniest"),
+        ]
+
+    def _narrowest_number_type(self, series, gaps, whole, smallest, largest, tiniest):
+        """
+        Chooses the type of a number column from its stats.
 
-                    # sort so datetimes are in order
-                    df = df.sort_values(by="DateTime")
+        Returns: polars dtype, or None to keep the column as it is
+        """
 
-                    # make DateTime column the index
-                    df.set_index(["DateTime"], inplace=True)
+        dtype = series.dtype
 
-                    # convert times to local mountain time
-                    utc_6 = pytz.FixedOffset(
-                        6 * 60
-                    )  ### THIS WILL PROBABLY ONLY WORK DURING DAYLIGHT SAVINGS TIMES
-                    mountain_time = pytz.timezone("America/Denver")
-                    df.index = df.index.tz_localize(utc_6).tz_convert(mountain_time)
+        # no values at all
+        if smallest is None:
+            return pl.Float32
 
-                else:
-                    # change type of UTC columns from floats -> ints -> strings
-                    df["UTC Date"] = df["UTC Date"].astype(int).astype(str)
-                    df["UTC Time"] = (
-                        df["UTC Time"].round().astype(int).astype(str).str.zfill(6)
-                    )  # adding padding for correct dates
-
-                    # # export df to a csv incase there is an error
-                    # df.to_csv('df.csv')
-
-                    # convert times to datetimes (in UTC for now)
-                    df["DateTime"] = pd.to_datetime(
-                        df["UTC Date"] + df["UTC Time"], format="%d%m%Y%H%M%S"
-                    )
+        if whole and not gaps:
+            # e.g. monitor columns, satellite counts
+            for new_type, numpy_type in INT_TYPES[smallest >= 0]:
+                info = np.iinfo(numpy_type)
+                if info.min <= smallest and largest <= info.max:
+                    return new_type if new_type != dtype else None
+            return pl.Int64 if dtype == pl.Float64 and largest < 2**63 else None
 
-                    # sort so datetimes are in order
-                    df = df.sort_values(by="DateTime")
+        if whole and max(-smallest, largest) <= FLOAT32_MAX_EXACT_INT:
+            return pl.Float32
 
-                    # make DateTime column the index
-                    df.set_index(["DateTime"], inplace=True)
+        # float32 loses digits to subnormals below tiny
+        if (
+            dtype == pl.Float64
+            and max(-smallest, largest) < np.finfo(np.float32).max
+            and tiniest >= np.finfo(np.float32).tiny
+        ):
+            values = series.to_numpy()
+            values = values[np.isfinite(values)]
 
-                    # convert times to local mountain time
-                    mountain_time = pytz.timezone("America/Denver")
-                    df.index = df.index.tz_localize("UTC").tz_convert(mountain_time)
+            # full precision instrument data usually fails on the first values already
+            if self._has_float32_digits(
+                values[:FLOAT32_SAMPLE]
+            ) and self._has_float32_digits(values):
+                return pl.Float32
 
-            elif "time" in df.columns:
-                # convert to datetimes and sort
-                df["DateTime"] = pd.to_datetime(df["time"])
-                df = df.sort_values(by="DateTime")
+        return None
 
-                # drop time column
-                df.drop("time", axis=1, inplace=True)
+    def _has_float32_digits(self, values):
+        """
+        Checks that every value has at most FLOAT32_DIGITS significant digits, so float32 keeps it as written.
 
-                # make Datetimes col the index
-                df.set_index(["DateTime"], inplace=True)
+        Inputs:
+        - values: numpy array of finite floats
 
-                # set timesone to local
-                mountain_time = pytz.timezone("America/Denver")
-                mst = pytz.timezone("Etc/GMT+7")
-                df.index = df.index.tz_localize(mst).tz_convert(mountain_time)
+        Returns: True/False
+        """
 
-            elif "DATE" in df.columns:
-                # Combine the "DATE" and rounded "TIME" columns
-                df["DateTime"] = pd.to_datetime(
-                    df["DATE"] + " " + df["TIME"].astype(str)
-                )
+        nonzero = np.abs(values[values != 0])
 
-                # make Datetimes col the index
-                df.set_index(["DateTime"], inplace=True)
+        # round every value to FLOAT32_DIGITS significant digits and see if it changed
+        rounded = round_significant(nonzero, FLOAT32_DIGITS)
 
-                # set time to local
-                mountain_time = pytz.timezone("America/Denver")
-                df.index = df.index.tz_localize("UTC").tz_convert(mountain_time)
+        return bool((np.abs(rounded - nonzero) <= 1e-12 * nonzero).all())
 
-            # AIM txt files
-            elif "Datetime (UTC)" in df.columns:
-                df["DateTime"] = pd.to_datetime(df["Datetime (UTC)"])
-                df.set_index(["DateTime"], inplace=True)
-                mountain_time = pytz.timezone("America/Denver")
-                df.index = df.index.tz_localize("UTC").tz_convert(mountain_time)
+    def downcast_text(self, df):
+        """
+        Converts text columns with repeated values (dates, status strings) to categoricals.
 
-        # remove duplicate indices
-        df = df[~df.index.duplicated(keep="first")]
+        Inputs:
+        - df: polars dataframe
 
-        return df
+        Returns: polars dataframe
+        """
+
+        columns = [column for column, dtype in df.schema.items() if dtype == pl.String]
+        if not columns or df.height == 0:
+            return df
+
+        n_unique = df.select(pl.col(columns).n_unique()).row(0, named=True)
+
+        return df.with_columns(
+            pl.col(column).cast(pl.Categorical)
+            for column in columns
+            if n_unique[column] <= CATEGORY_MAX_UNIQUE * df.height
+        )
+
+    def column_sizes(self, df):
+        """
+        Type and memory of each column.
+
+        Inputs:
+        - df: polars dataframe
+
+        Returns: pandas df indexed by column with the dtype and MB of each column
+        """
+
+        return pd.DataFrame(
+            {
+                "dtype": [str(dtype) for dtype in df.dtypes],
+                "MB": [df[column].estimated_size("mb") for column in df.columns],
+            },
+            index=df.columns,
+        )
+
+    def downcast_report(self, before, df):
+        """
+        Memory saved in each column that changed type since it was loaded.
+
+        Inputs:
+        - before: column_sizes of the loaded data
+        - df: the data as it is kept
+
+        Returns: df with the old and new type and MB of each column, largest savings first
+        """
+
+        after = self.column_sizes(df)
+        changed = before.join(after, how="inner", lsuffix=" before", rsuffix=" after")
+        changed = changed[changed["dtype before"] != changed["dtype after"]]
+
+        report = pd.DataFrame(
+            {
+                "Column": changed.index,
+                "Before": changed["dtype before"].to_numpy(),
+                "After": changed["dtype after"].to_numpy(),
+                "Before (MB)": changed["MB before"].to_numpy(),
+                "After (MB)": changed["MB after"].to_numpy(),
+                "Saved (MB)": (changed["MB before"] - changed["MB after"]).to_numpy(),
+            }
+        )
+
+        return report.sort_values("Saved (MB)", ascending=False, ignore_index=True)
 
-    def add_flag_column(self, df):
+    def add_flag_column(self, df, old_flags=None):
         """
-        Adds column for flagging different types of audits.
+        Adds a writable column for flagging different types of audits, the other columns stay shared.
 
         Inputs:
-        - df: pandas dataframe
+        - df: pandas dataframe from the data store
+        - old_flags: flags of an earlier upload to carry over, None for no flags
 
         Returns: pandas dataframe
         """
 
-        df["Audit Flag"] = np.nan
+        flags = pd.Series(np.nan, index=df.index, name="Audit Flag")
+        if old_flags is not None:
+            flags.update(old_flags)
+
+        df = df.copy(deep=False)
+        df["Audit Flag"] = flags
 
         return df
 
@@ -308,24 +1525,35 @@ class DataAnalysisTools:
     Class with functions that do the various analysis.
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, display=st, pool=None):
+        """
+        Inputs:
+        - display: where tables are displayed, streamlit or an AnalysisReport
+        - pool: AnalysisPool the grouping runs in, None to run it in this process
+        """
+
+        self.display = display
+        self.pool = pool
 
     def localize_time_inputs(self, time_entry, audit_date):
         """
         Turns user's time input into a datetime and sets the timezone as MT.
+
+        The time is read with the UTC offset America/Denver has on the audit date (MDT or MST). A time repeated when
+        daylight saving time ends is read as MST, a time skipped when it starts is moved forward.
+
+        Returns: pandas Timestamp, its value is the UTC epoch in nanoseconds
         """
 
         # convert to datetime
         dt = datetime.strptime(audit_date + " " + time_entry, "%Y%m%d %H:%M")
 
-        # set local timezone
-        local_tz = pytz.timezone("America/Denver")
-
         # localize the datetime
-        localized_dt = local_tz.localize(dt)
+        localized_dt = pd.Timestamp(dt).tz_localize(
+            "America/Denver", ambiguous=False, nonexistent="shift_forward"
+        )
 
-        print(f"{time_entry} converted to {localized_dt}")
+        logger.debug("%s converted to %s", time_entry, localized_dt)
 
         return localized_dt
 
@@ -336,11 +1564,16 @@ class DataAnalysisTools:
         Returns series
         """
 
-        # select chunk of data for specified time range and turn to series
-        analysis_data = df[(df.index >= start_time) & (df.index <= end_time)][compound]
+        # select chunk of data for specified time range and turn to series, only the compound column is read
+        with monitor.span("window_selection", compound=compound) as span:
+            analysis_data = (
+                df[compound].iloc[time_rows(df.index, start_time, end_time)].copy()
+            )
+            span["rows"] = len(analysis_data)
 
-        return analysis_data
+        return to_float64(analysis_data)
 
+    @monitor.timed("grouping")
     def find_ideal_grouping(self, audit_series):
         """
         Finds the ideal grouping of data that minimized the variance
@@ -358,16 +1591,32 @@ class DataAnalysisTools:
         Returns set of data to use for analysis, with its associated datetime
         """
 
+        if self.pool is not None:
+            # CPU bound, a worker process does not hold up the other sessions, it reports its progress back
+            return self.pool.find_ideal_grouping(
+                audit_series, getattr(self.display, "set_progress", None)
+            )
+
         # remove outliers
         audit_series = self._remove_outliers(audit_series)
 
+        # reports how many points were removed when the analysis runs in the background
+        set_progress = getattr(self.display, "set_progress", None)
+
         # begin removing data
+        iterations = 0
         variances = []
         means = []
         sil_scores = []
         above_mean_removed_data = []
         below_mean_removed_data = []
         while len(audit_series) > 15:
+            iterations += 1
+            if set_progress is not None and iterations % GROUPING_PROGRESS_EVERY == 0:
+                set_progress(
+                    stage=f"Finding the ideal grouping ({iterations} points removed)"
+                )
+
             # compute variance, mean, and squared distance from data to mean
             variance = audit_series.var()
             data_mean = audit_series.mean()
@@ -386,7 +1635,8 @@ class DataAnalysisTools:
             remove_point = audit_series[max_distance_index]
 
             if isinstance(remove_point, pd.core.series.Series):
-                print("MULTIPLE REMOVE POINTS")
+                # several points share the time of the farthest one
+                monitor.annotate(multiple_remove_points=True)
                 for value in remove_point.values:
                     if (value - data_mean) ** 2 == max_distance:
                         remove_point = value
@@ -402,8 +1652,7 @@ class DataAnalysisTools:
             # compute silhoutte score of the removed point
 
             # apply modified s.score where between cluster distance is distance from avg of 25th percentile
-            Q1 = np.nanpercentile(audit_series, 10)
-            Q3 = np.nanpercentile(audit_series, 90)
+            Q1, Q3 = np.nanquantile(audit_series, [0.1, 0.9])
             low_percentile = removed_series[removed_series <= Q1]
             high_percentile = removed_series[removed_series >= Q3]
 
@@ -462,8 +1711,41 @@ class DataAnalysisTools:
         # plt.legend()
         # plt.show()
 
+        monitor.annotate(iterations=iterations, points=len(audit_series))
+
         return audit_series
 
+    def find_ideal_groupings(self, audit_series_list, progress=(0, 1)):
+        """
+        Finds the ideal grouping of several series, in parallel when there is a pool.
+
+        Inputs:
+        - audit_series_list: list of series, e.g. the window of every compound
+        - progress: fractions of the analysis done before and after the groupings
+
+        Returns: list of series of the ideal groupings, in the same order
+        """
+
+        set_progress = getattr(self.display, "set_progress", None)
+        if self.pool is not None:
+            return self.pool.find_ideal_groupings(
+                audit_series_list, set_progress, progress
+            )
+
+        groupings = []
+        for audit_series in audit_series_list:
+            groupings.append(self.find_ideal_grouping(audit_series))
+            if set_progress is not None:
+                set_progress(
+                    progress[0]
+                    + (progress[1] - progress[0])
+                    * len(groupings)
+                    / len(audit_series_list),
+                    f"Found {len(groupings)} of {len(audit_series_list)} ideal groupings",
+                )
+
+        return groupings
+
     def _remove_outliers(self, audit_series):
         """
         Uses IQR to remove outliers.
@@ -471,9 +1753,17 @@ class DataAnalysisTools:
         Returns series with outliers removed
         """
 
-        # remove outliers
-        Q1 = np.nanpercentile(audit_series, 25)
-        Q3 = np.nanpercentile(audit_series, 75)
+        # no quartiles without data
+        if len(audit_series) == 0:
+            return audit_series
+
+        # remove outliers, both quartiles from one pass over the data
+        if OUTLIER_SKETCH_ROWS is not None and len(audit_series) > OUTLIER_SKETCH_ROWS:
+            Q1, Q3 = QuantileSketch.from_values(audit_series, seed=0).quantile(
+                [0.25, 0.75]
+            )
+        else:
+            Q1, Q3 = np.nanquantile(audit_series, [0.25, 0.75])
         IQR = Q3 - Q1
         audit_data_no_outliers = audit_series[
             (audit_series >= (Q1 - 1.5 * IQR)) & (audit_series <= (Q3 + 1.5 * IQR))
@@ -481,12 +1771,70 @@ class DataAnalysisTools:
 
         return audit_data_no_outliers
 
+    def compound_columns(self, df):
+        """
+        Guesses which columns are compounds: number columns that are not instrument, time, iMet or GPS readings.
+
+        Returns: list of column names
+        """
+
+        return [
+            column
+            for column in df.columns
+            if pd.api.types.is_numeric_dtype(df[column])
+            and not any(marker in column.lower() for marker in NON_COMPOUND_MARKERS)
+        ]
+
+    def compute_mdl(self, spike_data, blank_data):
+        """
+        Computes the MDL from the spike (MDL_s) and from the blank (MDL_b) following the EPA MDL procedure,
+        the larger of the two is the MDL.
+
+        Inputs:
+        - spike_data: series of the spike used in the analysis
+        - blank_data: series of the blank used in the analysis
+
+        Returns: dict of the inputs and results of both computations, the MDL, LOD and LOQ
+        """
+
+        # scipy is only loaded once an MDL check is run
+        import scipy.stats as stats
+
+        mdl = {}
+
+        # SDs and means rounded like compute_basic_stats
+        mdl["Spike Points"] = len(spike_data)
+        mdl["Spike t"] = round(stats.t.ppf(0.99, mdl["Spike Points"] - 1), 3)
+        mdl["Spike SD"] = round(spike_data.std(), 3)
+        mdl["MDL_s"] = mdl["Spike t"] * mdl["Spike SD"]
+
+        mdl["Blank Points"] = len(blank_data)
+        mdl["Blank Mean"] = np.max([round(blank_data.mean(), 3), 0])
+        mdl["Blank SD"] = round(blank_data.std(), 3)
+        if mdl["Blank Points"] <= 100:
+            # Students t-statistic
+            mdl["Blank t"] = round(stats.t.ppf(0.99, mdl["Blank Points"] - 1), 3)
+            mdl["MDL_b"] = mdl["Blank Mean"] + mdl["Blank t"] * mdl["Blank SD"]
+        else:
+            # 99th percentile of the samples in rank order
+            mdl["Blank t"] = np.nan
+            ordered_data = np.sort(blank_data)
+            rank = round(mdl["Blank Points"] * 0.99)
+            mdl["MDL_b"] = ordered_data[rank - 1]
+
+        mdl["MDL"] = np.max([mdl["MDL_s"], mdl["MDL_b"]])
+        mdl["LOD"] = mdl["Blank SD"] * 3
+        mdl["LOQ"] = mdl["Blank SD"] * 10
+
+        return mdl
+
     def display_table(self, data):
         """Displays the given data in streamlit"""
 
-        st.write("Data used in analysis:")
-        st.dataframe(data, width=800, height=400, use_container_width=True)
+        self.display.write("Data used in analysis:")
+        self.display.dataframe(data, width=800, height=400, use_container_width=True)
 
+    @monitor.timed("stats")
     def compute_basic_stats(self, analysis_series):
         """
         Computes min, max, median, std for the given data series
@@ -507,52 +1855,323 @@ class DataAnalysisTools:
         stats_df = pd.DataFrame.from_dict(stats, orient="index").T
 
         # display
-        st.write("Statistics:")
-        st.dataframe(stats_df, hide_index=True, use_container_width=True)
+        self.display.write("Statistics:")
+        self.display.dataframe(stats_df, hide_index=True, use_container_width=True)
 
         return stats
 
+    @monitor.timed("stats")
     def compute_audit_stats(self, analysis_series_stat, cal_gas_conc):
         """
         Compute audit stats and displays table
         """
 
-        audit_stats = {}
-
-        audit_stats["Percent Recovery"] = round(
-            (analysis_series_stat["Mean"] / cal_gas_conc) * 100, 3
-        )
-        audit_stats["Max % Recovery"] = round(
-            (analysis_series_stat["Maximum"] / cal_gas_conc) * 100, 3
-        )
-        audit_stats["Min % Recovery"] = round(
-            (analysis_series_stat["Minimum"] / cal_gas_conc) * 100, 3
-        )
-        audit_stats["Percent Difference"] = round(
-            (np.abs(analysis_series_stat["Mean"] - cal_gas_conc) / cal_gas_conc) * 100,
-            3,
-        )
-        avg_val = (
-            analysis_series_stat["Maximum"] + analysis_series_stat["Minimum"]
-        ) / 2
-        audit_stats["Range % Difference"] = round(
-            (
-                (analysis_series_stat["Maximum"] - analysis_series_stat["Minimum"])
-                / avg_val
-            )
-            * 100,
-            3,
+        audit_stats = self.audit_stat_values(
+            analysis_series_stat["Mean"],
+            analysis_series_stat["Maximum"],
+            analysis_series_stat["Minimum"],
+            cal_gas_conc,
         )
 
         audit_stats_df = pd.DataFrame.from_dict(audit_stats, orient="index").T
         # display
-        st.write("Audit Statistics:")
-        st.dataframe(audit_stats_df, hide_index=True, use_container_width=True)
+        self.display.write("Audit Statistics:")
+        self.display.dataframe(
+            audit_stats_df, hide_index=True, use_container_width=True
+        )
+
+    def audit_stat_values(self, mean, maximum, minimum, cal_gas_conc):
+        """
+        Computes the recovery and difference of audit windows from the calibration gas concentration.
+
+        Inputs:
+        - mean, maximum, minimum: stats of the ideal data, numbers or numpy arrays of several windows
+        - cal_gas_conc: the calibration gas concentration, a number or an array like the stats
+
+        Returns: dict of the audit stats, numbers or arrays like the inputs
+        """
+
+        audit_stats = {}
+
+        # a zero concentration has no recovery, it comes out as inf
+        with np.errstate(divide="ignore", invalid="ignore"):
+            audit_stats["Percent Recovery"] = np.round((mean / cal_gas_conc) * 100, 3)
+            audit_stats["Max % Recovery"] = np.round((maximum / cal_gas_conc) * 100, 3)
+            audit_stats["Min % Recovery"] = np.round((minimum / cal_gas_conc) * 100, 3)
+            audit_stats["Percent Difference"] = np.round(
+                (np.abs(mean - cal_gas_conc) / cal_gas_conc) * 100, 3
+            )
+            avg_val = (maximum + minimum) / 2
+            audit_stats["Range % Difference"] = np.round(
+                ((maximum - minimum) / avg_val) * 100, 3
+            )
+
+        return audit_stats
+
+    def fit_calibration(self, concentrations, means):
+        """
+        Least squares line of the measured means against the calibration gas concentrations, for several
+        compounds at once. Levels without data (NaN means) are left out of the fit.
+
+        Inputs:
+        - concentrations: numpy array of the concentration of every level
+        - means: numpy array of the mean of every compound (rows) at every level (columns)
+
+        Returns: dict of slope, intercept and R² (one per compound), fitted values and residuals (like means)
+        """
+
+        measured = ~np.isnan(means)
+        x = np.where(measured, concentrations, np.nan)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_mean = np.nanmean(x, axis=1, keepdims=True)
+            y_mean = np.nanmean(means, axis=1, keepdims=True)
+            sxy = np.nansum((x - x_mean) * (means - y_mean), axis=1)
+            sxx = np.nansum((x - x_mean) ** 2, axis=1)
+
+            slope = sxy / sxx
+            intercept = y_mean[:, 0] - slope * x_mean[:, 0]
+            fitted = slope[:, None] * concentrations + intercept[:, None]
+            residuals = means - fitted
+
+            ss_res = np.nansum(residuals**2, axis=1)
+            ss_tot = np.nansum((means - y_mean) ** 2, axis=1)
+            r_squared = 1 - ss_res / ss_tot
+
+        return {
+            "Slope": slope,
+            "Intercept": intercept,
+            "R²": r_squared,
+            "Fitted": fitted,
+            "Residuals": residuals,
+        }
+
+    def detect_windows(self, df, compound, min_minutes=WINDOW_MIN_MINUTES):
+        """
+        Proposes audit windows: stretches where the compound sits on a steady plateau.
+
+        The rows are summed into blocks and the change points of the block sums are found with PELT on prefix
+        sums, so the search is linear in the rows. Gaps in the data and switches of the GSU valve columns
+        always split windows and autocalibrations are never proposed. Neighbouring segments with about the same
+        level are merged, so a spike or a slow drift does not cut a plateau in two.
+
+        Inputs:
+        - df: analysis data indexed by time
+        - compound: compound header
+        - min_minutes: shortest window proposed
+
+        Returns: df of windows with start and end as 'hh:mm' (rounded inwards), level, SD and a suggested audit
+        """
+
+        with monitor.span("window_detection", compound=compound) as span:
+            times = df.index.asi8
+            values = df[compound].to_numpy(dtype=float)
+            valid = np.isfinite(values)
+
+            block_ns = WINDOW_BLOCK_S * 10**9
+            blocks = (times - times[0]) // block_ns if len(times) else times
+
+            # switches of the valve and pump monitors, autocalibrations are left out like in clean_data
+            switches = np.zeros(len(times), dtype=bool)
+            for column in df.columns:
+                if str(column).startswith(VALVE_PREFIX):
+                    state = np.nan_to_num(df[column].to_numpy(dtype=float), nan=-1)
+                    switches[1:] |= state[1:] != state[:-1]
+                    if column in AUTOCAL_MONITORS:
+                        valid &= state != AUTOCAL_MONITORS[column]
+
+            # rows, sum and sum of squares of every block with data
+            block_ids, positions = np.unique(blocks[valid], return_inverse=True)
+            x = values[valid]
+            counts = np.bincount(positions, minlength=len(block_ids)).astype(float)
+            sums = np.bincount(positions, weights=x, minlength=len(block_ids))
+            squares = np.bincount(positions, weights=x * x, minlength=len(block_ids))
+            span["rows"] = len(x)
+            span["blocks"] = len(block_ids)
+
+            windows = []
+            if len(x) > 1:
+                # noise of the raw values, from the differences so steps and spikes do not count
+                noise = np.median(np.abs(np.diff(x))) / (0.6745 * np.sqrt(2))
+                penalty = WINDOW_PENALTY * max(noise, 1e-12) ** 2 * np.log(len(x))
+                min_size = max(WINDOW_MIN_SEGMENT_S // WINDOW_BLOCK_S, 1)
+
+                # blocks that start a new piece: after a gap or a valve switch
+                breaks = np.flatnonzero(np.diff(block_ids) > 1) + 1
+                switched = np.searchsorted(block_ids, np.unique(blocks[switches]))
+                edges = np.unique(
+                    np.concatenate([[0, len(block_ids)], breaks, switched])
+                )
+                edges = edges[edges <= len(block_ids)]
+
+                segments = []
+                for start, end in zip(edges[:-1], edges[1:]):
+                    ends = self._change_points(
+                        counts[start:end],
+                        sums[start:end],
+                        squares[start:end],
+                        penalty,
+                        min_size,
+                    )
+                    segments.append(
+                        self._merge_segments(
+                            start + np.concatenate([[0], ends]),
+                            counts,
+                            sums,
+                            WINDOW_MERGE_SD * noise,
+                        )
+                    )
+
+                windows = [
+                    window
+                    for piece in segments
+                    for window in self._segment_windows(
+                        piece, block_ids, counts, sums, squares, times[0], df.index.tz
+                    )
+                    if window["Minutes"] >= min_minutes
+                ]
+
+            windows = pd.DataFrame(
+                windows, columns=["Start", "End", "Minutes", "Level", "SD"]
+            )
+            span["windows"] = len(windows)
+
+        # zero air and blanks sit at 0, the cal gas is the highest plateau
+        suggested = np.where(
+            windows["Level"].abs() <= WINDOW_MERGE_SD * windows["SD"],
+            "Zero Air / MDL Blank",
+            "",
+        ).astype(object)
+        if len(windows) > 1:
+            highest = windows["Level"].idxmax()
+            if windows.loc[highest, "Level"] > 2 * windows["Level"].median():
+                suggested[highest] = "Calibration"
+        windows["Suggested"] = suggested
+
+        return windows
+
+    def _change_points(self, counts, sums, squares, penalty, min_size):
+        """
+        PELT change point search for changes in the mean.
+
+        Inputs:
+        - counts, sums, squares: rows, sum and sum of squares of every block
+        - penalty: cost of adding a change point
+        - min_size: fewest blocks in a segment
+
+        Returns: numpy array of the block each segment ends before, the last one is the number of blocks
+        """
+
+        n = len(counts)
+        if n < 2 * min_size:
+            return np.array([n])
+
+        # prefix sums, the cost of a segment is the sum of squared deviations from its mean
+        W = np.concatenate([[0.0], np.cumsum(counts)])
+        S1 = np.concatenate([[0.0], np.cumsum(sums)])
+        S2 = np.concatenate([[0.0], np.cumsum(squares)])
+
+        F = np.full(n + 1, np.inf)
+        F[0] = -penalty
+        last = np.zeros(n + 1, dtype=int)
+        candidates = np.array([0])
+
+        for t in range(min_size, n + 1):
+            # candidates far enough back to end a segment at t
+            usable = np.searchsorted(candidates, t - min_size, side="right")
+            starts = candidates[:usable]
+            costs = (
+                F[starts]
+                + S2[t]
+                - S2[starts]
+                - (S1[t] - S1[starts]) ** 2 / (W[t] - W[starts])
+            )
+            best = np.argmin(costs)
+            F[t] = costs[best] + penalty
+            last[t] = starts[best]
+
+            # prune the candidates that can never be the last change point again
+            candidates = np.concatenate(
+                [starts[costs <= F[t]], candidates[usable:], [t - min_size + 1]]
+            )
+
+        ends = []
+        t = n
+        while t > 0:
+            ends.append(t)
+            t = last[t]
+
+        return np.array(ends[::-1])
+
+    def _merge_segments(self, bounds, counts, sums, tolerance):
+        """
+        Merges neighbouring segments whose levels are within a tolerance
+
+        Inputs:
+        - bounds: block each segment starts at, followed by the end of the last segment
+        - counts, sums: rows and sum of every block
+        - tolerance: largest level difference merged
+
+        Returns: list of (first block, end block) of the merged segments
+        """
+
+        def level(start, end):
+            return sums[start:end].sum() / counts[start:end].sum()
+
+        merged = [[bounds[0], bounds[1]]]
+        for start, end in zip(bounds[1:-1], bounds[2:]):
+            if abs(level(start, end) - level(*merged[-1])) <= tolerance:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+
+        return merged
+
+    def _segment_windows(self, segments, block_ids, counts, sums, squares, origin, tz):
+        """
+        Turns segments of blocks into audit windows, leaving out the first and last block (the transition)
+
+        Returns: list of dicts with Start, End ('hh:mm'), Minutes, Level, SD
+        """
+
+        block_ns = WINDOW_BLOCK_S * 10**9
+        windows = []
+        for start, end in segments:
+            if end - start < 3:
+                continue
+
+            inner = slice(start + 1, end - 1)
+            n = counts[inner].sum()
+            level = sums[inner].sum() / n
+            sd = np.sqrt(max(squares[inner].sum() / n - level**2, 0))
+
+            # rounded inwards to whole minutes, like the forms take them
+            first = pd.Timestamp(origin + block_ids[start + 1] * block_ns, tz="UTC")
+            last = pd.Timestamp(origin + (block_ids[end - 2] + 1) * block_ns, tz="UTC")
+            first = first.tz_convert(tz).ceil("min")
+            last = last.tz_convert(tz).floor("min")
+            if last <= first:
+                continue
+
+            windows.append(
+                {
+                    "Start": first.strftime("%H:%M"),
+                    "End": last.strftime("%H:%M"),
+                    "Minutes": int((last - first).total_seconds() // 60),
+                    "Level": round(level, 4),
+                    "SD": round(sd, 4),
+                }
+            )
+
+        return windows
 
     def curve_fit(self, x_values, y_values):
         """
         Does curve fit for t-stat data
         """
+        # scipy is only loaded once an MDL check is run
+        from scipy.optimize import curve_fit
+
         popt, pcov = curve_fit(self._func, x_values, y_values)
 
         return popt
@@ -560,6 +2179,7 @@ class DataAnalysisTools:
     def _func(self, x, a, b, c):
         return a * (1 / (x + b)) + c
 
+    @monitor.timed("stats")
     def met_difference_computations(self, analysis_data, kestrel_data):
         """
         Computes the absolute difference between the two data streams when their times overlap.
@@ -624,11 +2244,61 @@ class DataAnalysisTools:
         # rename index
         display_df.rename(columns={"index": "DateTime"}, inplace=True)
         display_df.set_index("DateTime", inplace=True)
-        st.write("Met Data")
-        st.dataframe(display_df, width=800, height=400, use_container_width=True)
+        self.display.write("Met Data")
+        self.display.dataframe(
+            display_df, width=800, height=400, use_container_width=True
+        )
+
+        self.display.write("Percent Difference")
+        self.display.dataframe(stats_df, use_container_width=True)
+
+    @monitor.timed("grid_bin")
+    def grid_bin(self, x, y, satellites, cell_size, min_satellites):
+        """
+        Bins projected GPS fixes into square grid cells and aggregates the fix quality
+        of each occupied cell, so downstream plotting scales with cells instead of fixes.
+
+        Inputs:
+        - x: array of projected x coordinates (m)
+        - y: array of projected y coordinates (m)
+        - satellites: array of the number of satellites for each fix
+        - cell_size: width of the grid cells (m)
+        - min_satellites: fixes with fewer satellites than this count as dropouts
+
+        Returns: df with one row per occupied cell (cell center, fixes, min/mean satellites, dropouts)
+        """
 
-        st.write("Percent Difference")
-        st.dataframe(stats_df, use_container_width=True)
+        # integer cell coordinates of each fix
+        col = np.floor((x - x.min()) / cell_size).astype(np.int64)
+        row = np.floor((y - y.min()) / cell_size).astype(np.int64)
+
+        # label occupied cells only (hash based, so no sort of the fixes)
+        cell_codes, cell_ids = pd.factorize(row * (col.max() + 1) + col)
+        n_cells = len(cell_ids)
+
+        fixes = np.bincount(cell_codes, minlength=n_cells)
+        satellite_sum = np.bincount(cell_codes, weights=satellites, minlength=n_cells)
+        dropouts = np.bincount(
+            cell_codes, weights=satellites < min_satellites, minlength=n_cells
+        )
+        min_sats = np.full(n_cells, np.inf)
+        np.minimum.at(min_sats, cell_codes, satellites)
+
+        # cell centers back in projected coordinates
+        cell_row, cell_col = np.divmod(cell_ids, col.max() + 1)
+
+        grid = pd.DataFrame(
+            {
+                "x": x.min() + (cell_col + 0.5) * cell_size,
+                "y": y.min() + (cell_row + 0.5) * cell_size,
+                "Fixes": fixes,
+                "Min Satellites": min_sats,
+                "Mean Satellites": satellite_sum / fixes,
+                "Dropouts": dropouts.astype(np.int64),
+            }
+        )
+
+        return grid
 
 
 class FlagData:
@@ -636,7 +2306,7 @@ class FlagData:
     Class for flagging data. Will be set up so that it persist past streamlit recompiling code
     """
 
-    def __init__(self, df, start_time, end_time, type):
+    def __init__(self, df, start_time, end_time, type, parameters=None):
         """
         Class for flagging data.
 
@@ -645,6 +2315,7 @@ class FlagData:
         - start_time: start time of the data to be flagged
         - end_time: end time of the data to be flagged
         - type: pe of audit/check so the data is properly flagged: 'zero', 'cal', 'mdl', 'met'
+        - parameters: dict of the analysis inputs, kept in the flag journal
         """
 
         # convert start and end times to time aware
@@ -652,6 +2323,7 @@ class FlagData:
         self.start_time = start_time
         self.end_time = end_time
         self.type = type
+        self.parameters = parameters
 
         self.type_to_flag = {"zero": 0, "cal": 1, "mdl": 2, "imet": 3}
 
@@ -662,19 +2334,101 @@ class FlagData:
         Flags data and updates session state to repserve the df
         """
 
-        df.loc[self.start_time : self.end_time, "Audit Flag"] = self.type_to_flag[
-            self.type
-        ]
+        df.iloc[
+            time_rows(df.index, self.start_time, self.end_time),
+            df.columns.get_loc("Audit Flag"),
+        ] = self.type_to_flag[self.type]
 
         # update session state
         self.update_session_state(df)
 
+        # and the journal, so the flags outlive the session
+        dataset_hash = st.session_state.get("audit_partition_hash")
+        if dataset_hash is not None:
+            get_flag_journal().append(
+                dataset_hash,
+                self.start_time,
+                self.end_time,
+                self.type,
+                self.type_to_flag[self.type],
+                self.parameters,
+            )
+
     def update_session_state(self, df):
         """
-        Updates the session state of the display data so that it persists past refreshes.
+        Updates the session state of the flags of the audited partition so that they persist past refreshes.
         """
 
-        st.session_state.dataframe = df
+        audit_flags = st.session_state.setdefault("audit_flags", {})
+        audit_flags[st.session_state.get("audit_partition")] = df["Audit Flag"]
+
+        # a prepared download no longer has every flag
+        st.session_state.flag_version = st.session_state.get("flag_version", 0) + 1
+
+
+class DataTableView:
+    """
+    Pages through the display data so the browser only gets the rows and columns on screen, the filters
+    are applied here instead of in the browser.
+    """
+
+    def __init__(self, df):
+        """
+        Inputs:
+        - df: display df of the audit day
+
+        Returns: none
+        """
+
+        self.df = df
+
+    def filter_rows(self, start_time=None, end_time=None, flag=None):
+        """
+        Finds the rows in a time range with an audit flag.
+
+        Inputs:
+        - start_time, end_time: localized datetimes of the range, None for no limit
+        - flag: value of TABLE_FLAG_FILTERS
+
+        Returns: row positions, a range when no flag is picked
+        """
+
+        rows = time_rows(self.df.index, start_time, end_time)
+        if isinstance(rows, slice):
+            rows = range(rows.start, rows.stop)
+
+        if flag is None:
+            return rows
+
+        flags = self.df["Audit Flag"].to_numpy()[rows]
+        if flag == "unflagged":
+            keep = np.isnan(flags)
+        elif flag == "flagged":
+            keep = ~np.isnan(flags)
+        else:
+            keep = flags == flag
+
+        return np.asarray(rows)[keep]
+
+    def page(self, rows, page, page_rows, columns=None):
+        """
+        Selects one page of the filtered rows.
+
+        Inputs:
+        - rows: row positions from filter_rows
+        - page: page number, starting at 0
+        - page_rows: rows per page
+        - columns: columns to show, None for all of them
+
+        Returns: pandas dataframe
+        """
+
+        page_df = self.df.iloc[rows[page * page_rows : (page + 1) * page_rows]]
+        if columns:
+            page_df = page_df[columns]
+
+        # float32 columns are shown with the decimals they were uploaded with
+        return to_float64(page_df)
 
 
 class AnalysisFinisher:
@@ -685,6 +2439,7 @@ class AnalysisFinisher:
     def __init__(self):
         pass
 
+    @monitor.timed("export")
     def download_csv(self, df):
         """
         Function for downloading df to csv data
@@ -693,7 +2448,8 @@ class AnalysisFinisher:
         - df: display df to save
         """
 
-        download_csv = df.to_csv(index=True).encode("utf-8")
+        # float32 columns are written as float64 so values keep the decimals they were uploaded with
+        download_csv = to_float64(df).to_csv(index=True).encode("utf-8")
 
         current_date = datetime.now().strftime("%Y-%m-%d")
         filename = f"{current_date}_audit_analysis.csv"
@@ -710,5 +2466,5 @@ class AnalysisFinisher:
         - df: display df that has haf flags added to it
         """
 
-        if "dataframe" in st.session_state:
-            del st.session_state.dataframe
+        if "audit_flags" in st.session_state:
+            del st.session_state.audit_flags
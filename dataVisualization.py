@@ -2,24 +2,53 @@
 Code for making plots in streamlit
 """
 
+import functools
+import threading
 import streamlit as st
-import matplotlib.pyplot as plt
-import seaborn as sns
-from matplotlib_scalebar.scalebar import ScaleBar
-from pyproj import CRS, Proj, Transformer, transform
+import numpy as np
+from performanceMonitor import monitor
 
 
-# Customize fonts and sizes
-plt.rcParams.update(
-    {
-        "font.size": 12,
-        "axes.titlesize": 12,
-        "axes.labelsize": 12,
-        "xtick.labelsize": 12,
-        "ytick.labelsize": 12,
-        "legend.fontsize": 12,
-    }
-)
+@functools.cache
+def _load_pyplot():
+    """
+    Imports matplotlib the first time a plot is made, so the app starts without it.
+
+    Returns: matplotlib.pyplot
+    """
+
+    import matplotlib.pyplot as plt
+
+    # Customize fonts and sizes
+    plt.rcParams.update(
+        {
+            "font.size": 12,
+            "axes.titlesize": 12,
+            "axes.labelsize": 12,
+            "xtick.labelsize": 12,
+            "ytick.labelsize": 12,
+            "legend.fontsize": 12,
+        }
+    )
+
+    return plt
+
+
+# pyplot keeps the current figure per process, analyses running in the background plot one at a time
+_PYPLOT_LOCK = threading.RLock()
+
+
+def _plots_with_pyplot(function):
+    """
+    Decorator that holds the pyplot lock while a plot is made
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with _PYPLOT_LOCK:
+            return function(*args, **kwargs)
+
+    return wrapper
 
 
 class DataVisualization:
@@ -27,9 +56,16 @@ class DataVisualization:
     Contains the functions for making the various plots
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, display=st):
+        """
+        Inputs:
+        - display: where plots are displayed, streamlit or an AnalysisReport
+        """
+
+        self.display = display
 
+    @monitor.timed("plot.scatter_plot")
+    @_plots_with_pyplot
     def scatter_plot(self, full_dataset, analysis_series, ideal_data):
         """
         Plots the different parts of the data in different colors
@@ -40,6 +76,8 @@ class DataVisualization:
         - ideal_data: subset of data that will be used for the final analysis
         """
 
+        plt = _load_pyplot()
+
         # plot the timeseries with color selection
         fig, ax = plt.subplots(nrows=2, figsize=(7, 5))
 
@@ -62,8 +100,10 @@ class DataVisualization:
 
         # fig_html = mpld3.fig_to_html(fig)
         # st.components.v1.html(fig_html, height=600)
-        st.pyplot(fig)
+        self.display.pyplot(fig)
 
+    @monitor.timed("plot.scatter_selection")
+    @_plots_with_pyplot
     def scatter_selection(
         self, full_dataset, spikes, blanks, analysis_spike, analysis_blank
     ):
@@ -76,6 +116,8 @@ class DataVisualization:
         - blanks: series of blanks
         """
 
+        plt = _load_pyplot()
+
         fig, ax = plt.subplots(nrows=3, figsize=(7, 7))
         ax[0].plot(spikes, color="blue", marker="o")
         ax[0].plot(analysis_spike, linestyle="None", marker="^", color="green")
@@ -100,8 +142,10 @@ class DataVisualization:
 
         # fig_html = mpld3.fig_to_html(fig)
         # st.components.v1.html(fig_html, height=600)
-        st.pyplot(fig)
+        self.display.pyplot(fig)
 
+    @monitor.timed("plot.histogram_plot")
+    @_plots_with_pyplot
     def histogram_plot(self, ideal_data_series, mean):
         """
         Produces a histogram of data in the analysis window vs the ideal window
@@ -111,6 +155,9 @@ class DataVisualization:
         - mean: mean of the provided data series
         """
 
+        plt = _load_pyplot()
+        import seaborn as sns
+
         # plot distributions of data with stats
         fig = plt.figure(figsize=(8, 6))
         sns.histplot(
@@ -129,13 +176,49 @@ class DataVisualization:
 
         # fig_html = mpld3.fig_to_html(fig)
         # st.components.v1.html(fig_html, height=600)
-        st.pyplot(fig)
+        self.display.pyplot(fig)
 
+    @monitor.timed("plot.calibration_plot")
+    @_plots_with_pyplot
+    def calibration_plot(self, concentrations, means, slope, intercept, compound):
+        """
+        Plots the mean of every calibration level against its concentration, with the fitted line
+
+        Inputs:
+        - concentrations: numpy array of the level concentrations
+        - means: numpy array of the measured mean of every level
+        - slope, intercept: the fitted calibration line
+        - compound: name of the compound
+        """
+
+        plt = _load_pyplot()
+
+        fig, ax = plt.subplots(figsize=(8, 6))
+        ax.scatter(concentrations, means, color="blue", label="Level Means")
+        line = np.array([0, np.max(concentrations)])
+        ax.plot(
+            line,
+            slope * line + intercept,
+            color="orange",
+            label=f"y = {slope:.4f}x + {intercept:.4f}",
+        )
+        ax.set_xlabel("Calibration Gas Concentration")
+        ax.set_ylabel(compound)
+        ax.legend()
+
+        fig.tight_layout()
+
+        self.display.pyplot(fig)
+
+    @monitor.timed("plot.met_plot")
+    @_plots_with_pyplot
     def met_plot(self, analysis_data, kestrel_data):
         """
         Plots the imet and kestrel data
         """
 
+        plt = _load_pyplot()
+
         imet_headers = [
             "Temperature (\u00b0C)",
             "Corrected Wind Direction (\u00b0)",
@@ -167,31 +250,56 @@ class DataVisualization:
 
         # fig_html = mpld3.fig_to_html(fig)
         # st.components.v1.html(fig_html, height=600)
-        st.pyplot(fig)
+        self.display.pyplot(fig)
+
+    @monitor.timed("plot.gps_grid_map")
+    @_plots_with_pyplot
+    def gps_grid_map(self, grid, cell_size, scale):
+        """
+        Plots the gridded GPS fix quality, one square per occupied cell
 
-    # def gps_map(self, df, gdf):
-    #     """
-    #     plots gps data
-    #     """
+        Inputs:
+        - grid: df of aggregated grid cells from DataAnalysisTools.grid_bin
+        - cell_size: width of the grid cells (m)
+        - scale: meters per projected unit, corrects the mercator stretch for the scale bar
+        """
 
-    #     fig, ax = plt.subplots()
-    #     ax.plot(df['GPS Number Of Satellites'])
-    #     st.pyplot(fig)
+        plt = _load_pyplot()
+        from matplotlib.collections import PolyCollection
+        from matplotlib_scalebar.scalebar import ScaleBar
+
+        # corners of every cell square
+        half = cell_size / 2
+        x = grid["x"].to_numpy()
+        y = grid["y"].to_numpy()
+        corners = np.stack(
+            [
+                np.column_stack([x - half, y - half]),
+                np.column_stack([x + half, y - half]),
+                np.column_stack([x + half, y + half]),
+                np.column_stack([x - half, y + half]),
+            ],
+            axis=1,
+        )
 
-    #     # plot
-    #     ax = gdf.plot(markersize=5, column=df['GPS Number Of Satellites'], cmap='viridis', legend=True)
-    #     cx.add_basemap(ax, zoom=15, source=cx.providers.Esri.WorldImagery)
+        panels = [
+            ("Min Satellites", "viridis"),
+            ("Dropouts", "Reds"),
+        ]
 
-    #     # Add scale bar
-    #     scalebar = ScaleBar(1, location='lower right')  # 1 pixel = 1 unit (you can adjust this)
-    #     ax.add_artist(scalebar)
-    #     ax.set_axis_off()
+        fig, axs = plt.subplots(ncols=2, figsize=(12, 6))
+        for ax, (column, cmap) in zip(axs, panels):
+            cells = PolyCollection(corners, array=grid[column].to_numpy(), cmap=cmap)
+            ax.add_collection(cells)
+            ax.autoscale_view()
+            ax.set_aspect("equal")
+            ax.set_axis_off()
+            ax.set_title(column)
+            fig.colorbar(cells, ax=ax, shrink=0.7)
 
-    #     # Label the legend
-    #     ax.legend(title='GPS Number Of Satellites')
+            # add scale bar
+            ax.add_artist(ScaleBar(scale, location="lower right"))
 
-    #     fig.tight_layout()
+        fig.tight_layout()
 
-    #     #fig_html = mpld3.fig_to_html(fig)
-    #     #st.components.v1.html(fig_html, height=600)
-    #     st.pyplot(ax.figure)
+        self.display.pyplot(fig)
@@ -0,0 +1,182 @@
+"""
+Keeps the audit flags in a local SQLite journal so they outlive the session:
+    - Appending every flagged interval with its audit type and inputs
+    - Replaying the flags of an audit day after a refresh or a server restart
+    - Listing the flags of an audit day as an audit trail
+    - Removing the flags of an audit day, or only its last flag, to undo them
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+
+# journal file, can be moved with the AUDIT_FLAG_JOURNAL environment variable
+DEFAULT_JOURNAL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "logs", "flags.sqlite"
+)
+
+# seconds a write waits for another session's write to finish
+JOURNAL_TIMEOUT_S = 10
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS flags (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dataset_hash TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    type TEXT NOT NULL,
+    flag INTEGER NOT NULL,
+    parameters TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS flags_dataset ON flags (dataset_hash, id);
+"""
+
+
+class FlagJournal:
+    """
+    Journal of the flagged intervals, the flags of an audit day are replayed in the order they were made.
+
+    Rows are keyed by the hash of the audit day (ProcessRawFiles.partition_hash), so the same files uploaded again
+    get their flags back.
+    """
+
+    def __init__(self, path=None):
+        """
+        Inputs:
+        - path: SQLite file, None to use the default
+
+        Returns: none
+        """
+
+        self.path = path or os.environ.get("AUDIT_FLAG_JOURNAL", DEFAULT_JOURNAL_PATH)
+        self._ready = False
+
+        # shared by all sessions
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """
+        Opens the journal, creating it the first time
+
+        Returns: sqlite3 connection
+        """
+
+        with self._lock:
+            if not self._ready:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with closing(
+                    sqlite3.connect(self.path, timeout=JOURNAL_TIMEOUT_S)
+                ) as db:
+                    db.executescript(JOURNAL_SCHEMA)
+                self._ready = True
+
+        return sqlite3.connect(self.path, timeout=JOURNAL_TIMEOUT_S)
+
+    def append(self, dataset_hash, start_time, end_time, type, flag, parameters=None):
+        """
+        Records one flagged interval.
+
+        Inputs:
+        - dataset_hash: hash of the audit day
+        - start_time, end_time: localized datetimes of the interval
+        - type: 'zero', 'cal', 'mdl', 'imet'
+        - flag: value written to the Audit Flag column
+        - parameters: dict of the analysis inputs (compound, concentration, ...)
+
+        Returns: none
+        """
+
+        row = (
+            dataset_hash,
+            start_time.isoformat(),
+            end_time.isoformat(),
+            type,
+            int(flag),
+            json.dumps(parameters or {}, default=str),
+            datetime.now().astimezone().isoformat(timespec="seconds"),
+        )
+
+        with closing(self.connect()) as db, db:
+            db.execute(
+                "INSERT INTO flags (dataset_hash, start_time, end_time, type, flag, parameters, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+
+    def history(self, dataset_hash):
+        """
+        Lists the flagged intervals of an audit day, oldest first
+
+        Returns: pandas dataframe
+        """
+
+        with closing(self.connect()) as db:
+            return pd.read_sql_query(
+                "SELECT start_time, end_time, type, flag, parameters, created FROM flags "
+                "WHERE dataset_hash = ? ORDER BY id",
+                db,
+                params=(dataset_hash,),
+            )
+
+    def remove(self, dataset_hash, last_only=False):
+        """
+        Deletes the flagged intervals of an audit day
+
+        Inputs:
+        - dataset_hash: hash of the audit day
+        - last_only: only delete the latest interval
+
+        Returns: number of intervals deleted
+        """
+
+        with closing(self.connect()) as db, db:
+            if last_only:
+                cursor = db.execute(
+                    "DELETE FROM flags WHERE id = (SELECT MAX(id) FROM flags WHERE dataset_hash = ?)",
+                    (dataset_hash,),
+                )
+            else:
+                cursor = db.execute(
+                    "DELETE FROM flags WHERE dataset_hash = ?", (dataset_hash,)
+                )
+
+        return cursor.rowcount
+
+    def replay(self, dataset_hash, df):
+        """
+        Writes the journaled flags of an audit day into the Audit Flag column, later intervals overwrite earlier ones.
+
+        Inputs:
+        - dataset_hash: hash of the audit day
+        - df: display df with an Audit Flag column
+
+        Returns: number of intervals replayed
+        """
+
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                "SELECT start_time, end_time, flag FROM flags WHERE dataset_hash = ? ORDER BY id",
+                (dataset_hash,),
+            ).fetchall()
+
+        for start_time, end_time, flag in rows:
+            df.loc[pd.Timestamp(start_time) : pd.Timestamp(end_time), "Audit Flag"] = (
+                flag
+            )
+
+        return len(rows)
+
+
+@st.cache_resource
+def get_flag_journal():
+    """
+    Returns the flag journal shared by all sessions
+    """
+
+    return FlagJournal()
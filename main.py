@@ -5,10 +5,24 @@ Constructs the UI and pulls in analysis from other files
 import streamlit as st
 from dataHandling import *
 from auditAnalysis import *
+from analysisResults import get_results_cache
+from analysisJobs import get_analysis_jobs
+from flagJournal import get_flag_journal
+from performanceMonitor import monitor
 
 
+# time the stages of this rerun
+monitor.start_run()
+show_performance = st.sidebar.checkbox("Show performance panel")
+
 # initialize necessary classes
 check = CheckInputs()
+results_cache = get_results_cache()
+analysis_jobs = get_analysis_jobs()
+
+# cache keys of the last analysis shown in each tab
+if "analysis_results" not in st.session_state:
+    st.session_state.analysis_results = {}
 
 # make title header
 st.markdown(
@@ -19,38 +33,219 @@ st.markdown(
 # audit_date = st.date_input('Select date of audit.', format='YYYY/MM/DD')
 
 welcome = st.write(
-    "Upload all data files from the audit. Please only upload data of a single type (i.e. all only .csv, all only .dat, or all only .txt)."
+    "Upload all data files from the audit. Please only upload data of a single type (i.e. all only .csv, all only .dat, or all only .txt). "
+    "Files can also be compressed (.gz or .zst) or zipped together (.zip)."
 )
 
 # upload files
+# compressed files are decompressed while they are read
 uploaded_files = st.file_uploader(
-    "Choose a file", accept_multiple_files=True, type=["csv", "dat", "txt"]
+    "Choose a file",
+    accept_multiple_files=True,
+    type=["csv", "dat", "txt", "gz", "zst", "zip"],
 )
 
 if uploaded_files:
+    # files of different instruments (e.g. PTR-MS, iMet and GPS) are joined row by row instead of stacked
+    align_instruments = st.checkbox(
+        "Align instruments on a common timeline",
+        value=False,
+        help="Rows of the other instruments are matched to the instrument with the most rows by the nearest time within a second.",
+    )
+
     # load and merge files
-    files = ProcessRawFiles(uploaded_files)
+    files = ProcessRawFiles(uploaded_files, align_instruments)
+
+    # audit one day (and vehicle) at a time, only that partition is loaded
+    partitions = {
+        files.partition_label(partition): partition for partition in files.partitions
+    }
+    partition = st.selectbox("Audit Day", list(partitions))
+    files.select_partition(partitions[partition])
 
     # once files are merged, show dataframe
     st.write("Uploaded Audit Data")
 
+    # only the page on screen is sent to the browser, the filters run on the server
+    table_view = DataTableView(files.session_state_data)
+    with st.expander("Filter table"):
+        table_start = st.text_input("From (hh&#58;mm)", key="table_start")
+        table_end = st.text_input("To (hh&#58;mm)", key="table_end")
+        table_flag = st.selectbox(
+            "Audit Flag", list(TABLE_FLAG_FILTERS), key="table_flag"
+        )
+        table_columns = st.multiselect(
+            "Columns (all if none are picked)",
+            list(files.session_state_data.columns),
+            key="table_columns",
+        )
+
+    table_times = []
+    for table_time in [table_start, table_end]:
+        if table_time == "":
+            table_times.append(None)
+        elif check.check_time(table_time):
+            table_times.append(
+                DataAnalysisTools().localize_time_inputs(table_time, files.audit_date)
+            )
+        else:
+            st.error(f"Invalid Time Format: {table_time}")
+            table_times.append(None)
+
+    table_rows = table_view.filter_rows(*table_times, TABLE_FLAG_FILTERS[table_flag])
+    page_rows = st.selectbox(
+        "Rows per page", TABLE_PAGE_ROWS, index=1, key="table_page_rows"
+    )
+    pages = max(-(-len(table_rows) // page_rows), 1)
+    page = st.number_input(
+        "Page", min_value=1, max_value=pages, value=1, key="table_page"
+    )
+
     displayed_audit_data = st.dataframe(
-        files.session_state_data, width=800, height=400, use_container_width=True
+        table_view.page(table_rows, min(page, pages) - 1, page_rows, table_columns),
+        width=800,
+        height=400,
+        use_container_width=True,
+    )
+    st.caption(
+        f"Page {min(page, pages)} of {pages}, {len(table_rows)} of {len(files.session_state_data)} rows"
     )
 
+    # memory saved by storing the columns in narrower types
+    if len(files.downcast_report) > 0:
+        with st.expander("Column types"):
+            saved = files.downcast_report["Saved (MB)"].sum()
+            before = files.downcast_report["Before (MB)"].sum()
+            st.write(
+                f"Downcasting saved {saved:.1f} MB of {before:.1f} MB in the converted columns."
+            )
+            st.dataframe(
+                files.downcast_report.round(3),
+                hide_index=True,
+                use_container_width=True,
+            )
+
     st.write("Flag Meanings: 0 = audit zero, 1 = cal gas, 2 = mdl check, 3 = imet")
+
+    # every interval flagged on this audit day, kept after refreshes and restarts
+    with st.expander("Flag history"):
+        flag_history = get_flag_journal().history(files.partition_hash)
+        st.dataframe(
+            flag_history,
+            hide_index=True,
+            use_container_width=True,
+        )
+
+        # the flags are taken off before the rerun, so the table above already shows the rest
+        undo_column, clear_column = st.columns(2)
+        undo_column.button(
+            "Undo last flag",
+            key="undo-flag",
+            disabled=flag_history.empty,
+            on_click=files.clear_flags,
+            kwargs={"last_only": True},
+        )
+        clear_column.button(
+            "Clear flags of this day",
+            key="clear-flags",
+            disabled=flag_history.empty,
+            on_click=files.clear_flags,
+        )
     # download button
     finish = AnalysisFinisher()
 
-    download_button = st.download_button(
-        "Download CSV",
-        *finish.download_csv(st.session_state.dataframe),
-        key="download-csv",
-    )
+    # every audit day of the upload with its flags, only built when asked for so reruns do not pay for it
+    export_key = (files.dataset_hash, st.session_state.get("flag_version", 0))
+    if st.button(
+        "Prepare download",
+        key="prepare-csv",
+        help="Builds a CSV of all audit days of the upload with their flags",
+    ):
+        st.session_state.export_csv = (
+            export_key,
+            finish.download_csv(files.export_data()),
+        )
+
+    # a download prepared before the last flags were added is not offered
+    export_csv = st.session_state.get("export_csv")
+    if export_csv is not None and export_csv[0] == export_key:
+        download_button = st.download_button(
+            "Download CSV",
+            *export_csv[1],
+            key="download-csv",
+        )
+
+    # propose audit windows and fill them into the forms
+    with st.expander("Find audit windows"):
+        detect_form = st.form(key="detect_windows", clear_on_submit=False, border=False)
+        detect_compound = detect_form.text_input(
+            "Compound Name (as it appears in the data)", key="detect_compound"
+        )
+        detect_error = detect_form.empty()
+
+        if detect_form.form_submit_button("Find Windows"):
+            if check.check_compound(detect_compound, files.analysis_data):
+                st.session_state.audit_windows = (
+                    files.partition_hash,
+                    detect_compound,
+                    DataAnalysisTools().detect_windows(
+                        files.analysis_data, detect_compound
+                    ),
+                )
+            else:
+                detect_error.error("Invalid Compound Name")
+
+        # windows found for this audit day
+        detected = st.session_state.get("audit_windows")
+        if detected is not None and detected[0] == files.partition_hash:
+            _, detect_compound, windows = detected
+
+            if len(windows) == 0:
+                st.write("No steady windows found.")
+            else:
+                st.dataframe(windows, hide_index=True, use_container_width=True)
+
+                labels = {
+                    f"{row.Start}-{row.End}, level {row.Level}": row
+                    for row in windows.itertuples()
+                }
+                window = labels[st.selectbox("Window", list(labels))]
+                audits = {
+                    "Zero Air": ("zero_start", "zero_end", "zero_compound"),
+                    "Calibration": ("cal_start", "cal_end", "cal_compound"),
+                    "MDL Spike": ("spike_start", "spike_end", "mdl_compound"),
+                    "MDL Blank": ("blank_start", "blank_end", "mdl_compound"),
+                    "iMet": ("imet_start", "imet_end", None),
+                }
+                suggested = [
+                    audit for audit in audits if window.Suggested.startswith(audit)
+                ]
+                audit = st.selectbox(
+                    "Use for",
+                    list(audits),
+                    index=list(audits).index(suggested[0]) if suggested else 0,
+                )
+
+                if st.button("Fill Form"):
+                    start_key, end_key, compound_key = audits[audit]
+                    st.session_state[start_key] = window.Start
+                    st.session_state[end_key] = window.End
+                    if compound_key is not None:
+                        st.session_state[compound_key] = detect_compound
+                    st.success(
+                        f"Filled the {audit} form with {window.Start}-{window.End}."
+                    )
 
     # audit type tabs
-    zero_air_tab, calibration_tab, mdl_tab, imet_tab, gps_tab = st.tabs(
-        ["Zero Air Audit", "Calibration Audit", "MDL Check", "iMet Audit", "GPS Check"]
+    zero_air_tab, calibration_tab, curve_tab, mdl_tab, imet_tab, gps_tab = st.tabs(
+        [
+            "Zero Air Audit",
+            "Calibration Audit",
+            "Calibration Curve",
+            "MDL Check",
+            "iMet Audit",
+            "GPS Check",
+        ]
     )
 
     # df that gets actively edited throughout
@@ -62,11 +257,15 @@ if uploaded_files:
 
         zero_air_form = st.form(key="zero_air", clear_on_submit=False, border=True)
 
-        start_time = zero_air_form.text_input("Start Time (hh&#58;mm)")
+        start_time = zero_air_form.text_input(
+            "Start Time (hh&#58;mm)", key="zero_start"
+        )
         start_error = zero_air_form.empty()
-        end_time = zero_air_form.text_input("End Time (hh&#58;mm)")
+        end_time = zero_air_form.text_input("End Time (hh&#58;mm)", key="zero_end")
         end_error = zero_air_form.empty()
-        compound = zero_air_form.text_input("Compound Name (as it appears in the data)")
+        compound = zero_air_form.text_input(
+            "Compound Name (as it appears in the data)", key="zero_compound"
+        )
         compound_error = zero_air_form.empty()
 
         submit_button = zero_air_form.form_submit_button("Analyze")
@@ -79,15 +278,27 @@ if uploaded_files:
 
             # if all passes, continue with analysis
             if start_check and end_check and compound_check:
-                # proceed with analysis
-                ZeroAirAnalysis(
+                # proceed with analysis in the background (redisplayed if already computed)
+                key = results_cache.make_key(
+                    files.partition_hash, "zero", start_time, end_time, compound
+                )
+                analysis = ZeroAirAnalysis(
                     start_time,
                     end_time,
                     files.audit_date,
                     compound,
                     files.analysis_data,
                     audit_df,
+                    report=results_cache.get(key),
+                    background=analysis_jobs.submitter(key),
+                    pool=analysis_jobs.pool,
                 )
+                results_cache.put(key, analysis.report)
+                st.session_state.analysis_results["zero"] = key
+
+                # progress of the analysis running in the background
+                if analysis.job is not None:
+                    analysis_jobs.display(key, files.partition_hash)
 
             else:
                 if not start_check:
@@ -97,6 +308,12 @@ if uploaded_files:
                 if not compound_check:
                     compound_error.error("Invalid Compound Name")
 
+        else:
+            # show the last analysis again after reruns, or its progress if it is still running
+            key = st.session_state.analysis_results.get("zero")
+            if not analysis_jobs.display(key, files.partition_hash):
+                results_cache.redisplay(key, files.partition_hash)
+
     # display for calibration tab
     with calibration_tab:
         st.header("Calibration Audit Analysis")
@@ -105,12 +322,14 @@ if uploaded_files:
             key="calibration", clear_on_submit=False, border=True
         )
 
-        start_time = calibration_form.text_input("Start Time (hh&#58;mm)")
+        start_time = calibration_form.text_input(
+            "Start Time (hh&#58;mm)", key="cal_start"
+        )
         start_error = calibration_form.empty()
-        end_time = calibration_form.text_input("End Time (hh&#58;mm)")
+        end_time = calibration_form.text_input("End Time (hh&#58;mm)", key="cal_end")
         end_error = calibration_form.empty()
         compound = calibration_form.text_input(
-            "Compound Name (as it appears in the data)"
+            "Compound Name (as it appears in the data)", key="cal_compound"
         )
         compound_error = calibration_form.empty()
         gas_concentration = calibration_form.number_input(
@@ -128,8 +347,16 @@ if uploaded_files:
 
             # if all passes, continue with analysis
             if start_check and end_check and compound_check:
-                # proceed with analysis
-                CalGasAnalysis(
+                # proceed with analysis in the background (redisplayed if already computed)
+                key = results_cache.make_key(
+                    files.partition_hash,
+                    "cal",
+                    start_time,
+                    end_time,
+                    compound,
+                    gas_concentration,
+                )
+                analysis = CalGasAnalysis(
                     start_time,
                     end_time,
                     files.audit_date,
@@ -137,7 +364,16 @@ if uploaded_files:
                     gas_concentration,
                     files.analysis_data,
                     audit_df,
+                    report=results_cache.get(key),
+                    background=analysis_jobs.submitter(key),
+                    pool=analysis_jobs.pool,
                 )
+                results_cache.put(key, analysis.report)
+                st.session_state.analysis_results["cal"] = key
+
+                # progress of the analysis running in the background
+                if analysis.job is not None:
+                    analysis_jobs.display(key, files.partition_hash)
 
             else:
                 if not start_check:
@@ -147,27 +383,146 @@ if uploaded_files:
                 if not compound_check:
                     compound_error.error("Invalid Compound Name")
 
+        else:
+            # show the last analysis again after reruns, or its progress if it is still running
+            key = st.session_state.analysis_results.get("cal")
+            if not analysis_jobs.display(key, files.partition_hash):
+                results_cache.redisplay(key, files.partition_hash)
+
+    # display for multi-point calibration tab
+    with curve_tab:
+        st.header("Calibration Curve Analysis")
+
+        curve_form = st.form(
+            key="calibration_curve", clear_on_submit=False, border=True
+        )
+
+        # one row per calibration gas level, e.g. a zero and 4-6 concentrations
+        levels_df = curve_form.data_editor(
+            pd.DataFrame(
+                {
+                    "Start Time (hh:mm)": pd.Series(dtype=str),
+                    "End Time (hh:mm)": pd.Series(dtype=str),
+                    "Concentration": pd.Series(dtype=float),
+                }
+            ),
+            num_rows="dynamic",
+            use_container_width=True,
+            key="curve_levels",
+        )
+        levels_error = curve_form.empty()
+        curve_compounds = curve_form.multiselect(
+            "Compounds (as they appear in the data)",
+            list(files.analysis_data.columns),
+            key="curve_compounds",
+        )
+        curve_compounds_error = curve_form.empty()
+
+        submit_button = curve_form.form_submit_button("Analyze")
+
+        if submit_button:
+            # check that the inputs are valid
+            levels = [
+                (str(row[0]).strip(), str(row[1]).strip(), row[2])
+                for row in levels_df.itertuples(index=False)
+            ]
+            levels_check = (
+                len(levels) >= 2
+                and all(
+                    check.check_time(start_time)
+                    and check.check_time(end_time)
+                    and pd.notna(concentration)
+                    and concentration >= 0
+                    for start_time, end_time, concentration in levels
+                )
+                and len({concentration for _, _, concentration in levels}) >= 2
+            )
+            compounds_check = len(curve_compounds) > 0
+
+            # if all passes, continue with analysis
+            if levels_check and compounds_check:
+                # proceed with analysis in the background (redisplayed if already computed)
+                key = results_cache.make_key(
+                    files.partition_hash,
+                    "cal_curve",
+                    tuple(levels),
+                    tuple(curve_compounds),
+                )
+                analysis = MultiPointCalAnalysis(
+                    levels,
+                    files.audit_date,
+                    curve_compounds,
+                    files.analysis_data,
+                    audit_df,
+                    report=results_cache.get(key),
+                    background=analysis_jobs.submitter(key),
+                    pool=analysis_jobs.pool,
+                )
+                results_cache.put(key, analysis.report)
+                st.session_state.analysis_results["cal_curve"] = key
+
+                # progress of the analysis running in the background
+                if analysis.job is not None:
+                    analysis_jobs.display(key, files.partition_hash)
+
+            else:
+                if not levels_check:
+                    levels_error.error(
+                        "Enter at least two levels with different concentrations, each with a valid start "
+                        "and end time (hh:mm) and a concentration of 0 or more"
+                    )
+                if not compounds_check:
+                    curve_compounds_error.error("Pick at least one compound")
+
+        else:
+            # show the last analysis again after reruns, or its progress if it is still running
+            key = st.session_state.analysis_results.get("cal_curve")
+            if not analysis_jobs.display(key, files.partition_hash):
+                results_cache.redisplay(key, files.partition_hash)
+
     # display for mdl check tab
     with mdl_tab:
         st.header("MDL Check Analysis")
 
         mdl_form = st.form(key="mdl_form", clear_on_submit=False, border=True)
 
-        spike_start_time = mdl_form.text_input("Spike Start Time (hh&#58;mm)")
+        spike_start_time = mdl_form.text_input(
+            "Spike Start Time (hh&#58;mm)", key="spike_start"
+        )
         spike_start_error = mdl_form.empty()
-        spike_end_time = mdl_form.text_input("Spike End Time (hh&#58;mm)")
+        spike_end_time = mdl_form.text_input(
+            "Spike End Time (hh&#58;mm)", key="spike_end"
+        )
         spike_end_error = mdl_form.empty()
-        blank_start_time = mdl_form.text_input("Blank Start Time (hh&#58;mm)")
+        blank_start_time = mdl_form.text_input(
+            "Blank Start Time (hh&#58;mm)", key="blank_start"
+        )
         blank_start_error = mdl_form.empty()
-        blank_end_time = mdl_form.text_input("Blank End Time (hh&#58;mm)")
+        blank_end_time = mdl_form.text_input(
+            "Blank End Time (hh&#58;mm)", key="blank_end"
+        )
         blank_end_error = mdl_form.empty()
-        compound = mdl_form.text_input("Compound Name (as it appears in the data)")
+        compound = mdl_form.text_input(
+            "Compound Name (as it appears in the data)", key="mdl_compound"
+        )
         compound_error = mdl_form.empty()
         time_averaging = mdl_form.radio(
             "Apply time averaging?",
-            options=["None", "1 minute", "5 minutes"],
+            options=list(TIME_BINS),
             horizontal=True,  # This makes the options appear in a row
         )
+        # batch mode, the MDL of several compounds with the same spike and blank in one table
+        batch = mdl_form.checkbox(
+            "Batch: compute the MDL of every compound below instead", key="mdl_batch"
+        )
+        with mdl_form.expander("Batch compounds"):
+            batch_compounds = st.multiselect(
+                "Compounds",
+                list(files.analysis_data.columns),
+                default=DataAnalysisTools().compound_columns(files.analysis_data),
+                key="mdl_batch_compounds",
+            )
+        batch_error = mdl_form.empty()
 
         submit_button = mdl_form.form_submit_button("Analyze")
 
@@ -177,7 +532,10 @@ if uploaded_files:
             spike_end_check = check.check_time(spike_end_time)
             blank_start_check = check.check_time(blank_start_time)
             blank_end_check = check.check_time(blank_end_time)
-            compound_check = check.check_compound(compound, files.analysis_data)
+            compound_check = batch or check.check_compound(
+                compound, files.analysis_data
+            )
+            batch_check = not batch or len(batch_compounds) > 0
 
             # if all passes, continue with analysis
             if (
@@ -186,19 +544,65 @@ if uploaded_files:
                 and blank_start_check
                 and blank_end_check
                 and compound_check
+                and batch_check
             ):
-                # proceed with analysis
-                MDLCheckAnalysis(
-                    spike_start_time,
-                    spike_end_time,
-                    blank_start_time,
-                    blank_end_time,
-                    time_averaging,
-                    files.audit_date,
-                    compound,
-                    files.analysis_data,
-                    audit_df,
-                )
+                # proceed with analysis in the background (redisplayed if already computed)
+                if batch:
+                    key = results_cache.make_key(
+                        files.partition_hash,
+                        "mdl_batch",
+                        spike_start_time,
+                        spike_end_time,
+                        blank_start_time,
+                        blank_end_time,
+                        time_averaging,
+                        tuple(batch_compounds),
+                    )
+                    analysis = BatchMDLAnalysis(
+                        spike_start_time,
+                        spike_end_time,
+                        blank_start_time,
+                        blank_end_time,
+                        time_averaging,
+                        files.audit_date,
+                        batch_compounds,
+                        files.analysis_data,
+                        audit_df,
+                        report=results_cache.get(key),
+                        background=analysis_jobs.submitter(key),
+                        pool=analysis_jobs.pool,
+                    )
+                else:
+                    key = results_cache.make_key(
+                        files.partition_hash,
+                        "mdl",
+                        spike_start_time,
+                        spike_end_time,
+                        blank_start_time,
+                        blank_end_time,
+                        time_averaging,
+                        compound,
+                    )
+                    analysis = MDLCheckAnalysis(
+                        spike_start_time,
+                        spike_end_time,
+                        blank_start_time,
+                        blank_end_time,
+                        time_averaging,
+                        files.audit_date,
+                        compound,
+                        files.analysis_data,
+                        audit_df,
+                        report=results_cache.get(key),
+                        background=analysis_jobs.submitter(key),
+                        pool=analysis_jobs.pool,
+                    )
+                results_cache.put(key, analysis.report)
+                st.session_state.analysis_results["mdl"] = key
+
+                # progress of the analysis running in the background
+                if analysis.job is not None:
+                    analysis_jobs.display(key, files.partition_hash)
 
             else:
                 if not spike_start_check:
@@ -211,21 +615,30 @@ if uploaded_files:
                     blank_end_error.error("Invalid End Time")
                 if not compound_check:
                     compound_error.error("Invalid Compound Name")
+                if not batch_check:
+                    batch_error.error("Pick at least one batch compound")
+
+        else:
+            # show the last analysis again after reruns, or its progress if it is still running
+            key = st.session_state.analysis_results.get("mdl")
+            if not analysis_jobs.display(key, files.partition_hash):
+                results_cache.redisplay(key, files.partition_hash)
 
     with imet_tab:
         st.header("iMet Audit Analysis")
 
         imet_form = st.form(key="imet_form", clear_on_submit=False, border=True)
 
-        start_time = imet_form.text_input("Start Time (hh&#58;mm)")
+        start_time = imet_form.text_input("Start Time (hh&#58;mm)", key="imet_start")
         error_start = imet_form.empty()
-        end_time = imet_form.text_input("End Time (hh&#58;mm)")
+        end_time = imet_form.text_input("End Time (hh&#58;mm)", key="imet_end")
         error_end = imet_form.empty()
 
         # upload for kestrel data
         uploaded_file = imet_form.file_uploader(
             "Upload met data for comparison", type=["csv"], key="uploaded_file"
         )
+        upload_error = imet_form.empty()
         if uploaded_file:
             # read in the uploaded file
             kestrel_df = pd.read_csv(uploaded_file, skiprows=[0, 1, 2, 4])
@@ -236,35 +649,80 @@ if uploaded_files:
             # check that the inputs are valid
             start_check = check.check_time(start_time)
             end_check = check.check_time(end_time)
+            upload_check = uploaded_file is not None
 
             # if all passes, continue with analysis
-            if start_check and end_check:
-                # proceed with analysis
-                print("proceeding with analysis")
-                iMetAnalysis(
+            if start_check and end_check and upload_check:
+                # proceed with analysis in the background
+                key = results_cache.make_key(
+                    files.partition_hash,
+                    "imet",
+                    start_time,
+                    end_time,
+                    files.hash_uploaded_files([uploaded_file]),
+                )
+                analysis = iMetAnalysis(
                     start_time,
                     end_time,
                     files.audit_date,
                     kestrel_df,
                     files.analysis_data,
                     audit_df,
+                    report=results_cache.get(key),
+                    background=analysis_jobs.submitter(key),
+                    pool=analysis_jobs.pool,
                 )
+                results_cache.put(key, analysis.report)
+                st.session_state.analysis_results["imet"] = key
+
+                # progress of the analysis running in the background
+                if analysis.job is not None:
+                    analysis_jobs.display(key, files.partition_hash)
 
             else:
                 if not start_check:
-                    start_error.error("Invalid Start Time")
+                    error_start.error("Invalid Start Time")
                 if not end_check:
-                    end_error.error("Invalid End Time")
+                    error_end.error("Invalid End Time")
+                if not upload_check:
+                    upload_error.error("Upload the met data to compare with")
+
+        else:
+            # show the last analysis again after reruns, or its progress if it is still running
+            key = st.session_state.analysis_results.get("imet")
+            if not analysis_jobs.display(key, files.partition_hash):
+                results_cache.redisplay(key, files.partition_hash)
 
     with gps_tab:
         st.header("GPS Check Analysis")
 
-        st.write("GPS section under development. No data to display.")
+        gps_form = st.form(key="gps_form", clear_on_submit=False, border=True)
 
-        # analyze_button = st.button('View GPS Analysis')
+        cell_size = gps_form.number_input(
+            "Grid Cell Size (m)", min_value=10, value=250, step=10
+        )
+        min_satellites = gps_form.number_input(
+            "Minimum Satellites for a Good Fix", min_value=1, value=4, step=1
+        )
+        gps_error = gps_form.empty()
 
-        # if analyze_button:
-        #     GPSCheck(files.analysis_data)
+        submit_button = gps_form.form_submit_button("Analyze")
+
+        if submit_button:
+            # check that the GPS columns are in the data
+            gps_check = all(
+                check.check_compound(header, files.analysis_data)
+                for header in [
+                    "GPS Number Of Satellites",
+                    "GPS Latitude (\u00b0N)",
+                    "GPS Longitude (\u00b0E)",
+                ]
+            )
+
+            if gps_check:
+                GPSCheck(files.analysis_data, cell_size, min_satellites)
+            else:
+                gps_error.error("No GPS data in the uploaded files")
 
     # st.write('Press the Finish Analsyis button to end the analysis of this data.')
 
@@ -272,3 +730,7 @@ if uploaded_files:
     # if end_button:
     #     # end the analysis
     #     files.end_analysis(finish.display_data)
+
+# stage timings of this rerun
+if show_performance:
+    monitor.display_panel()
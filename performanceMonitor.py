@@ -0,0 +1,374 @@
+"""
+Timing and memory use of the pipeline stages:
+    - Recording nested timing spans around stages
+    - Optionally recording peak and retained memory of each span
+    - Writing the spans to a JSON lines log
+    - Showing the spans of the last run in the sidebar
+"""
+
+import os
+import json
+import time
+import uuid
+import platform
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+import streamlit as st
+
+# log file, can be moved with the AUDIT_PERFORMANCE_LOG environment variable
+DEFAULT_LOG_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "logs", "performance.jsonl"
+)
+
+# how often the resident memory is sampled while memory tracking is on
+RSS_SAMPLE_INTERVAL_S = 0.005
+
+MB = 1024**2
+
+# the log is moved to <log>.1 once it is this big, so at most twice this is kept on disk
+LOG_MAX_BYTES = 20 * MB
+
+
+def current_rss():
+    """
+    Resident memory of the process in bytes.
+
+    Reads /proc on Linux, elsewhere falls back to the peak resident memory of the process (0 on Windows, which
+    has neither).
+    """
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        # unix only
+        import resource
+    except ImportError:
+        return 0
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if platform.system() == "Darwin" else max_rss * 1024
+
+
+class PerformanceMonitor:
+    """
+    Records how long each stage of the pipeline takes.
+
+    Spans are kept per thread, so every streamlit session only sees the spans of its own script run.
+
+    Memory tracking is off by default since tracemalloc slows everything down. When it is on, each span
+    also records the peak and retained Python allocations (tracemalloc) and the peak resident memory
+    (sampled in a background thread), so native allocations from polars and arrow show up as well.
+    """
+
+    def __init__(self, log_path=None, track_memory=None):
+        """
+        Inputs:
+        - log_path: JSON lines file the spans are appended to, None to use the default
+        - track_memory: record memory of each span, None to use the AUDIT_MEMORY_PROFILE environment variable
+
+        Returns: none
+        """
+
+        self.log_path = log_path or os.environ.get(
+            "AUDIT_PERFORMANCE_LOG", DEFAULT_LOG_PATH
+        )
+
+        self._local = threading.local()
+        self._log_lock = threading.Lock()
+        self._log_file = None
+
+        # spans of all threads that are sampling resident memory
+        self._rss_spans = []
+        self._rss_lock = threading.Lock()
+        self._rss_sampler = None
+        self._rss_stop = None
+
+        if track_memory is None:
+            track_memory = os.environ.get("AUDIT_MEMORY_PROFILE", "") not in ["", "0"]
+        self.track_memory = False
+        self.set_memory_tracking(track_memory)
+
+    def set_memory_tracking(self, track_memory):
+        """
+        Turns memory tracking on or off for the whole process
+
+        Inputs:
+        - track_memory: True/False
+        """
+
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not track_memory and self.track_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        self.track_memory = track_memory
+
+        if track_memory and self._rss_sampler is None:
+            self._rss_stop = threading.Event()
+            self._rss_sampler = threading.Thread(
+                target=self._sample_rss,
+                args=(self._rss_stop,),
+                name="rss-sampler",
+                daemon=True,
+            )
+            self._rss_sampler.start()
+        elif not track_memory and self._rss_sampler is not None:
+            # the sampler stops at its next wake up
+            self._rss_stop.set()
+            self._rss_sampler = None
+
+    def start_run(self):
+        """
+        Starts a new script run, forgetting the spans of the previous run in this thread
+
+        Returns: run id
+        """
+
+        self._local.run_id = uuid.uuid4().hex[:12]
+        self._local.spans = []
+        self._local.stack = []
+
+        return self._local.run_id
+
+    @property
+    def spans(self):
+        """
+        Spans recorded in this thread since the run started
+        """
+
+        return getattr(self._local, "spans", [])
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Times the code in the with block.
+
+        Inputs:
+        - name: name of the stage
+        - attributes: extra values to record with the span (file name, rows...)
+
+        Returns: the span record, attributes can be added to it inside the with block
+        """
+
+        if not hasattr(self._local, "spans"):
+            self.start_run()
+
+        stack = self._local.stack
+        record = {
+            "run": self._local.run_id,
+            "name": name,
+            "parent": stack[-1]["name"] if stack else None,
+            "depth": len(stack),
+            "start": time.time(),
+        }
+        record.update(attributes)
+
+        memory = self.track_memory and tracemalloc.is_tracing()
+        if memory:
+            self._start_memory(record, stack)
+
+        stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["duration_s"] = round(time.perf_counter() - start, 6)
+            stack.pop()
+            if memory:
+                self._end_memory(record, stack)
+            self._local.spans.append(record)
+            self._write(record)
+
+    def _start_memory(self, record, stack):
+        """
+        Marks the memory at the start of a span.
+
+        tracemalloc has a single peak per process, so it is reset for every span and the peak seen so far is
+        handed to the parent span to keep. Spans of other threads (background analyses) open at the same time
+        reset it too and count each other's allocations, all of them only record the resident memory.
+        """
+
+        traced, peak = tracemalloc.get_traced_memory()
+        if stack and "_traced_peak" in stack[-1]:
+            stack[-1]["_traced_peak"] = max(stack[-1]["_traced_peak"], peak)
+        tracemalloc.reset_peak()
+
+        record["_thread"] = threading.get_ident()
+        record["_traced_start"] = traced
+        record["_traced_peak"] = 0
+        record["_rss_start"] = record["_rss_peak"] = current_rss()
+
+        with self._rss_lock:
+            self._rss_spans.append(record)
+            if len({span["_thread"] for span in self._rss_spans}) > 1:
+                for span in self._rss_spans:
+                    span["_overlapped"] = True
+
+    def _end_memory(self, record, stack):
+        """
+        Records the peak and retained memory of a span, in MB above the memory at its start
+        """
+
+        with self._rss_lock:
+            self._rss_spans.remove(record)
+
+        record.pop("_thread")
+        overlapped = record.pop("_overlapped", False)
+
+        if not tracemalloc.is_tracing():
+            # tracking was turned off during the span
+            for key in ["_traced_start", "_traced_peak", "_rss_start", "_rss_peak"]:
+                record.pop(key)
+            return
+
+        traced, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, record.pop("_traced_peak"))
+        if stack and "_traced_peak" in stack[-1]:
+            stack[-1]["_traced_peak"] = max(stack[-1]["_traced_peak"], peak)
+
+        traced_start = record.pop("_traced_start")
+        rss_start = record.pop("_rss_start")
+        rss = current_rss()
+        rss_peak = max(record.pop("_rss_peak"), rss)
+
+        if overlapped:
+            # tracemalloc counted other threads' allocations
+            record["memory_overlapped"] = True
+        else:
+            record["peak_mb"] = round((peak - traced_start) / MB, 2)
+            record["retained_mb"] = round((traced - traced_start) / MB, 2)
+        record["rss_peak_mb"] = round((rss_peak - rss_start) / MB, 2)
+        record["rss_retained_mb"] = round((rss - rss_start) / MB, 2)
+        record["rss_mb"] = round(rss / MB, 1)
+
+    def _sample_rss(self, stop):
+        """
+        Background thread that keeps the peak resident memory of every open span up to date, until stop is set
+        """
+
+        while not stop.wait(RSS_SAMPLE_INTERVAL_S):
+            if not self._rss_spans:
+                continue
+
+            rss = current_rss()
+            with self._rss_lock:
+                for record in self._rss_spans:
+                    record["_rss_peak"] = max(record["_rss_peak"], rss)
+
+    def annotate(self, **attributes):
+        """
+        Adds attributes to the innermost open span of this thread (e.g. loop iterations)
+        """
+
+        stack = getattr(self._local, "stack", [])
+        if stack:
+            stack[-1].update(attributes)
+
+    def timed(self, name):
+        """
+        Decorator that records a span around every call of a function
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _write(self, record):
+        """
+        Appends a span to the JSON lines log, the file stays open between spans
+        """
+
+        line = json.dumps(record, default=str) + "\n"
+        try:
+            with self._log_lock:
+                if self._log_file is None:
+                    os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                    # line buffered, every span is on disk once written
+                    self._log_file = open(self.log_path, "a", buffering=1)
+
+                self._log_file.write(line)
+
+                if self._log_file.tell() > LOG_MAX_BYTES:
+                    # rotate, the previous older log is replaced
+                    self._log_file.close()
+                    self._log_file = None
+                    os.replace(self.log_path, f"{self.log_path}.1")
+        except OSError:
+            # a read only deployment still runs, just without the log
+            pass
+
+    def display_panel(self):
+        """
+        Shows the spans of this run in the sidebar
+        """
+
+        st.sidebar.header("Performance")
+
+        track_memory = st.sidebar.checkbox(
+            "Track memory (slower)",
+            value=self.track_memory,
+            help="Records peak and retained memory of each stage for every session until turned off.",
+        )
+        if track_memory != self.track_memory:
+            self.set_memory_tracking(track_memory)
+
+        if track_memory and st.sidebar.button("Profile ingest again"):
+            # imported here, dataHandling imports this module
+            from dataHandling import ProcessRawFiles
+
+            # drop only the merged data so ingest runs with tracking on, the results, jobs and flag journal stay
+            ProcessRawFiles.load_and_merge_data.clear()
+            st.rerun()
+
+        spans = self.spans
+        if not spans:
+            st.sidebar.write("No stages ran in this rerun.")
+            return
+
+        # spans finish child first, show them in the order they started
+        spans_df = pd.DataFrame(sorted(spans, key=lambda span: span["start"]))
+        spans_df["Stage"] = [
+            "\u00a0\u00a0" * depth + name
+            for depth, name in zip(spans_df["depth"], spans_df["name"])
+        ]
+        spans_df["ms"] = (spans_df["duration_s"] * 1000).round(1)
+
+        details = [
+            column
+            for column in spans_df.columns
+            if column
+            not in [
+                "run",
+                "name",
+                "parent",
+                "depth",
+                "start",
+                "duration_s",
+                "Stage",
+                "ms",
+            ]
+        ]
+        st.sidebar.dataframe(
+            spans_df[["Stage", "ms"] + details],
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.sidebar.caption(f"Spans are also written to {self.log_path}")
+
+
+# shared by all modules
+monitor = PerformanceMonitor()
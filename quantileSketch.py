@@ -0,0 +1,147 @@
+"""
+Approximate quantiles in bounded memory (KLL sketch):
+    - Adding values in chunks, e.g. one audit day at a time
+    - Merging the sketches of different days or workers
+    - Reading quantiles with a known rank error
+"""
+
+import numpy as np
+
+# sketch size, the rank error of a quantile is below 1.65% of the values with 99% confidence at k=200
+# (halving the error takes about twice the k)
+SKETCH_K = 200
+
+# values added to the sketch at a time, so a long series is never copied or sorted whole
+SKETCH_CHUNK = 65536
+
+# capacity of each lower level of the sketch relative to the one above
+LEVEL_RATIO = 2 / 3
+
+
+class QuantileSketch:
+    """
+    KLL sketch (Karnin, Lang and Liberty, 2016) of a stream of values.
+
+    Level h keeps values that stand for 2^h values each; a full level is sorted and every other value moves
+    up a level. The sketch holds O(k) values whatever the number of values added.
+    """
+
+    def __init__(self, k=SKETCH_K, seed=None):
+        """
+        Inputs:
+        - k: size of the top level, sets memory and error
+        - seed: seed of the random compaction offsets, for repeatable quantiles
+
+        Returns: none
+        """
+
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self._random = np.random.default_rng(seed)
+
+    @classmethod
+    def from_values(cls, values, k=SKETCH_K, seed=None):
+        """
+        Builds a sketch of an array or series
+
+        Returns: QuantileSketch
+        """
+
+        sketch = cls(k, seed)
+        values = np.asarray(values, dtype=np.float64)
+        for start in range(0, len(values), SKETCH_CHUNK):
+            sketch.update(values[start : start + SKETCH_CHUNK])
+
+        return sketch
+
+    def capacity(self, level):
+        """
+        Values level can hold before it is compacted
+        """
+
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * LEVEL_RATIO**depth)), 2)
+
+    def update(self, values):
+        """
+        Adds values to the sketch, NaNs are skipped.
+
+        Inputs:
+        - values: array of floats
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        """
+        Adds the values of another sketch, e.g. of another audit day
+
+        Inputs:
+        - other: QuantileSketch
+        """
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, values in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], values])
+
+        self.count += other.count
+        self._compress()
+
+    def _compress(self):
+        """
+        Compacts full levels until the sketch is within its capacity
+        """
+
+        while sum(len(values) for values in self.levels) > sum(
+            self.capacity(level) for level in range(len(self.levels))
+        ):
+            for level, values in enumerate(self.levels):
+                if len(values) >= self.capacity(level):
+                    break
+
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+
+            values = np.sort(values)
+            # an odd value out stays on its level
+            keep = values[: len(values) % 2]
+            paired = values[len(values) % 2 :]
+            # a random half stands for both, so the ranks are unbiased
+            promoted = paired[self._random.integers(2) :: 2]
+
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def quantile(self, q):
+        """
+        Approximate quantiles, the rank error is bounded as described at SKETCH_K
+
+        Inputs:
+        - q: quantile or list of quantiles in [0, 1]
+
+        Returns: float or numpy array, NaN for an empty sketch
+        """
+
+        q = np.asarray(q, dtype=np.float64)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)[()]
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(len(values), 2**level) for level, values in enumerate(self.levels)]
+        )
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        ranks = np.cumsum(weights[order])
+
+        # first value whose rank reaches the quantile
+        index = np.searchsorted(ranks, q * ranks[-1], side="left")
+
+        return values[np.minimum(index, len(values) - 1)][()]